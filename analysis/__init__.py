@@ -1,13 +1,48 @@
 """
-Analysis package initialization
+Analysis package initialization. The visualization module, which imports
+ matplotlib and seaborn, is only imported when a plot is rendered or one
+ of its names is accessed
 """
+import importlib
 import logging
+from typing import TYPE_CHECKING, Any, Iterator, Optional
 import pandas as pd
-from analysis.analysis import analyze_dataframe, find_missing_values
-from analysis.visualization import plot_count, plot_distribution, \
-    boxplot_dist, plot_scatter, plot_heatmap
+from analysis.analysis import analyze_dataframe, report_profile
+from analysis.cube import SalesCube, load_cube
+from analysis.segmentation import abc_classes, rfm_scores, save_segments, \
+    segment_table
+from analysis.stats_cache import STATS, StatsCache
+from analysis.summary import SummaryAccumulator
+
+if TYPE_CHECKING:
+    from analysis.visualization import PlotTask
 
 logger: logging.Logger = logging.getLogger(__name__)
+PLOT_FREQUENCIES: dict[str, list[str]] = {
+    'scatter': ['Monto_Facturado $', 'ID_Territorio', 'ID_Cliente'],
+    'count': ['Cantidad_Facturada', 'Monto_Facturado $', 'ID_Territorio'],
+    'territory_box': ['Monto_Facturado $', 'ID_Territorio'],
+    'family_box': ['Monto_Facturado $', 'Familia_SKU']}
+CONTINUOUS_COLUMNS: list[str] = ['Cantidad_Facturada', 'Monto_Facturado $']
+LAZY_NAMES: dict[str, str] = {
+    name: 'analysis.visualization' for name in [
+        'PlotTask', 'plot_count', 'plot_distribution', 'boxplot_dist',
+        'plot_scatter', 'plot_heatmap', 'render_plots']}
+
+
+def __getattr__(name: str) -> Any:
+    """
+    Import the module of a lazily exported name on its first access
+    :param name: Name of the attribute
+    :type name: str
+    :return: The attribute
+    :rtype: Any
+    """
+    if name not in LAZY_NAMES:
+        raise AttributeError(f'module {__name__} has no attribute {name}')
+    value: Any = getattr(importlib.import_module(LAZY_NAMES[name]), name)
+    globals()[name] = value
+    return value
 
 
 def numerical_eda(dataframe: pd.DataFrame) -> pd.DataFrame:
@@ -15,33 +50,157 @@ def numerical_eda(dataframe: pd.DataFrame) -> pd.DataFrame:
     EDA based on numerical values for dataset
     :param dataframe: Dataframe to analyze
     :type dataframe: pd.DataFrame
-    :return: The dataframe without missing values
+    :return: The analyzed dataframe
     :rtype: pd.DataFrame
     """
     logger.info("Running Exploratory Data Analysis")
     analyze_dataframe(dataframe)
-    # dataframe = find_missing_values(dataframe)
     return dataframe
 
 
-def visualize_data(dataframe: pd.DataFrame) -> None:
+def _distribution_task(
+        dataframe: pd.DataFrame, column: str, color: str
+) -> 'PlotTask':
+    """
+    Distribution plot task of a column from its cached value counts
+    :param dataframe: Dataframe to visualize
+    :type dataframe: pd.DataFrame
+    :param column: Name of the column
+    :type column: str
+    :param color: Color of the plot
+    :type color: str
+    :return: The plot task
+    :rtype: PlotTask
+    """
+    counts: pd.Series = STATS.value_counts(dataframe, column)
+    counts = counts[counts.index.notna()].sort_index()
+    return 'plot_distribution', pd.Series(counts.index, name=column), (
+        color,), {'weights': counts.to_numpy()}
+
+
+def _data_tasks(dataframe: pd.DataFrame) -> Iterator['PlotTask']:
+    """
+    Plot tasks of the dataframe built from the statistics cache, so the
+     plots share the correlation, value counts and frequencies computed
+     by the EDA instead of scanning the rows again
+    :param dataframe: Dataframe to visualize
+    :type dataframe: pd.DataFrame
+    :return: Generator of plot tasks
+    :rtype: Iterator[PlotTask]
+    """
+    correlation: pd.DataFrame = STATS.corr(dataframe)
+    yield 'plot_heatmap', pd.DataFrame(), (), {'correlation': correlation}
+    yield 'plot_scatter', STATS.frequency(
+        dataframe, PLOT_FREQUENCIES['scatter']), (
+        'Monto_Facturado $', 'ID_Territorio', 'ID_Cliente'), {
+        'correlation': correlation, 'weights': 'count'}
+    for column, color in [('ID_Cliente', 'lightskyblue'),
+                          ('ID_Territorio', 'palegreen'),
+                          ('ID_Bodega', 'coral')]:
+        yield _distribution_task(dataframe, column, color)
+    yield 'plot_count', STATS.frequency(
+        dataframe, PLOT_FREQUENCIES['count']), (
+        ['Cantidad_Facturada', 'Monto_Facturado $'], 'ID_Territorio'), {
+        'weights': 'count'}
+    yield _distribution_task(dataframe, 'ID_SKU', 'palegreen')
+    yield 'boxplot_dist', STATS.frequency(
+        dataframe, PLOT_FREQUENCIES['territory_box']), (
+        'Monto_Facturado $', 'ID_Territorio'), {'weights': 'count'}
+    yield 'boxplot_dist', STATS.frequency(
+        dataframe, PLOT_FREQUENCIES['family_box']), (
+        'Monto_Facturado $', 'Familia_SKU'), {'weights': 'count'}
+    # plot_distribution(dataframe['Familia_SKU'], 'lightskyblue')
+
+
+def visualize_data(
+        dataframe: pd.DataFrame, batch: bool = False,
+        workers: Optional[int] = None, refresh_cache: bool = False
+) -> None:
     """
     Basic visualization of the dataframe
     :param dataframe: Dataframe to visualize
     :type dataframe: pd.DataFrame
+    :param batch: Whether to render headless over a process pool. The
+     default is False
+    :type batch: bool
+    :param workers: Number of processes for batch mode. The default is
+     None (number of CPUs)
+    :type workers: int
+    :param refresh_cache: Whether to render the figures even if they are
+     unchanged. The default is False
+    :type refresh_cache: bool
     :return: None
     :rtype: NoneType
     """
+    from analysis.visualization import render_plots
     logger.info("Running visualization")
-    plot_heatmap(dataframe)
-    plot_scatter(dataframe, 'Monto_Facturado $', 'ID_Territorio', 'ID_Cliente')
-    plot_distribution(dataframe['ID_Cliente'], 'lightskyblue')
-    plot_distribution(dataframe['ID_Territorio'], 'palegreen')
-    plot_distribution(dataframe['ID_Bodega'], 'coral')
-    plot_count(
-        dataframe, ['Cantidad_Facturada', 'Monto_Facturado $'],
-        'ID_Territorio')
-    plot_distribution(dataframe['ID_SKU'], 'palegreen')
-    boxplot_dist(dataframe, 'Monto_Facturado $', 'ID_Territorio')
-    boxplot_dist(dataframe, 'Monto_Facturado $', 'Familia_SKU')
-    # plot_distribution(dataframe['Familia_SKU'], 'lightskyblue')
+    render_plots(_data_tasks(dataframe), batch, workers, refresh_cache)
+    logger.info("Statistics cache usage: %s", STATS.info())
+
+
+def summarize_eda(accumulator: SummaryAccumulator) -> None:
+    """
+    EDA based on the accumulated statistics of a streaming run
+    :param accumulator: Statistics accumulated over every chunk
+    :type accumulator: SummaryAccumulator
+    :return: None
+    :rtype: NoneType
+    """
+    logger.info("Running Exploratory Data Analysis from summaries")
+    report_profile(accumulator.profiler)
+
+
+def _summary_tasks(
+        accumulator: SummaryAccumulator
+) -> Iterator['PlotTask']:
+    """
+    Plot tasks of a streaming run built from the accumulated frequencies
+    :param accumulator: Statistics accumulated over every chunk
+    :type accumulator: SummaryAccumulator
+    :return: Generator of plot tasks
+    :rtype: Iterator[PlotTask]
+    """
+    correlation: pd.DataFrame = accumulator.corr()
+    yield 'plot_heatmap', pd.DataFrame(), (), {'correlation': correlation}
+    yield 'plot_scatter', accumulator.frequency('scatter'), (
+        'Monto_Facturado $', 'ID_Territorio', 'ID_Cliente'), {
+        'correlation': correlation, 'weights': 'count'}
+    for column, color in [('ID_Cliente', 'lightskyblue'),
+                          ('ID_Territorio', 'palegreen'),
+                          ('ID_Bodega', 'coral'), ('ID_SKU', 'palegreen')]:
+        counts: pd.Series = accumulator.value_counts(column).sort_index()
+        yield 'plot_distribution', pd.Series(counts.index, name=column), (
+            color,), {'weights': counts.to_numpy()}
+    yield 'plot_count', accumulator.frequency('count'), (
+        ['Cantidad_Facturada', 'Monto_Facturado $'], 'ID_Territorio'), {
+        'weights': 'count'}
+    yield 'boxplot_dist', accumulator.frequency('territory_box'), (
+        'Monto_Facturado $', 'ID_Territorio'), {'weights': 'count'}
+    yield 'boxplot_dist', accumulator.frequency('family_box'), (
+        'Monto_Facturado $', 'Familia_SKU'), {'weights': 'count'}
+
+
+def visualize_summary(
+        accumulator: SummaryAccumulator, batch: bool = False,
+        workers: Optional[int] = None, refresh_cache: bool = False
+) -> None:
+    """
+    Visualization of a streaming run from the accumulated frequencies
+    :param accumulator: Statistics accumulated over every chunk
+    :type accumulator: SummaryAccumulator
+    :param batch: Whether to render headless over a process pool. The
+     default is False
+    :type batch: bool
+    :param workers: Number of processes for batch mode. The default is
+     None (number of CPUs)
+    :type workers: int
+    :param refresh_cache: Whether to render the figures even if they are
+     unchanged. The default is False
+    :type refresh_cache: bool
+    :return: None
+    :rtype: NoneType
+    """
+    from analysis.visualization import render_plots
+    logger.info("Running visualization from summaries")
+    render_plots(_summary_tasks(accumulator), batch, workers,
+                 refresh_cache)
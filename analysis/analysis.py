@@ -2,51 +2,63 @@
 First Analysis script
 """
 import logging
+import os
+from typing import Any, Optional
 import pandas as pd
+from analysis.profiler import DataFrameProfiler, diff_profiles, load_profile
+from analysis.stats_cache import STATS
+from engineering.persistence_manager import DataType
 
 logger: logging.Logger = logging.getLogger(__name__)
 pd.set_option('display.max_columns', 20)
 pd.set_option('display.max_rows', 101)
 
 
-def analyze_dataframe(dataframe: pd.DataFrame) -> None:
+def report_profile(
+        profiler: DataFrameProfiler, filename: str = 'profile'
+) -> dict[str, Any]:
     """
-    Analyze the dataframe and its columns with inference statistics
-    :param dataframe: DataFrame to analyze
-    :type dataframe: pd.DataFrame
-    :return: None
-    :rtype: NoneType
+    Save the profile and log the statistics that changed since the
+     previous profile with the same name
+    :param profiler: The profiler with the accumulated statistics
+    :type profiler: DataFrameProfiler
+    :param filename: Name of the profile file. The default is 'profile'
+    :type filename: str
+    :return: The profile
+    :rtype: dict[str, Any]
     """
-    print(dataframe.head())
-    print(dataframe.shape)
-    print(dataframe.dtypes)
-    print(dataframe.info(memory_usage='deep'))
-    print(dataframe.memory_usage(deep=True))
-    print(dataframe.describe(include='all', datetime_is_numeric=True))
-    non_numeric_df = dataframe.select_dtypes(exclude=[
-        'uint8', 'uint16', 'uint32', 'uint64',
-        'int8', 'int16', 'int32',
-        'int64',
-        'float16', 'float32', 'float64'])
-    for column in non_numeric_df.columns:
-        print(non_numeric_df[column].value_counts())
-        print(non_numeric_df[column].unique())
-        print(non_numeric_df[column].value_counts(normalize=True) * 100)
+    filepath: str = f'{DataType.PROFILES.value}{filename}.json'
+    previous: Optional[dict[str, Any]] = load_profile(filepath) if \
+        os.path.exists(filepath) else None
+    profiler.save(filename)
+    profile: dict[str, Any] = profiler.to_dict()
+    logger.info("Profile of %s rows:\n%s", profiler.rows,
+                profiler.describe())
+    if previous is not None:
+        changes: pd.DataFrame = diff_profiles(previous, load_profile(
+            filepath))
+        logger.info("Profile changes since %s:\n%s", previous['created'],
+                    changes if not changes.empty else 'None')
+    return profile
 
 
-def find_missing_values(dataframe: pd.DataFrame) -> pd.DataFrame:
+def analyze_dataframe(
+        dataframe: pd.DataFrame, exact: bool = True,
+        filename: str = 'profile'
+) -> dict[str, Any]:
     """
-    Remove missing values from the dataframe
-    :param dataframe: Dirty dataframe to remove missing values from
+    Analyze the dataframe and its columns with inference statistics in a
+     single pass per column, shared with the plots through the statistics
+     cache
+    :param dataframe: DataFrame to analyze
     :type dataframe: pd.DataFrame
-    :return: Cleaned dataframe
-    :rtype: pd.DataFrame
+    :param exact: Whether to compute exact distinct counts and quantiles
+     instead of HyperLogLog and t-digest estimates. The default is True
+    :type exact: bool
+    :param filename: Name of the profile file. The default is 'profile'
+    :type filename: str
+    :return: The profile of the dataframe
+    :rtype: dict[str, Any]
     """
-    missing_values: pd.Series = (dataframe.isnull().sum())
-    print(missing_values)
-    if missing_values.any():
-        logger.warning("FOUND MISSING VALUES")
-        print(missing_values[missing_values > 0])
-        print(missing_values[missing_values > 0] / dataframe.shape[0] * 100)
-        dataframe = dataframe.dropna()
-    return dataframe
+    profiler: DataFrameProfiler = STATS.profile(dataframe, exact)
+    return report_profile(profiler, filename)
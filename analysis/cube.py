@@ -0,0 +1,246 @@
+"""
+Precomputed sales cube script
+"""
+import logging
+import os
+from typing import Any, Optional
+import numpy as np
+import pandas as pd
+from analysis.profiler import plain
+from engineering.persistence_manager import DataType, MONTH_COLUMN
+
+logger: logging.Logger = logging.getLogger(__name__)
+DIMENSIONS: list[str] = ['ID_Territorio', 'ID_Bodega', 'Familia_SKU',
+                         'ID_Cliente', MONTH_COLUMN]
+MEASURES: list[str] = ['Cantidad_Facturada', 'Monto_Facturado $']
+VALUES: list[str] = [f'{measure}_{statistic}' for measure in MEASURES
+                     for statistic in ('sum', 'count')] + ['rows']
+
+
+def _total(cells: pd.DataFrame) -> pd.DataFrame:
+    """
+    Grand total of the cells keeping the dtypes of the values
+    :param cells: Cells of the cube
+    :type cells: pd.DataFrame
+    :return: A single row with the sums and counts
+    :rtype: pd.DataFrame
+    """
+    return cells[VALUES].sum().to_frame().T.astype(
+        cells[VALUES].dtypes.to_dict())
+
+
+class SalesCube:
+    """
+    Cube with the sums and counts of the measures for every combination of
+     territory, warehouse, SKU family, client and month. The rollups of
+     each set of dimensions are materialized from the base cells on their
+     first query, so later queries only filter and group a small cuboid
+    """
+
+    def __init__(
+            self, dataframe: Optional[pd.DataFrame] = None,
+            month_column: str = 'Fecha_Pedido'
+    ):
+        self.month_column: str = month_column
+        self.cells: pd.DataFrame = pd.DataFrame(columns=DIMENSIONS + VALUES)
+        self.cuboids: dict[tuple[str, ...], pd.DataFrame] = {}
+        if dataframe is not None:
+            self.update(dataframe)
+
+    def __len__(self) -> int:
+        return len(self.cells)
+
+    def _aggregate(self, dataframe: pd.DataFrame) -> pd.DataFrame:
+        """
+        Aggregate rows into cells of the cube
+        :param dataframe: Rows with the columns of filter_desired_columns
+        :type dataframe: pd.DataFrame
+        :return: The sums and counts of each combination of dimensions
+        :rtype: pd.DataFrame
+        """
+        cells: pd.DataFrame = dataframe[DIMENSIONS[:-1]].apply(plain)
+        cells[MONTH_COLUMN] = dataframe[self.month_column].dt.strftime(
+            '%Y-%m')
+        for measure in MEASURES:
+            cells[f'{measure}_sum'] = dataframe[measure].astype('float64')
+            cells[f'{measure}_count'] = dataframe[measure].notna().astype(
+                'int64')
+        cells['rows'] = np.ones(len(cells), dtype='int64')
+        return cells
+
+    def _compact(self, cells: pd.DataFrame) -> None:
+        """
+        Merge the cells with the same dimensions and store the text
+         dimensions as categoricals
+        :param cells: Cells to merge
+        :type cells: pd.DataFrame
+        :return: None
+        :rtype: NoneType
+        """
+        cells = cells.groupby(DIMENSIONS, observed=True, dropna=False,
+                              sort=False, as_index=False)[VALUES].sum()
+        for dimension in DIMENSIONS[1:]:
+            cells[dimension] = cells[dimension].astype('category')
+        self.cells = cells
+        self.cuboids.clear()
+
+    def update(self, dataframe: pd.DataFrame) -> 'SalesCube':
+        """
+        Add new rows to the cube
+        :param dataframe: Rows with the columns of filter_desired_columns
+        :type dataframe: pd.DataFrame
+        :return: The cube itself
+        :rtype: SalesCube
+        """
+        if dataframe.empty:
+            return self
+        cells: pd.DataFrame = self._aggregate(dataframe)
+        if len(self.cells):
+            cells = pd.concat([self.cells.apply(plain), cells],
+                              ignore_index=True)
+        self._compact(cells)
+        return self
+
+    def drop(self, dimension: str, values: list) -> 'SalesCube':
+        """
+        Remove the cells of some values of a dimension, so replaced rows
+         can be added again with update
+        :param dimension: Dimension of the values
+        :type dimension: str
+        :param values: Values whose cells are removed
+        :type values: list
+        :return: The cube itself
+        :rtype: SalesCube
+        """
+        self.cells = self.cells[~self.cells[dimension].isin(values)]
+        self.cuboids.clear()
+        return self
+
+    def _cuboid(self, dimensions: list[str]) -> pd.DataFrame:
+        """
+        Cells rolled up to a set of dimensions, materialized on first use
+        :param dimensions: Dimensions to keep
+        :type dimensions: list[str]
+        :return: The sums and counts of each combination of the dimensions
+        :rtype: pd.DataFrame
+        """
+        key: tuple[str, ...] = tuple(
+            dimension for dimension in DIMENSIONS if dimension in dimensions)
+        if key not in self.cuboids:
+            self.cuboids[key] = self.cells.groupby(
+                list(key), observed=True, dropna=False, as_index=False)[
+                VALUES].sum() if key else _total(self.cells)
+        return self.cuboids[key]
+
+    def rollup(
+            self, dimensions: Optional[list[str]] = None,
+            filters: Optional[dict[str, Any]] = None
+    ) -> pd.DataFrame:
+        """
+        Sums and counts of the measures by some dimensions within a slice
+        :param dimensions: Dimensions to group by. The default is None
+         (grand total)
+        :type dimensions: list[str]
+        :param filters: Value or list of values of each sliced dimension.
+         The default is None
+        :type filters: dict[str, Any]
+        :return: The aggregated measures
+        :rtype: pd.DataFrame
+        """
+        dimensions = list(dimensions or [])
+        filters = filters or {}
+        unknown: set[str] = set(dimensions).union(filters).difference(
+            DIMENSIONS)
+        if unknown:
+            raise ValueError(f'Unknown dimensions {sorted(unknown)}')
+        cuboid: pd.DataFrame = self._cuboid(dimensions + list(filters))
+        for dimension, value in filters.items():
+            values: list = value if isinstance(value, (list, tuple, set)) \
+                else [value]
+            cuboid = cuboid[cuboid[dimension].isin(values)]
+        if not filters:
+            return cuboid
+        if not dimensions:
+            return _total(cuboid)
+        return cuboid.groupby(dimensions, observed=True, dropna=False,
+                              as_index=False)[VALUES].sum()
+
+    def drilldown(
+            self, dimensions: list[str], dimension: str,
+            filters: Optional[dict[str, Any]] = None
+    ) -> pd.DataFrame:
+        """
+        Break down a rollup by one more dimension
+        :param dimensions: Dimensions of the current rollup
+        :type dimensions: list[str]
+        :param dimension: Dimension to break down by
+        :type dimension: str
+        :param filters: Value or list of values of each sliced dimension.
+         The default is None
+        :type filters: dict[str, Any]
+        :return: The aggregated measures
+        :rtype: pd.DataFrame
+        """
+        return self.rollup(list(dimensions) + [dimension], filters)
+
+    def slice(self, filters: dict[str, Any]) -> 'SalesCube':
+        """
+        Sub-cube with only the cells of some dimension values
+        :param filters: Value or list of values of each sliced dimension
+        :type filters: dict[str, Any]
+        :return: The sliced cube
+        :rtype: SalesCube
+        """
+        cube: SalesCube = SalesCube(month_column=self.month_column)
+        mask: pd.Series = pd.Series(True, index=self.cells.index)
+        for dimension, value in filters.items():
+            mask &= self.cells[dimension].isin(
+                value if isinstance(value, (list, tuple, set)) else [value])
+        cube.cells = self.cells[mask]
+        return cube
+
+    def save(
+            self, filename: str = 'cube',
+            data_type: DataType = DataType.PROCESSED
+    ) -> str:
+        """
+        Save the cells of the cube as Parquet
+        :param filename: Name of the file without extension. The default
+         is 'cube'
+        :type filename: str
+        :param data_type: Folder where the cube will be saved. The default
+         is PROCESSED
+        :type data_type: DataType
+        :return: Path of the saved cube
+        :rtype: str
+        """
+        filepath: str = f'{data_type.value}{filename}.parquet'
+        self.cells.to_parquet(filepath, index=False)
+        logger.info("Sales cube with %s cells saved to %s", len(self),
+                    filepath)
+        return filepath
+
+
+def load_cube(
+        filename: str = 'cube', data_type: DataType = DataType.PROCESSED,
+        month_column: str = 'Fecha_Pedido'
+) -> Optional[SalesCube]:
+    """
+    Load a cube saved by SalesCube.save
+    :param filename: Name of the file without extension. The default is
+     'cube'
+    :type filename: str
+    :param data_type: Folder of the cube. The default is PROCESSED
+    :type data_type: DataType
+    :param month_column: Date column of the month dimension. The default
+     is 'Fecha_Pedido'
+    :type month_column: str
+    :return: The cube or None if it was not saved
+    :rtype: SalesCube
+    """
+    filepath: str = f'{data_type.value}{filename}.parquet'
+    if not os.path.exists(filepath):
+        return None
+    cube: SalesCube = SalesCube(month_column=month_column)
+    cube.cells = pd.read_parquet(filepath)
+    return cube
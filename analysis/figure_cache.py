@@ -0,0 +1,261 @@
+"""
+Content-addressed cache script for figures
+"""
+import functools
+import hashlib
+import inspect
+import json
+import logging
+import os
+import time
+from typing import Any, Callable, Optional
+import numpy as np
+import pandas as pd
+from matplotlib import pyplot as plt
+from core.config import FIG_SIZE, FONT_SIZE, PALETTE, RE_PATTERN, RE_REPL
+from engineering.persistence_manager import DataType
+
+logger: logging.Logger = logging.getLogger(__name__)
+MANIFEST_NAME: str = 'manifest.json'
+_saved_figures: list[str] = []
+_pending_entries: list[tuple[DataType, dict[str, dict[str, Any]]]] = []
+_state: dict[str, bool] = {'deferred': False}
+
+
+def defer_manifest() -> None:
+    """
+    Keep the new manifest entries of this process in memory so a parent
+     process can record them, instead of writing the manifest
+    :return: None
+    :rtype: NoneType
+    """
+    _state['deferred'] = True
+
+
+def take_pending_entries() -> list[tuple[DataType, dict[str, dict]]]:
+    """
+    Take the manifest entries deferred by this process
+    :return: Folder of the figures and entries by fingerprint
+    :rtype: list[tuple[DataType, dict[str, dict]]]
+    """
+    entries: list[tuple[DataType, dict[str, dict]]] = list(_pending_entries)
+    _pending_entries.clear()
+    return entries
+
+
+def save_figure(filepath: str) -> None:
+    """
+    Save the current figure and remember its path for the manifest
+    :param filepath: Path of the image
+    :type filepath: str
+    :return: None
+    :rtype: NoneType
+    """
+    plt.savefig(filepath)
+    _saved_figures.append(filepath)
+
+
+def _used_columns(dataframe: pd.DataFrame, arguments: list[Any]) -> list:
+    """
+    Find the columns of the dataframe named by the other arguments
+    :param dataframe: Data argument of the plot
+    :type dataframe: pd.DataFrame
+    :param arguments: The other arguments of the plot
+    :type arguments: list[Any]
+    :return: The named columns or every column if none is named
+    :rtype: list
+    """
+    names: set = set()
+    for argument in arguments:
+        values: list = argument if isinstance(argument, (list, tuple)) \
+            else [argument]
+        names.update(value for value in values if isinstance(value, str))
+    used: list = [column for column in dataframe.columns if column in names]
+    return used or list(dataframe.columns)
+
+
+def _update_digest(digest: Any, value: Any, arguments: list[Any]) -> None:
+    """
+    Feed an argument of a plot into the fingerprint
+    :param digest: Hash object to update
+    :type digest: Any
+    :param value: The argument
+    :type value: Any
+    :param arguments: Every argument of the plot to find the used columns
+    :type arguments: list[Any]
+    :return: None
+    :rtype: NoneType
+    """
+    if isinstance(value, pd.DataFrame):
+        value = value[_used_columns(value, arguments)]
+        digest.update(repr(value.dtypes.astype(str).to_dict()).encode())
+        value = pd.util.hash_pandas_object(value, index=False)
+    elif isinstance(value, pd.Series):
+        digest.update(f'{value.name}{value.dtype}'.encode())
+        value = pd.util.hash_pandas_object(value, index=False)
+    if isinstance(value, pd.Series):
+        digest.update(value.to_numpy().tobytes())
+    elif isinstance(value, np.ndarray):
+        digest.update(f'{value.dtype}{value.shape}'.encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, DataType):
+        digest.update(value.value.encode())
+    else:
+        digest.update(repr(value).encode())
+
+
+def figure_fingerprint(
+        function: Callable, args: tuple, kwargs: dict
+) -> str:
+    """
+    Fingerprint of a plot from the columns it uses, its parameters with
+     their defaults and the style configuration
+    :param function: The plot function
+    :type function: Callable
+    :param args: Positional arguments of the call
+    :type args: tuple
+    :param kwargs: Keyword arguments of the call
+    :type kwargs: dict
+    :return: Hexadecimal fingerprint
+    :rtype: str
+    """
+    bound: inspect.BoundArguments = inspect.signature(function).bind(
+        *args, **kwargs)
+    bound.apply_defaults()
+    arguments: list[Any] = list(bound.arguments.values())
+    digest = hashlib.sha256(function.__qualname__.encode())
+    digest.update(repr((PALETTE, FIG_SIZE, int(FONT_SIZE), RE_PATTERN,
+                        RE_REPL)).encode())
+    for name, value in bound.arguments.items():
+        digest.update(name.encode())
+        _update_digest(digest, value, arguments)
+    return digest.hexdigest()[:32]
+
+
+def load_manifest(data_type: DataType = DataType.FIGURES) -> dict:
+    """
+    Load the manifest of the figures
+    :param data_type: Folder of the figures. The default is FIGURES
+    :type data_type: DataType
+    :return: Entries by fingerprint
+    :rtype: dict
+    """
+    filepath: str = f'{data_type.value}{MANIFEST_NAME}'
+    if not os.path.exists(filepath):
+        return {}
+    try:
+        with open(filepath, encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError) as exc:
+        logger.warning("Discarding unreadable figure manifest: %s", exc)
+        return {}
+
+
+def _save_manifest(manifest: dict, data_type: DataType) -> None:
+    """
+    Replace the manifest of the figures atomically
+    :param manifest: Entries by fingerprint
+    :type manifest: dict
+    :param data_type: Folder of the figures
+    :type data_type: DataType
+    :return: None
+    :rtype: NoneType
+    """
+    filepath: str = f'{data_type.value}{MANIFEST_NAME}'
+    with open(f'{filepath}.tmp', 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, indent=1, sort_keys=True)
+    os.replace(f'{filepath}.tmp', filepath)
+
+
+def record_figures(
+        entries: dict[str, dict[str, Any]],
+        data_type: DataType = DataType.FIGURES
+) -> None:
+    """
+    Record new entries in the manifest, evicting the entries of images
+     they overwrote
+    :param entries: Entries by fingerprint
+    :type entries: dict[str, dict[str, Any]]
+    :param data_type: Folder of the figures. The default is FIGURES
+    :type data_type: DataType
+    :return: None
+    :rtype: NoneType
+    """
+    if not entries:
+        return
+    manifest: dict = load_manifest(data_type)
+    for key, entry in entries.items():
+        files: set = set(entry['files'])
+        manifest = {old_key: old_entry for old_key, old_entry in
+                    manifest.items()
+                    if not files.intersection(old_entry['files'])}
+        manifest[key] = entry
+    _save_manifest(manifest, data_type)
+
+
+def evict_figure_cache(
+        data_type: DataType = DataType.FIGURES,
+        max_age_days: Optional[float] = None, clear: bool = False
+) -> int:
+    """
+    Evict the manifest entries whose images are missing, that are older
+     than max_age_days or every entry when clearing
+    :param data_type: Folder of the figures. The default is FIGURES
+    :type data_type: DataType
+    :param max_age_days: Maximum days since the images were rendered.
+     The default is None (no age limit)
+    :type max_age_days: float
+    :param clear: Whether to evict every entry. The default is False
+    :type clear: bool
+    :return: Number of evicted entries
+    :rtype: int
+    """
+    manifest: dict = load_manifest(data_type)
+    now: float = time.time()
+    kept: dict = {
+        key: entry for key, entry in manifest.items() if not clear and
+        all(os.path.exists(path) for path in entry['files']) and
+        (max_age_days is None or
+         now - entry['created'] <= max_age_days * 86400)}
+    if len(kept) != len(manifest):
+        _save_manifest(kept, data_type)
+    evicted: int = len(manifest) - len(kept)
+    logger.info("Evicted %s figure cache entries", evicted)
+    return evicted
+
+
+def cached_figure(function: Callable) -> Callable:
+    """
+    Decorator to skip a plot function when its images were rendered from
+     the same fingerprint. The wrapped function accepts refresh_cache to
+     render anyway
+    :param function: Plot function that saves its images with save_figure
+    :type function: Callable
+    :return: The wrapped plot function
+    :rtype: Callable
+    """
+    data_type_default: DataType = inspect.signature(
+        function).parameters['data_type'].default
+
+    @functools.wraps(function)
+    def wrapper(*args: Any, refresh_cache: bool = False, **kwargs: Any
+                ) -> None:
+        data_type: DataType = inspect.signature(function).bind(
+            *args, **kwargs).arguments.get('data_type', data_type_default)
+        key: str = figure_fingerprint(function, args, kwargs)
+        entry: Optional[dict] = load_manifest(data_type).get(key)
+        if not refresh_cache and entry and all(
+                os.path.exists(path) for path in entry['files']):
+            logger.info("Skipping %s, unchanged since %s", function.__name__,
+                        time.ctime(entry['created']))
+            return
+        _saved_figures.clear()
+        function(*args, **kwargs)
+        entries: dict[str, dict[str, Any]] = {key: {
+            'function': function.__name__, 'files': list(_saved_figures),
+            'created': time.time()}}
+        if _state['deferred']:
+            _pending_entries.append((data_type, entries))
+        else:
+            record_figures(entries, data_type)
+    return wrapper
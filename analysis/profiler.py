@@ -0,0 +1,609 @@
+"""
+Single-pass mergeable profiler script
+"""
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Any, Optional
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_bool_dtype, is_categorical_dtype, \
+    is_datetime64_any_dtype, is_numeric_dtype
+from engineering.persistence_manager import DataType
+
+logger: logging.Logger = logging.getLogger(__name__)
+QUANTILES: list[float] = [0.25, 0.5, 0.75]
+RELATIVE_ACCURACY: float = 0.01
+
+
+def plain(series: pd.Series) -> pd.Series:
+    """
+    Convert a categorical column to the dtype of its categories so values
+     from chunks with different categories can be merged
+    :param series: The column to convert
+    :type series: pd.Series
+    :return: The column without categorical dtype
+    :rtype: pd.Series
+    """
+    if is_categorical_dtype(series):
+        return series.astype(series.cat.categories.dtype)
+    return series
+
+
+def _python(value: Any) -> Any:
+    """
+    Convert numpy scalars to their Python equivalent for serialization
+    :param value: The value to convert
+    :type value: Any
+    :return: The Python value
+    :rtype: Any
+    """
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def log_bins(
+        values: np.ndarray, accuracy: float = RELATIVE_ACCURACY
+) -> np.ndarray:
+    """
+    Replace each value by the representative of its logarithmic bin, so a
+     continuous column takes a bounded number of distinct values whose
+     relative error is at most accuracy. The sign, zeros and nulls are
+     kept
+    :param values: The values to bin
+    :type values: np.ndarray
+    :param accuracy: Maximum relative error of the representatives. The
+     default is RELATIVE_ACCURACY
+    :type accuracy: float
+    :return: The representative of each value
+    :rtype: np.ndarray
+    """
+    values = np.asarray(values, dtype=np.float64)
+    gamma: float = (1 + accuracy) / (1 - accuracy)
+    magnitude: np.ndarray = np.abs(values)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        index: np.ndarray = np.ceil(np.log(magnitude) / np.log(gamma))
+        representative: np.ndarray = 2 * gamma ** index / (gamma + 1)
+    return np.where(magnitude > 0, np.sign(values) * representative, values)
+
+
+def weighted_quantiles(counts: pd.Series, quantiles: list[float]) -> list:
+    """
+    Compute the quantiles of the values represented by their counts, with
+     the same linear interpolation numpy uses on the expanded values
+    :param counts: Counts indexed by the values
+    :type counts: pd.Series
+    :param quantiles: Quantiles between 0 and 1 to compute
+    :type quantiles: list[float]
+    :return: The value of each quantile
+    :rtype: list
+    """
+    counts = counts[counts > 0].sort_index()
+    if counts.empty:
+        return [np.nan] * len(quantiles)
+    values: np.ndarray = counts.index.to_numpy()
+    cumulative: np.ndarray = np.cumsum(counts.to_numpy())
+    results: list = []
+    for quantile in quantiles:
+        position: float = quantile * (cumulative[-1] - 1)
+        lower: int = int(np.floor(position))
+        low_value = values[np.searchsorted(cumulative, lower, side='right')]
+        high_value = values[np.searchsorted(
+            cumulative, min(lower + 1, cumulative[-1] - 1), side='right')]
+        value = low_value + (high_value - low_value) * (position - lower)
+        results.append(pd.Timestamp(value) if values.dtype.kind == 'M'
+                       else value)
+    return results
+
+
+class HyperLogLog:
+    """
+    HyperLogLog sketch to estimate the number of distinct values
+    """
+
+    def __init__(self, precision: int = 12):
+        self.precision: int = precision
+        self.registers: np.ndarray = np.zeros(1 << precision, dtype=np.uint8)
+
+    def update(self, hashes: np.ndarray) -> None:
+        """
+        Add 64-bit hashes of values to the sketch
+        :param hashes: Hashes of the values
+        :type hashes: np.ndarray
+        :return: None
+        :rtype: NoneType
+        """
+        bits: int = 64 - self.precision
+        index: np.ndarray = (hashes >> np.uint64(bits)).astype(np.int64)
+        remainder: np.ndarray = hashes & np.uint64((1 << bits) - 1)
+        _, exponent = np.frexp(remainder.astype(np.float64))
+        rank: np.ndarray = np.where(remainder == 0, bits + 1,
+                                    bits - exponent + 1)
+        np.maximum.at(self.registers, index, rank.astype(np.uint8))
+
+    def merge(self, other: 'HyperLogLog') -> None:
+        """
+        Merge the registers of another sketch
+        :param other: The sketch to merge
+        :type other: HyperLogLog
+        :return: None
+        :rtype: NoneType
+        """
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def estimate(self) -> int:
+        """
+        Estimate the number of distinct values
+        :return: The estimated cardinality
+        :rtype: int
+        """
+        size: int = self.registers.size
+        alpha: float = 0.7213 / (1 + 1.079 / size)
+        raw: float = alpha * size ** 2 / np.sum(
+            np.power(2.0, -self.registers.astype(np.float64)))
+        zeros: int = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * size and zeros:
+            return int(round(size * np.log(size / zeros)))
+        return int(round(raw))
+
+
+class TDigest:
+    """
+    Merging t-digest sketch to estimate quantiles
+    """
+
+    def __init__(self, compression: int = 100):
+        self.compression: int = compression
+        self.means: np.ndarray = np.empty(0)
+        self.weights: np.ndarray = np.empty(0)
+        self.minimum: float = np.inf
+        self.maximum: float = -np.inf
+
+    def update(self, values: np.ndarray, weights: np.ndarray) -> None:
+        """
+        Add weighted values to the digest
+        :param values: The values to add
+        :type values: np.ndarray
+        :param weights: The weight of each value
+        :type weights: np.ndarray
+        :return: None
+        :rtype: NoneType
+        """
+        if not values.size:
+            return
+        self.minimum = min(self.minimum, float(values.min()))
+        self.maximum = max(self.maximum, float(values.max()))
+        self.means = np.concatenate([self.means, values.astype(np.float64)])
+        self.weights = np.concatenate([
+            self.weights, weights.astype(np.float64)])
+        self._compress()
+
+    def merge(self, other: 'TDigest') -> None:
+        """
+        Merge the centroids of another digest
+        :param other: The digest to merge
+        :type other: TDigest
+        :return: None
+        :rtype: NoneType
+        """
+        if other.means.size:
+            self.minimum = min(self.minimum, other.minimum)
+            self.maximum = max(self.maximum, other.maximum)
+            self.means = np.concatenate([self.means, other.means])
+            self.weights = np.concatenate([self.weights, other.weights])
+            self._compress()
+
+    def _compress(self) -> None:
+        """
+        Merge neighbouring centroids that fall in the same bucket of the k1
+         scale function, which keeps small centroids near the tails
+        :return: None
+        :rtype: NoneType
+        """
+        order: np.ndarray = np.argsort(self.means, kind='mergesort')
+        means: np.ndarray = self.means[order]
+        weights: np.ndarray = self.weights[order]
+        quantile: np.ndarray = (np.cumsum(weights) - weights / 2) / \
+            weights.sum()
+        bucket: np.ndarray = np.floor(self.compression * (
+                np.arcsin(2 * quantile - 1) / np.pi + 0.5)).astype(np.int64)
+        totals: np.ndarray = np.bincount(bucket, weights=weights)
+        sums: np.ndarray = np.bincount(bucket, weights=weights * means)
+        used: np.ndarray = totals > 0
+        self.means = sums[used] / totals[used]
+        self.weights = totals[used]
+
+    def quantile(self, quantiles: list[float]) -> list[float]:
+        """
+        Estimate the quantiles of the added values
+        :param quantiles: Quantiles between 0 and 1
+        :type quantiles: list[float]
+        :return: The estimated value of each quantile
+        :rtype: list[float]
+        """
+        if not self.means.size:
+            return [np.nan] * len(quantiles)
+        total: float = self.weights.sum()
+        midpoints: np.ndarray = np.cumsum(self.weights) - self.weights / 2
+        positions: np.ndarray = np.concatenate([[0], midpoints, [total]])
+        values: np.ndarray = np.concatenate([
+            [self.minimum], self.means, [self.maximum]])
+        return list(np.interp(np.asarray(quantiles) * total, positions,
+                              values))
+
+
+class ColumnProfile:
+    """
+    Mergeable profile of a single column. Each update scans the column
+     once with value_counts and derives the rest from the distinct values.
+     A sketched column keeps only its most frequent values with sketches
+     of its distinct count and quantiles, so its state stays bounded
+    """
+
+    def __init__(
+            self, name: str, dtype: Any, exact: bool = True, top_k: int = 10,
+            capacity: int = 1000, sketched: bool = False
+    ):
+        self.name: str = name
+        self.dtype: str = str(dtype)
+        self.kind: str = 'datetime' if is_datetime64_any_dtype(dtype) else \
+            'numeric' if is_numeric_dtype(dtype) and not is_bool_dtype(
+                dtype) else 'categorical'
+        self.exact: bool = exact
+        self.sketched: bool = sketched or not exact
+        self.top_k: int = top_k
+        self.capacity: int = capacity
+        self.count: int = 0
+        self.nulls: int = 0
+        self.counts: pd.Series = pd.Series(dtype='float64')
+        self.mean: float = 0.0
+        self.m2: float = 0.0
+        self.minimum: Any = None
+        self.maximum: Any = None
+        self.hll: Optional[HyperLogLog] = HyperLogLog() if \
+            self.sketched else None
+        self.digest: Optional[TDigest] = TDigest() if self.sketched and \
+            self.kind != 'categorical' else None
+
+    def update(
+            self, series: pd.Series, counts: Optional[pd.Series] = None
+    ) -> 'ColumnProfile':
+        """
+        Profile a chunk of the column and merge it
+        :param series: Chunk of the column
+        :type series: pd.Series
+        :param counts: Value counts of the chunk with missing values, when
+         they are already known. The default is None
+        :type counts: pd.Series
+        :return: The profile itself
+        :rtype: ColumnProfile
+        """
+        other: ColumnProfile = ColumnProfile(
+            self.name, self.dtype if self.count else series.dtype,
+            self.exact, self.top_k, self.capacity, self.sketched)
+        if counts is None:
+            counts = plain(series).value_counts(dropna=False)
+        missing: np.ndarray = counts.index.isna()
+        other.nulls = int(counts[missing].sum())
+        counts = counts[~missing & (counts.to_numpy() > 0)]
+        other.counts = counts
+        other.count = int(counts.sum())
+        if other.count:
+            other.minimum = counts.index.min()
+            other.maximum = counts.index.max()
+        if other.kind != 'categorical' and other.count:
+            numbers: np.ndarray = self._numbers(counts.index)
+            weights: np.ndarray = counts.to_numpy(dtype=np.float64)
+            other.mean = float(np.dot(numbers, weights) / other.count)
+            other.m2 = float(np.dot((numbers - other.mean) ** 2, weights))
+            if other.digest is not None:
+                other.digest.update(numbers, weights)
+        if other.hll is not None:
+            other.hll.update(pd.util.hash_array(counts.index.to_numpy()))
+        return self.merge(other)
+
+    def _numbers(self, values: pd.Index) -> np.ndarray:
+        """
+        Represent numeric or datetime values as float numbers
+        :param values: The values to represent
+        :type values: pd.Index
+        :return: The float representation of the values
+        :rtype: np.ndarray
+        """
+        if self.kind == 'datetime':
+            return values.to_numpy().astype('datetime64[ns]').astype(
+                np.int64).astype(np.float64)
+        return values.to_numpy(dtype=np.float64)
+
+    def merge(self, other: 'ColumnProfile') -> 'ColumnProfile':
+        """
+        Merge another profile of the same column
+        :param other: The profile to merge
+        :type other: ColumnProfile
+        :return: The profile itself
+        :rtype: ColumnProfile
+        """
+        total: int = self.count + other.count
+        if other.count:
+            delta: float = other.mean - self.mean
+            self.m2 += other.m2 + delta ** 2 * self.count * other.count / \
+                total
+            self.mean += delta * other.count / total
+            self.minimum = other.minimum if self.minimum is None else min(
+                self.minimum, other.minimum)
+            self.maximum = other.maximum if self.maximum is None else max(
+                self.maximum, other.maximum)
+        if not self.count:
+            self.dtype, self.kind = other.dtype, other.kind
+        self.count = total
+        self.nulls += other.nulls
+        self.counts = self.counts.add(other.counts, fill_value=0) if \
+            len(self.counts) else other.counts
+        if self.sketched and len(self.counts) > self.capacity:
+            self.counts = self.counts.nlargest(self.capacity)
+        if self.hll is not None and other.hll is not None:
+            self.hll.merge(other.hll)
+        if self.digest is not None and other.digest is not None:
+            self.digest.merge(other.digest)
+        return self
+
+    @property
+    def distinct(self) -> int:
+        """
+        Number of distinct non-null values, estimated for a sketched
+         column
+        :return: The number of distinct values
+        :rtype: int
+        """
+        if self.hll is not None:
+            return self.hll.estimate()
+        return int(len(self.counts))
+
+    @property
+    def std(self) -> float:
+        """
+        Sample standard deviation of the numeric values
+        :return: The standard deviation
+        :rtype: float
+        """
+        return float(np.sqrt(self.m2 / (self.count - 1))) if \
+            self.count > 1 else np.nan
+
+    def value_counts(self, normalize: bool = False) -> pd.Series:
+        """
+        Value counts sorted by frequency. Only the most frequent values
+         are kept for a sketched column
+        :param normalize: Whether to return proportions. The default is
+         False
+        :type normalize: bool
+        :return: The counts of each value
+        :rtype: pd.Series
+        """
+        counts: pd.Series = self.counts.astype('int64').sort_values(
+            ascending=False, kind='stable').rename(self.name)
+        return counts / self.count if normalize else counts
+
+    def quantiles(self, quantiles: list[float]) -> list:
+        """
+        Quantiles of the numeric or datetime values
+        :param quantiles: Quantiles between 0 and 1
+        :type quantiles: list[float]
+        :return: The value of each quantile
+        :rtype: list
+        """
+        if self.kind == 'categorical':
+            return [np.nan] * len(quantiles)
+        if self.digest is None:
+            return weighted_quantiles(self.counts, quantiles)
+        values: list[float] = self.digest.quantile(quantiles)
+        if self.kind == 'datetime':
+            return [pd.Timestamp(int(value)) for value in values]
+        return values
+
+    def to_dict(self) -> dict[str, Any]:
+        """
+        Structured representation of the profile
+        :return: Dictionary with the statistics of the column
+        :rtype: dict[str, Any]
+        """
+        profile: dict[str, Any] = {
+            'dtype': self.dtype, 'kind': self.kind, 'count': self.count,
+            'nulls': self.nulls, 'distinct': self.distinct,
+            'distinct_exact': self.hll is None,
+            'min': _python(self.minimum), 'max': _python(self.maximum),
+            'top': [[_python(value), int(count)] for value, count in
+                    self.value_counts().head(self.top_k).items()]}
+        if self.kind != 'categorical' and self.count:
+            profile['mean'] = pd.Timestamp(int(self.mean)) if \
+                self.kind == 'datetime' else self.mean
+            profile['std'] = None if self.kind == 'datetime' else self.std
+            profile['quantiles'] = dict(zip(
+                [str(quantile) for quantile in QUANTILES],
+                [_python(value) for value in self.quantiles(QUANTILES)]))
+        return profile
+
+
+class DataFrameProfiler:
+    """
+    Single-pass profiler of a dataframe whose state can be merged across
+     chunks or workers
+    """
+
+    def __init__(
+            self, exact: bool = True, top_k: int = 10,
+            sketched: Optional[list[str]] = None
+    ):
+        self.exact: bool = exact
+        self.top_k: int = top_k
+        self.sketched: list[str] = sketched or []
+        self.rows: int = 0
+        self.columns: dict[str, ColumnProfile] = {}
+
+    def update(
+            self, dataframe: pd.DataFrame,
+            counts: Optional[dict[str, pd.Series]] = None
+    ) -> 'DataFrameProfiler':
+        """
+        Profile a chunk of rows and merge it
+        :param dataframe: The chunk to profile
+        :type dataframe: pd.DataFrame
+        :param counts: Value counts of the columns with missing values,
+         when they are already known. The default is None
+        :type counts: dict[str, pd.Series]
+        :return: The profiler itself
+        :rtype: DataFrameProfiler
+        """
+        self.rows += dataframe.shape[0]
+        for column in dataframe.columns:
+            if column not in self.columns:
+                self.columns[column] = ColumnProfile(
+                    column, dataframe[column].dtype, self.exact, self.top_k,
+                    sketched=column in self.sketched)
+            self.columns[column].update(
+                dataframe[column], (counts or {}).get(column))
+        return self
+
+    def merge(self, other: 'DataFrameProfiler') -> 'DataFrameProfiler':
+        """
+        Merge the profile of another chunk or worker
+        :param other: The profiler to merge
+        :type other: DataFrameProfiler
+        :return: The profiler itself
+        :rtype: DataFrameProfiler
+        """
+        self.rows += other.rows
+        for column, profile in other.columns.items():
+            if column in self.columns:
+                self.columns[column].merge(profile)
+            else:
+                self.columns[column] = profile
+        return self
+
+    def describe(self) -> pd.DataFrame:
+        """
+        Descriptive statistics of every column like
+         describe(include='all', datetime_is_numeric=True)
+        :return: The descriptive statistics
+        :rtype: pd.DataFrame
+        """
+        statistics: dict[str, dict] = {}
+        for column, profile in self.columns.items():
+            row: dict[str, Any] = {'count': profile.count}
+            if profile.kind == 'categorical':
+                top: pd.Series = profile.value_counts().head(1)
+                row.update({'unique': profile.distinct,
+                            'top': top.index[0] if len(top) else np.nan,
+                            'freq': top.iloc[0] if len(top) else np.nan})
+            elif profile.count:
+                quantiles: list = profile.quantiles(QUANTILES)
+                row.update({
+                    'mean': profile.to_dict()['mean'],
+                    'std': np.nan if profile.kind == 'datetime' else
+                    profile.std, 'min': profile.minimum,
+                    '25%': quantiles[0], '50%': quantiles[1],
+                    '75%': quantiles[2], 'max': profile.maximum})
+            statistics[column] = row
+        index: list[str] = ['count', 'unique', 'top', 'freq', 'mean', 'std',
+                            'min', '25%', '50%', '75%', 'max']
+        return pd.DataFrame(statistics).reindex(index).dropna(how='all')
+
+    def to_dict(self) -> dict[str, Any]:
+        """
+        Structured representation of the profile
+        :return: Dictionary with the profile of every column
+        :rtype: dict[str, Any]
+        """
+        return {'created': datetime.now().isoformat(timespec='seconds'),
+                'rows': self.rows, 'exact': self.exact,
+                'columns': {column: profile.to_dict() for column, profile
+                            in self.columns.items()}}
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Flat representation of the profile with one row per column
+        :return: The profile as dataframe
+        :rtype: pd.DataFrame
+        """
+        records: list[dict] = []
+        for column, profile in self.to_dict()['columns'].items():
+            quantiles: dict = profile.pop('quantiles', {})
+            record: dict = {'column': column}
+            record.update({key: str(value) if key in ('min', 'max', 'mean')
+                           else value for key, value in profile.items()})
+            record['top'] = json.dumps(profile['top'], default=str)
+            record.update({f'q{key}': str(value) for key, value in
+                           quantiles.items()})
+            records.append(record)
+        return pd.DataFrame(records)
+
+    def save(
+            self, filename: str = 'profile',
+            data_type: DataType = DataType.PROFILES, file_format: str = 'json'
+    ) -> str:
+        """
+        Save the profile as JSON or Parquet
+        :param filename: Name of the file without extension. The default
+         is 'profile'
+        :type filename: str
+        :param data_type: Folder where the profile will be saved. The
+         default is PROFILES
+        :type data_type: DataType
+        :param file_format: 'json' or 'parquet'. The default is 'json'
+        :type file_format: str
+        :return: Path of the saved profile
+        :rtype: str
+        """
+        os.makedirs(data_type.value, exist_ok=True)
+        filepath: str = f'{data_type.value}{filename}.{file_format}'
+        if file_format == 'parquet':
+            self.to_frame().to_parquet(filepath, index=False)
+        else:
+            with open(filepath, 'w', encoding='utf-8') as file:
+                json.dump(self.to_dict(), file, indent=2, default=str)
+        logger.info("Profile saved to %s", filepath)
+        return filepath
+
+
+def load_profile(filepath: str) -> dict[str, Any]:
+    """
+    Load a JSON profile written by DataFrameProfiler.save
+    :param filepath: Path of the profile
+    :type filepath: str
+    :return: The profile
+    :rtype: dict[str, Any]
+    """
+    with open(filepath, encoding='utf-8') as file:
+        return json.load(file)
+
+
+def diff_profiles(
+        previous: dict[str, Any], current: dict[str, Any]
+) -> pd.DataFrame:
+    """
+    Compare the statistics of two profiles column by column
+    :param previous: The profile of an earlier run
+    :type previous: dict[str, Any]
+    :param current: The profile of the current run
+    :type current: dict[str, Any]
+    :return: Dataframe with previous and current values of the statistics
+     that changed
+    :rtype: pd.DataFrame
+    """
+    records: list[dict] = []
+    columns: list[str] = list(dict.fromkeys(
+        [*previous['columns'], *current['columns']]))
+    for column in columns:
+        before: dict = previous['columns'].get(column, {})
+        after: dict = current['columns'].get(column, {})
+        for statistic in ['dtype', 'count', 'nulls', 'distinct', 'min',
+                          'max', 'mean', 'std']:
+            old, new = before.get(statistic), after.get(statistic)
+            numbers: bool = all(isinstance(value, (int, float)) and not
+                                isinstance(value, bool) for value in
+                                (old, new))
+            if (numbers and not np.isclose(old, new, equal_nan=True)) or (
+                    not numbers and str(old) != str(new)):
+                records.append({'column': column, 'statistic': statistic,
+                                'previous': old, 'current': new})
+    return pd.DataFrame(
+        records, columns=['column', 'statistic', 'previous', 'current'])
@@ -0,0 +1,241 @@
+"""
+Customer and product segmentation script
+"""
+import logging
+from typing import Optional
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+from engineering.persistence_manager import DataType
+
+logger: logging.Logger = logging.getLogger(__name__)
+RFM_BINS: int = 5
+ABC_THRESHOLDS: dict[str, float] = {'A': 0.8, 'B': 0.95}
+ABC_KEYS: list[str] = ['ID_SKU', 'Familia_SKU']
+RFM_SEGMENTS: dict[str, tuple[int, int]] = {
+    'Champions': (4, 4), 'Loyal': (3, 4), 'Recent': (4, 1),
+    'Potential': (3, 2), 'At risk': (1, 3), 'Hibernating': (2, 1),
+    'Lost': (1, 1)}
+
+
+def _aggregate(
+        dataframe: pd.DataFrame, key: str, by: Optional[str],
+        **aggregations: tuple[str, str]
+) -> pd.DataFrame:
+    """
+    Aggregate the sales of each value of a key within an optional
+     partition in a single groupby
+    :param dataframe: The sales
+    :type dataframe: pd.DataFrame
+    :param key: The key of the entities
+    :type key: str
+    :param by: The partition column or None
+    :type by: str
+    :return: One row per partition and key with the aggregations
+    :rtype: pd.DataFrame
+    """
+    keys: list[str] = [key] if by is None else [by, key]
+    aggregated: pd.DataFrame = dataframe.groupby(
+        keys, observed=True, sort=False).agg(**aggregations).reset_index()
+    return aggregated.astype(dataframe[keys].dtypes.to_dict())
+
+
+def _text_categorical(series: pd.Series) -> pd.Categorical:
+    """
+    Categorical of a key with its categories as text, converting only the
+     distinct values
+    :param series: The key column
+    :type series: pd.Series
+    :return: The categorical key
+    :rtype: pd.Categorical
+    """
+    categorical: pd.Categorical = pd.Categorical(series)
+    return categorical.rename_categories(
+        categorical.categories.astype(str))
+
+
+def _score(
+        values: pd.Series, partitions: Optional[pd.Series], bins: int,
+        ascending: bool = True
+) -> np.ndarray:
+    """
+    Quantile score from 1 to bins of each value within its partition,
+     from its percentile rank
+    :param values: Values to score
+    :type values: pd.Series
+    :param partitions: Partition of each value or None
+    :type partitions: pd.Series
+    :param bins: Number of scores
+    :type bins: int
+    :param ascending: Whether higher values get higher scores. The
+     default is True
+    :type ascending: bool
+    :return: The score of each value
+    :rtype: np.ndarray
+    """
+    ranks: pd.Series = values.rank(pct=True, ascending=ascending) if \
+        partitions is None else values.groupby(partitions).rank(
+        pct=True, ascending=ascending)
+    return np.clip(np.ceil(ranks.to_numpy() * bins), 1, bins).astype(
+        np.uint8)
+
+
+def rfm_scores(
+        dataframe: pd.DataFrame, by: Optional[str] = None,
+        reference_date: Optional[pd.Timestamp] = None, bins: int = RFM_BINS
+) -> pd.DataFrame:
+    """
+    Recency, frequency and monetary scores of each client from one
+     aggregation of their sales lines. Scores go from 1 to bins by
+     percentile rank within the partition, with the most recent, frequent
+     and valuable clients scoring bins
+    :param dataframe: Sales with the columns of filter_desired_columns
+    :type dataframe: pd.DataFrame
+    :param by: Column to score each partition apart, such as
+     'ID_Territorio'. The default is None
+    :type by: str
+    :param reference_date: Date the recency is measured from. The default
+     is None (the day after the last order)
+    :type reference_date: pd.Timestamp
+    :param bins: Number of scores. The default is RFM_BINS
+    :type bins: int
+    :return: Recency in days, frequency, monetary value, scores and
+     segment of each client
+    :rtype: pd.DataFrame
+    """
+    clients: pd.DataFrame = _aggregate(
+        dataframe, 'ID_Cliente', by, Ultimo_Pedido=('Fecha_Pedido', 'max'),
+        Frecuencia=('Fecha_Pedido', 'size'),
+        Monto=('Monto_Facturado $', 'sum'))
+    reference_date = reference_date or dataframe['Fecha_Pedido'].max() + \
+        pd.Timedelta(days=1)
+    clients['Recencia_Dias'] = (
+            reference_date - clients.pop('Ultimo_Pedido')).dt.days
+    partitions: Optional[pd.Series] = None if by is None else clients[by]
+    clients['R'] = _score(clients['Recencia_Dias'], partitions, bins, False)
+    clients['F'] = _score(clients['Frecuencia'], partitions, bins)
+    clients['M'] = _score(clients['Monto'], partitions, bins)
+    clients['RFM'] = (clients['R'].astype(np.uint16) * 100 +
+                      clients['F'].astype(np.uint16) * 10 + clients['M'])
+    value: np.ndarray = (clients['F'].to_numpy() + clients['M'].to_numpy()
+                         ) / 2 * RFM_BINS / bins
+    recency: np.ndarray = clients['R'].to_numpy() * RFM_BINS / bins
+    clients['Segmento'] = pd.Categorical(np.select(
+        [(recency >= minimum_recency) & (value >= minimum_value) for
+         minimum_recency, minimum_value in RFM_SEGMENTS.values()],
+        list(RFM_SEGMENTS), 'Lost'), list(RFM_SEGMENTS))
+    return clients.rename(columns={'Monto': 'Monto_Facturado $'})
+
+
+def abc_classes(
+        dataframe: pd.DataFrame, key: str = 'ID_SKU',
+        by: Optional[str] = None, value: str = 'Monto_Facturado $',
+        thresholds: Optional[dict[str, float]] = None
+) -> pd.DataFrame:
+    """
+    ABC (Pareto) class of each value of a key by its share of the sales.
+     The values are sorted by sales once, and each one takes the first
+     class whose cumulative share threshold was not reached before it, so
+     the classes split at 80 and 95 percent of the sales by default
+    :param dataframe: Sales with the columns of filter_desired_columns
+    :type dataframe: pd.DataFrame
+    :param key: Column to classify, such as 'ID_SKU' or 'Familia_SKU'. The
+     default is 'ID_SKU'
+    :type key: str
+    :param by: Column to classify each partition apart, such as
+     'ID_Territorio'. The default is None
+    :type by: str
+    :param value: Column of the sales. The default is 'Monto_Facturado $'
+    :type value: str
+    :param thresholds: Cumulative share where each class ends, the last
+     class taking the rest. The default is None (ABC_THRESHOLDS)
+    :type thresholds: dict[str, float]
+    :return: Sales, share, cumulative share and class of each value
+    :rtype: pd.DataFrame
+    """
+    thresholds = thresholds or ABC_THRESHOLDS
+    items: pd.DataFrame = _aggregate(dataframe, key, by, **{
+        value: (value, 'sum')})
+    items = items.sort_values(
+        ([by] if by else []) + [value], ascending=[True] * bool(by) + [
+            False], kind='stable', ignore_index=True)
+    totals: pd.Series = items[value].sum() if by is None else \
+        items.groupby(by, sort=False)[value].transform('sum')
+    items['Participacion'] = items[value] / totals
+    cumulative: pd.Series = items['Participacion'] if by is None else \
+        items.groupby(by, sort=False)['Participacion']
+    items['Participacion_Acum'] = cumulative.cumsum()
+    previous: np.ndarray = (items['Participacion_Acum'] - items[
+        'Participacion']).to_numpy()
+    labels: list[str] = list(thresholds) + [chr(ord(max(thresholds)) + 1)]
+    items['Clase_ABC'] = pd.Categorical.from_codes(np.searchsorted(
+        np.array(list(thresholds.values())), previous, 'right'),
+        labels)
+    return items
+
+
+def segment_table(
+        dataframe: pd.DataFrame, by: Optional[str] = None
+) -> pd.DataFrame:
+    """
+    Compact table with the RFM segment of every client and the ABC class
+     of every SKU and SKU family, one row per entity and partition
+    :param dataframe: Sales with the columns of filter_desired_columns
+    :type dataframe: pd.DataFrame
+    :param by: Column to segment each partition apart, such as
+     'ID_Territorio'. The default is None
+    :type by: str
+    :return: Dimension, key, segment, RFM score (0 for the ABC classes),
+     sales and share of the sales of each entity
+    :rtype: pd.DataFrame
+    """
+    clients: pd.DataFrame = rfm_scores(dataframe, by)
+    totals: pd.Series = clients['Monto_Facturado $'].sum() if by is None \
+        else clients.groupby(by)['Monto_Facturado $'].transform('sum')
+    clients['Participacion'] = clients['Monto_Facturado $'] / totals
+    parts: dict[str, pd.DataFrame] = {'ID_Cliente': clients, **{
+        key: abc_classes(dataframe, key, by) for key in ABC_KEYS}}
+    frames: list[pd.DataFrame] = list(parts.values())
+    table: pd.DataFrame = pd.DataFrame({
+        'Dimension': pd.Categorical.from_codes(np.repeat(
+            np.arange(len(parts)), [len(frame) for frame in frames]),
+            list(parts)),
+        'Clave': union_categoricals([
+            _text_categorical(frame[key]) for key, frame in parts.items()]),
+        'Segmento': union_categoricals([
+            frame['Segmento' if key == 'ID_Cliente' else 'Clase_ABC'].array
+            for key, frame in parts.items()]),
+        'Puntaje': np.concatenate([frame['RFM'].to_numpy(np.uint16) if
+                                   key == 'ID_Cliente' else np.zeros(
+            len(frame), np.uint16) for key, frame in parts.items()]),
+        **{column: np.concatenate([frame[column].to_numpy() for frame in
+                                   frames])
+           for column in ['Monto_Facturado $', 'Participacion']}})
+    if by is not None:
+        table.insert(0, by, np.concatenate(
+            [frame[by].to_numpy() for frame in frames]))
+    return table
+
+
+def save_segments(
+        table: pd.DataFrame, filename: str = 'segments',
+        data_type: DataType = DataType.PROCESSED
+) -> str:
+    """
+    Save the segment table as Parquet
+    :param table: The table returned by segment_table
+    :type table: pd.DataFrame
+    :param filename: Name of the file without extension. The default is
+     'segments'
+    :type filename: str
+    :param data_type: Folder where the table will be saved. The default
+     is PROCESSED
+    :type data_type: DataType
+    :return: Path of the saved table
+    :rtype: str
+    """
+    filepath: str = f'{data_type.value}{filename}.parquet'
+    table.to_parquet(filepath, index=False)
+    logger.info("Segment table with %s rows saved to %s", len(table),
+                filepath)
+    return filepath
@@ -0,0 +1,222 @@
+"""
+Shared statistics cache script
+"""
+import hashlib
+import logging
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Optional, Union
+import pandas as pd
+from analysis.profiler import DataFrameProfiler, plain
+
+logger: logging.Logger = logging.getLogger(__name__)
+STATS_CACHE_SIZE: int = 64
+Frame = Union[pd.DataFrame, pd.Series]
+
+
+class StatsCache:
+    """
+    Least recently used cache of the statistics of dataframes, so the EDA
+     and the plots of the same data scan it once per statistic. Entries are
+     keyed by a fingerprint of the content of the frame, so shallow copies
+     and equal frames share them. The fingerprint of each frame object is
+     computed once, so frames must not be modified in place after their
+     statistics are cached. Statistics are computed without holding the
+     lock, so concurrent stages only wait for each other when they need
+     the same statistic
+    """
+
+    def __init__(self, maxsize: int = STATS_CACHE_SIZE):
+        self.maxsize: int = maxsize
+        self.entries: OrderedDict[tuple, Any] = OrderedDict()
+        self.fingerprints: dict[int, tuple[weakref.ref, str]] = {}
+        self.pending: dict[tuple, Future] = {}
+        self.hits: int = 0
+        self.misses: int = 0
+        self.lock: threading.Lock = threading.Lock()
+
+    def fingerprint(self, dataframe: Frame) -> str:
+        """
+        Hash of the columns, dtypes, index and values of a frame, memoized
+         while the frame object is alive
+        :param dataframe: The frame to identify
+        :type dataframe: Frame
+        :return: The hexadecimal digest of the frame
+        :rtype: str
+        """
+        identity: int = id(dataframe)
+        with self.lock:
+            known: Optional[tuple[weakref.ref, str]] = \
+                self.fingerprints.get(identity)
+        if known is not None and known[0]() is dataframe:
+            return known[1]
+        digest = hashlib.blake2b(digest_size=16)
+        columns: pd.Series = dataframe.dtypes if isinstance(
+            dataframe, pd.DataFrame) else pd.Series(
+            {dataframe.name: dataframe.dtype})
+        digest.update(repr(list(columns.astype(str).items())).encode())
+        digest.update(pd.util.hash_pandas_object(
+            dataframe, index=True).to_numpy().tobytes())
+        fingerprint: str = digest.hexdigest()
+        with self.lock:
+            self.fingerprints[identity] = (weakref.ref(
+                dataframe, lambda _reference: self.fingerprints.pop(
+                    identity, None)), fingerprint)
+            return fingerprint
+
+    def memoize(
+            self, dataframe: Frame, statistic: str, arguments: tuple,
+            compute: Callable[[], Any]
+    ) -> Any:
+        """
+        Statistic of a frame from the cache, computing it on a miss and
+         evicting the least recently used entry when the cache is full. A
+         statistic being computed by another thread is waited for instead
+         of computed again
+        :param dataframe: The frame of the statistic
+        :type dataframe: Frame
+        :param statistic: Name of the statistic
+        :type statistic: str
+        :param arguments: Arguments that change the statistic
+        :type arguments: tuple
+        :param compute: Function computing the statistic
+        :type compute: Callable[[], Any]
+        :return: The statistic
+        :rtype: Any
+        """
+        key: tuple = (self.fingerprint(dataframe), statistic, arguments)
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                logger.debug("Statistics cache hit for %s%s", statistic,
+                             arguments)
+                return self.entries[key]
+            pending: Optional[Future] = self.pending.get(key)
+            if pending is None:
+                self.misses += 1
+                self.pending[key] = Future()
+            else:
+                self.hits += 1
+        if pending is not None:
+            return pending.result()
+        try:
+            value: Any = compute()
+        except BaseException as error:
+            with self.lock:
+                self.pending.pop(key).set_exception(error)
+            raise
+        with self.lock:
+            self.entries[key] = value
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+            self.pending.pop(key).set_result(value)
+        return value
+
+    def value_counts(self, dataframe: pd.DataFrame, column: str) -> pd.Series:
+        """
+        Counts of each value of a column, missing values included, with
+         categorical columns converted by plain
+        :param dataframe: The dataframe
+        :type dataframe: pd.DataFrame
+        :param column: Name of the column
+        :type column: str
+        :return: The counts sorted by frequency
+        :rtype: pd.Series
+        """
+        return self.memoize(dataframe, 'value_counts', (column,), lambda:
+                            plain(dataframe[column]).value_counts(
+                                dropna=False))
+
+    def frequency(
+            self, dataframe: pd.DataFrame, columns: list[str]
+    ) -> pd.DataFrame:
+        """
+        Joint frequencies of a group of columns, like
+         SummaryAccumulator.frequency without binning
+        :param dataframe: The dataframe
+        :type dataframe: pd.DataFrame
+        :param columns: The columns to group by
+        :type columns: list[str]
+        :return: Dataframe with the distinct values and their 'count'
+        :rtype: pd.DataFrame
+        """
+        return self.memoize(
+            dataframe, 'frequency', tuple(columns), lambda: dataframe[
+                columns].apply(plain).groupby(columns, dropna=True).size(
+            ).rename('count').reset_index())
+
+    def corr(
+            self, dataframe: pd.DataFrame, columns: Optional[list[str]] = None
+    ) -> pd.DataFrame:
+        """
+        Pearson correlation of the numeric columns, computed once for all
+         of them
+        :param dataframe: The dataframe
+        :type dataframe: pd.DataFrame
+        :param columns: Columns of the matrix to return. The default is None
+         (every numeric column)
+        :type columns: list[str]
+        :return: The correlation matrix
+        :rtype: pd.DataFrame
+        """
+        correlation: pd.DataFrame = self.memoize(
+            dataframe, 'corr', (), lambda: dataframe.corr(numeric_only=True))
+        return correlation if columns is None else correlation.loc[
+            columns, columns]
+
+    def profile(
+            self, dataframe: pd.DataFrame, exact: bool = True
+    ) -> DataFrameProfiler:
+        """
+        Profile of the dataframe built from the cached value counts
+        :param dataframe: The dataframe
+        :type dataframe: pd.DataFrame
+        :param exact: Whether to compute exact distinct counts and
+         quantiles. The default is True
+        :type exact: bool
+        :return: The profiler of the dataframe
+        :rtype: DataFrameProfiler
+        """
+        return self.memoize(
+            dataframe, 'profile', (exact,), lambda: DataFrameProfiler(
+                exact).update(dataframe, {
+                    column: self.value_counts(dataframe, column)
+                    for column in dataframe.columns}))
+
+    def describe(self, dataframe: pd.DataFrame) -> pd.DataFrame:
+        """
+        Descriptive statistics of every column like
+         describe(include='all', datetime_is_numeric=True)
+        :param dataframe: The dataframe
+        :type dataframe: pd.DataFrame
+        :return: The descriptive statistics
+        :rtype: pd.DataFrame
+        """
+        return self.memoize(dataframe, 'describe', (), lambda: self.profile(
+            dataframe).describe())
+
+    def info(self) -> dict[str, int]:
+        """
+        Usage of the cache
+        :return: Hits, misses and number of entries
+        :rtype: dict[str, int]
+        """
+        return {'hits': self.hits, 'misses': self.misses,
+                'entries': len(self.entries)}
+
+    def clear(self) -> None:
+        """
+        Remove every entry and reset the usage counters
+        :return: None
+        :rtype: NoneType
+        """
+        with self.lock:
+            self.entries.clear()
+            self.fingerprints.clear()
+            self.hits = self.misses = 0
+
+
+STATS: StatsCache = StatsCache()
@@ -0,0 +1,183 @@
+"""
+Mergeable summary statistics script
+"""
+import logging
+from typing import Optional
+import numpy as np
+import pandas as pd
+from analysis.profiler import DataFrameProfiler, log_bins, plain
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+class SummaryAccumulator:
+    """
+    Mergeable accumulator of summary statistics for dataframe chunks. It
+     keeps a profile per column, the pairwise co-moments of the numeric
+     columns and the joint frequencies of the column groups to plot. The
+     continuous columns are sketched in the profile and binned in the
+     frequencies, so the state does not grow with their distinct values
+    """
+
+    def __init__(
+            self, frequencies: Optional[dict[str, list[str]]] = None,
+            continuous: Optional[list[str]] = None
+    ):
+        self.frequency_columns: dict[str, list[str]] = frequencies or {}
+        self.continuous: list[str] = continuous or []
+        self.head: Optional[pd.DataFrame] = None
+        self.dtypes: Optional[pd.Series] = None
+        self.profiler: DataFrameProfiler = DataFrameProfiler(
+            sketched=self.continuous)
+        self.frequencies: dict[str, pd.Series] = {}
+        self.numeric_columns: list[str] = []
+        self.pairs: Optional[np.ndarray] = None
+        self.means: Optional[np.ndarray] = None
+        self.squares: Optional[np.ndarray] = None
+        self.comoments: Optional[np.ndarray] = None
+
+    def update(self, chunk: pd.DataFrame) -> 'SummaryAccumulator':
+        """
+        Accumulate the statistics of a new chunk
+        :param chunk: The chunk of rows to accumulate
+        :type chunk: pd.DataFrame
+        :return: The accumulator itself
+        :rtype: SummaryAccumulator
+        """
+        other: SummaryAccumulator = SummaryAccumulator(
+            self.frequency_columns, self.continuous)
+        other.head = chunk.head()
+        other.dtypes = chunk.dtypes
+        other.profiler.update(chunk)
+        for name, columns in self.frequency_columns.items():
+            subset: pd.DataFrame = chunk[columns].apply(plain)
+            for column in set(columns).intersection(self.continuous):
+                subset[column] = log_bins(subset[column].to_numpy())
+            other.frequencies[name] = subset.groupby(
+                columns, dropna=True).size()
+        numeric: pd.DataFrame = chunk.select_dtypes('number')
+        other.numeric_columns = list(numeric.columns)
+        other.pair_moments(numeric.to_numpy(dtype='float64'))
+        return self.merge(other)
+
+    def pair_moments(self, values: np.ndarray) -> None:
+        """
+        Count, means, squared deviations and co-moments of every pair of
+         columns over the rows where both have a value, like the pairwise
+         complete observations of DataFrame.corr
+        :param values: The numeric columns of a chunk with NaN as missing
+        :type values: np.ndarray
+        :return: None
+        :rtype: NoneType
+        """
+        present: np.ndarray = ~np.isnan(values)
+        observed: np.ndarray = present.astype('float64')
+        filled: np.ndarray = np.where(present, values, 0.0)
+        shift: np.ndarray = filled.sum(axis=0) / np.maximum(
+            present.sum(axis=0), 1)
+        centered: np.ndarray = np.where(present, values - shift, 0.0)
+        self.pairs = observed.T @ observed
+        sums: np.ndarray = centered.T @ observed
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means: np.ndarray = np.where(
+                self.pairs > 0, sums / self.pairs, 0.0)
+        self.means = means + shift[:, np.newaxis]
+        self.squares = (centered ** 2).T @ observed - sums * means
+        self.comoments = centered.T @ centered - sums * means.T
+
+    def merge(self, other: 'SummaryAccumulator') -> 'SummaryAccumulator':
+        """
+        Merge the statistics of another accumulator into this one
+        :param other: The accumulator to merge
+        :type other: SummaryAccumulator
+        :return: The accumulator itself
+        :rtype: SummaryAccumulator
+        """
+        if self.head is None:
+            self.head, self.dtypes = other.head, other.dtypes
+        self.profiler.merge(other.profiler)
+        for name, frequency in other.frequencies.items():
+            self.frequencies[name] = frequency if \
+                name not in self.frequencies else \
+                self.frequencies[name].add(frequency, fill_value=0)
+        if other.pairs is None:
+            return self
+        if self.pairs is None:
+            self.numeric_columns = other.numeric_columns
+            self.pairs, self.means = other.pairs, other.means
+            self.squares, self.comoments = other.squares, other.comoments
+            return self
+        total: np.ndarray = self.pairs + other.pairs
+        delta: np.ndarray = other.means - self.means
+        with np.errstate(invalid='ignore', divide='ignore'):
+            weight: np.ndarray = np.where(
+                total > 0, self.pairs * other.pairs / total, 0.0)
+            self.means = self.means + np.where(
+                total > 0, delta * other.pairs / total, 0.0)
+        self.squares = self.squares + other.squares + delta ** 2 * weight
+        self.comoments = self.comoments + other.comoments + \
+            delta * delta.T * weight
+        self.pairs = total
+        return self
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        """
+        Shape of the accumulated rows
+        :return: Number of rows and columns
+        :rtype: tuple[int, int]
+        """
+        return self.profiler.rows, len(self.profiler.columns)
+
+    def value_counts(
+            self, column: str, normalize: bool = False
+    ) -> pd.Series:
+        """
+        Value counts of a column sorted by frequency
+        :param column: Name of the column
+        :type column: str
+        :param normalize: Whether to return proportions. The default is
+         False
+        :type normalize: bool
+        :return: The counts of each value
+        :rtype: pd.Series
+        """
+        return self.profiler.columns[column].value_counts(normalize)
+
+    def frequency(self, name: str) -> pd.DataFrame:
+        """
+        Joint frequencies of a group of columns, with the continuous
+         columns binned
+        :param name: Name of the column group
+        :type name: str
+        :return: Dataframe with the distinct values and their 'count'
+        :rtype: pd.DataFrame
+        """
+        frequency: pd.Series = self.frequencies[name]
+        return frequency[frequency > 0].astype('int64').rename(
+            'count').reset_index()
+
+    def corr(self) -> pd.DataFrame:
+        """
+        Pearson correlation of the numeric columns, each pair over the rows
+         where both have a value
+        :return: The correlation matrix
+        :rtype: pd.DataFrame
+        """
+        if self.pairs is None:
+            return pd.DataFrame()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            correlation: np.ndarray = np.where(
+                self.pairs > 1, self.comoments / np.sqrt(
+                    self.squares * self.squares.T), np.nan)
+        return pd.DataFrame(correlation, index=self.numeric_columns,
+                            columns=self.numeric_columns)
+
+    def describe(self) -> pd.DataFrame:
+        """
+        Descriptive statistics of every column like
+         describe(include='all', datetime_is_numeric=True)
+        :return: The descriptive statistics
+        :rtype: pd.DataFrame
+        """
+        return self.profiler.describe()
@@ -2,18 +2,221 @@
 Visualization script
 """
 import itertools
+import logging
 import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Iterable, Optional, Union
+import matplotlib
 import numpy as np
 import pandas as pd
 import seaborn as sns
 from matplotlib import pyplot as plt, cm
+from pandas.api.types import is_bool_dtype, is_numeric_dtype
+from analysis.figure_cache import cached_figure, defer_manifest, \
+    record_figures, save_figure, take_pending_entries
+from analysis.profiler import plain, weighted_quantiles
+from analysis.stats_cache import STATS
 from core.config import FIG_SIZE, FONT_SIZE, PALETTE, RE_PATTERN, RE_REPL
 from engineering.persistence_manager import DataType
 
+logger: logging.Logger = logging.getLogger(__name__)
+PlotTask = tuple[str, Any, tuple, dict]
+DISTRIBUTION_BINS: int = 50
+KDE_GRID_SIZE: int = 256
+TOP_HUE: int = 10
+MAX_SCATTER_POINTS: int = 5000
+OTHER_LABEL: str = 'Other'
 
+
+def set_headless() -> None:
+    """
+    Force the non-interactive Agg backend so figures are only saved
+    :return: None
+    :rtype: NoneType
+    """
+    matplotlib.use('Agg', force=True)
+
+
+def _show_and_close() -> None:
+    """
+    Show the current figures unless rendering headless and release them
+    :return: None
+    :rtype: NoneType
+    """
+    if matplotlib.get_backend().lower() != 'agg':
+        plt.show()
+    plt.close('all')
+
+
+def _init_worker() -> None:
+    """
+    Prepare a batch worker to render headless and hand its figure
+     manifest entries back to the parent process
+    :return: None
+    :rtype: NoneType
+    """
+    set_headless()
+    defer_manifest()
+
+
+def render_plot(
+        name: str, data: Any, args: tuple, kwargs: dict,
+        refresh_cache: bool = False
+) -> tuple[str, list]:
+    """
+    Render a single plot function of this module
+    :param name: Name of the plot function
+    :type name: str
+    :param data: Series or dataframe with only the columns the plot uses
+    :type data: Any
+    :param args: Remaining positional arguments of the plot function
+    :type args: tuple
+    :param kwargs: Keyword arguments of the plot function
+    :type kwargs: dict
+    :param refresh_cache: Whether to render even if the images are
+     unchanged. The default is False
+    :type refresh_cache: bool
+    :return: Name of the plot function and its deferred manifest entries
+    :rtype: tuple[str, list]
+    """
+    globals()[name](data, *args, refresh_cache=refresh_cache, **kwargs)
+    return name, take_pending_entries()
+
+
+def render_plots(
+        tasks: Iterable[PlotTask], batch: bool = False,
+        workers: Optional[int] = None, refresh_cache: bool = False
+) -> None:
+    """
+    Render plot tasks sequentially or, in batch mode, headless over a
+     process pool where each worker only receives the data of its plot
+    :param tasks: Plot function names with their data, args and kwargs
+    :type tasks: Iterable[PlotTask]
+    :param batch: Whether to render headless in a process pool. The
+     default is False
+    :type batch: bool
+    :param workers: Number of processes for batch mode. The default is
+     None (number of CPUs)
+    :type workers: int
+    :param refresh_cache: Whether to render even if the images are
+     unchanged. The default is False
+    :type refresh_cache: bool
+    :return: None
+    :rtype: NoneType
+    """
+    if not batch:
+        for task in tasks:
+            render_plot(*task, refresh_cache=refresh_cache)
+        return
+    with ProcessPoolExecutor(workers, initializer=_init_worker) as executor:
+        futures: list = [executor.submit(
+            render_plot, *task, refresh_cache=refresh_cache)
+            for task in tasks]
+        for future in futures:
+            name, entries = future.result()
+            for data_type, entry in entries:
+                record_figures(entry, data_type)
+            logger.info("Rendered %s", name)
+
+
+def _is_continuous(values: Union[pd.Index, pd.Series]) -> bool:
+    """
+    Check if the values can be binned on a numeric axis
+    :param values: The values of a column
+    :type values: Union[pd.Index, pd.Series]
+    :return: True if the values are numeric and not boolean
+    :rtype: bool
+    """
+    return is_numeric_dtype(values) and not is_bool_dtype(values)
+
+
+def aggregate_counts(
+        df_column: pd.Series, weights: Optional[np.ndarray] = None
+) -> pd.Series:
+    """
+    Count the rows of each distinct value of a column
+    :param df_column: Single column
+    :type df_column: pd.Series
+    :param weights: Count of each value when the column holds distinct
+     values instead of rows. The default is None
+    :type weights: np.ndarray
+    :return: Counts indexed by the sorted distinct values
+    :rtype: pd.Series
+    """
+    column: pd.Series = plain(df_column)
+    if weights is None:
+        return column.value_counts(dropna=True).sort_index()
+    counts: pd.Series = pd.Series(weights, index=column.to_numpy())
+    return counts[counts.index.notna()].groupby(level=0).sum().sort_index()
+
+
+def binned_kde(
+        values: np.ndarray, counts: np.ndarray,
+        grid_size: int = KDE_GRID_SIZE
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Gaussian kernel density estimate evaluated on a fixed grid by binning
+     the weighted values and convolving the bins with the kernel, with
+     the bandwidth of Scott's rule like seaborn
+    :param values: Distinct values
+    :type values: np.ndarray
+    :param counts: Count of each value
+    :type counts: np.ndarray
+    :param grid_size: Number of points of the grid. The default is
+     KDE_GRID_SIZE
+    :type grid_size: int
+    :return: The grid and the density at each of its points
+    :rtype: tuple[np.ndarray, np.ndarray]
+    """
+    total: float = counts.sum()
+    mean: float = np.average(values, weights=counts)
+    deviation: float = np.sqrt(np.average(
+        (values - mean) ** 2, weights=counts))
+    if not total or not deviation:
+        return np.array([]), np.array([])
+    bandwidth: float = deviation * total ** (-1 / 5)
+    grid: np.ndarray = np.linspace(
+        values.min() - 3 * bandwidth, values.max() + 3 * bandwidth,
+        grid_size)
+    step: float = grid[1] - grid[0]
+    binned, _ = np.histogram(
+        values, bins=grid_size,
+        range=(grid[0] - step / 2, grid[-1] + step / 2), weights=counts)
+    half_width: int = min(int(np.ceil(4 * bandwidth / step)),
+                          (grid_size - 1) // 2)
+    offsets: np.ndarray = np.arange(-half_width, half_width + 1) * step
+    kernel: np.ndarray = np.exp(-0.5 * (offsets / bandwidth) ** 2) / (
+            bandwidth * np.sqrt(2 * np.pi))
+    return grid, np.convolve(binned, kernel, mode='same') / total
+
+
+def weighted_corr(
+        dataframe: pd.DataFrame, columns: list[str], weights: str
+) -> pd.DataFrame:
+    """
+    Pearson correlation of the columns of pre-aggregated frequencies
+    :param dataframe: Distinct values with their counts
+    :type dataframe: pd.DataFrame
+    :param columns: Numeric columns to correlate
+    :type columns: list[str]
+    :param weights: Column with the count of each row
+    :type weights: str
+    :return: The correlation matrix
+    :rtype: pd.DataFrame
+    """
+    dataframe = dataframe.dropna(subset=columns)
+    covariance: np.ndarray = np.cov(
+        dataframe[columns].to_numpy(dtype='float64').T,
+        fweights=dataframe[weights].to_numpy(dtype='int64'))
+    deviations: np.ndarray = np.sqrt(np.diag(covariance))
+    return pd.DataFrame(covariance / np.outer(deviations, deviations),
+                        index=columns, columns=columns)
+
+
+@cached_figure
 def plot_count(
         dataframe: pd.DataFrame, variables: list, hue: str,
-        data_type: DataType = DataType.FIGURES
+        data_type: DataType = DataType.FIGURES, weights: Optional[str] = None
 ) -> None:
     """
     This method plots the counts of observations from the given variables
@@ -26,29 +229,47 @@ def plot_count(
     :param data_type: Path where data will be saved: RAW or
      PROCESSED. The default is FIGURES
     :type data_type: DataType
+    :param weights: Column with the count of each row when the dataframe
+     holds pre-aggregated frequencies. The default is None
+    :type weights: str
     :return: None
     :rtype: NoneType
     """
+    if weights is None:
+        weights = 'count'
+        dataframe = dataframe[[*variables, hue]].assign(count=1)
     plt.figure(figsize=FIG_SIZE)
     plt.suptitle('Count-plot for Discrete variables')
     plot_iterator: int = 1
     for i in variables:
         plt.subplot(1, len(variables), plot_iterator)
-        sns.countplot(x=dataframe[i], hue=dataframe[hue], palette=PALETTE)
+        variable: pd.Series = plain(dataframe[i])
+        if _is_continuous(variable) and \
+                variable.nunique() > DISTRIBUTION_BINS:
+            variable = pd.cut(variable, DISTRIBUTION_BINS, precision=0)
+        counts: pd.DataFrame = dataframe.groupby(
+            [variable, hue], observed=True)[weights].sum().reset_index()
+        sns.barplot(x=i, y=weights, hue=hue, data=counts, palette=PALETTE,
+                    estimator=sum, errorbar=None)
         label = re.sub(pattern=RE_PATTERN, repl=RE_REPL, string=i)
         plt.xlabel(label, fontsize=15)
         plt.ylabel('Count', fontsize=15)
         plot_iterator += 1
-        plt.savefig(f'{data_type.value}discrete_{i}.png')
-        plt.show()
+        save_figure(f'{data_type.value}discrete_{i}.png')
+    _show_and_close()
 
 
+@cached_figure
 def plot_distribution(
-        df_column: pd.Series, color: str,data_type: DataType = DataType.FIGURES
+        df_column: pd.Series, color: str,
+        data_type: DataType = DataType.FIGURES,
+        weights: Optional[np.ndarray] = None, bins: int = DISTRIBUTION_BINS
 ) -> None:
     """
     This method plots the distribution of the given quantitative continuous
-    variable
+    variable. The rows are counted per distinct value first, so drawing
+     the histogram and the KDE depends on the bins and not on the rows.
+     Text values are drawn as bars of the most frequent bins - 1 values
     :param df_column: Single column
     :type df_column: pd.Series
     :param color: color for the distribution
@@ -56,22 +277,83 @@ def plot_distribution(
     :param data_type: Path where data will be saved: RAW or
      PROCESSED. The default is FIGURES
     :type data_type: DataType
+    :param weights: Count of each value when the column holds distinct
+     values instead of rows. The default is None
+    :type weights: np.ndarray
+    :param bins: Number of bins of the histogram. The default is
+     DISTRIBUTION_BINS
+    :type bins: int
     :return: None
     :rtype: NoneType
     """
     label: str = re.sub(
         pattern=RE_PATTERN, repl=RE_REPL, string=str(df_column.name))
-    sns.displot(x=df_column, kde=True, color=color, height=8, aspect=1.875)
+    counts: pd.Series = aggregate_counts(df_column, weights)
+    numbers: pd.Index = pd.Index(pd.to_numeric(counts.index, errors='coerce'))
+    plt.figure(figsize=FIG_SIZE)
+    if _is_continuous(numbers) and numbers.notna().all():
+        values: np.ndarray = numbers.to_numpy(dtype='float64')
+        frequency: np.ndarray = counts.to_numpy(dtype='float64')
+        histogram, edges = np.histogram(values, bins=bins, weights=frequency)
+        plt.bar(edges[:-1], histogram, width=np.diff(edges), align='edge',
+                color=color, edgecolor='white', alpha=0.75)
+        grid, density = binned_kde(values, frequency)
+        plt.plot(grid, density * frequency.sum() * np.diff(edges).mean(),
+                 color=color)
+    else:
+        counts = counts.sort_values(ascending=False)
+        if counts.shape[0] > bins:
+            counts = pd.concat([counts.iloc[:bins - 1], pd.Series(
+                [counts.iloc[bins - 1:].sum()], index=[OTHER_LABEL])])
+        plt.bar(counts.index.astype(str), counts.to_numpy(), color=color)
     plt.title('Distribution Plot for ' + label)
     plt.xlabel(label, fontsize=FONT_SIZE)
     plt.ylabel('Frequency', fontsize=FONT_SIZE)
-    plt.savefig(f'{data_type.value}{str(df_column.name)}.png')
-    plt.show()
+    save_figure(f'{data_type.value}{str(df_column.name)}.png')
+    _show_and_close()
+
+
+def _weighted_box_stats(
+        dataframe: pd.DataFrame, first_variable: str, second_variable: str,
+        weights: str
+) -> list[dict]:
+    """
+    Compute the boxplot statistics of the first variable for each group of
+     the second variable from pre-aggregated frequencies
+    :param dataframe: Distinct values with their counts
+    :type dataframe: pd.DataFrame
+    :param first_variable: Variable to describe
+    :type first_variable: str
+    :param second_variable: Variable to group by
+    :type second_variable: str
+    :param weights: Column with the count of each row
+    :type weights: str
+    :return: Statistics per group as expected by Axes.bxp
+    :rtype: list[dict]
+    """
+    stats: list[dict] = []
+    for group, frequency in dataframe.groupby(second_variable, sort=True):
+        counts: pd.Series = frequency.groupby(first_variable)[weights].sum()
+        first_quartile, median, third_quartile = weighted_quantiles(
+            counts, [0.25, 0.5, 0.75])
+        iqr: float = third_quartile - first_quartile
+        values: np.ndarray = counts.index.to_numpy()
+        inside: np.ndarray = values[
+            (values >= first_quartile - 1.5 * iqr) &
+            (values <= third_quartile + 1.5 * iqr)]
+        stats.append({
+            'label': str(group), 'med': median, 'q1': first_quartile,
+            'q3': third_quartile, 'whislo': inside.min(),
+            'whishi': inside.max(),
+            'fliers': values[(values < inside.min()) |
+                             (values > inside.max())]})
+    return stats
 
 
+@cached_figure
 def boxplot_dist(
         dataframe: pd.DataFrame, first_variable: str, second_variable: str,
-        data_type: DataType = DataType.FIGURES
+        data_type: DataType = DataType.FIGURES, weights: Optional[str] = None
 ) -> None:
     """
     This method plots the distribution of the first variable data
@@ -85,6 +367,9 @@ def boxplot_dist(
     :param data_type: Path where data will be saved: RAW or
      PROCESSED. The default is FIGURES
     :type data_type: DataType
+    :param weights: Column with the count of each row when the dataframe
+     holds pre-aggregated frequencies. The default is None
+    :type weights: str
     :return: None
     :rtype: NoneType
     """
@@ -93,22 +378,59 @@ def boxplot_dist(
         pattern=RE_PATTERN, repl=RE_REPL, string=first_variable)
     y_label: str = re.sub(
         pattern=RE_PATTERN, repl=RE_REPL, string=second_variable)
-    sns.boxplot(x=first_variable, y=second_variable, data=dataframe,
-                palette=PALETTE)
+    if weights:
+        stats: list[dict] = _weighted_box_stats(
+            dataframe, first_variable, second_variable, weights)
+        boxes: dict = plt.gca().bxp(stats, vert=False, patch_artist=True)
+        for box, color in zip(boxes['boxes'], sns.color_palette(
+                PALETTE, len(stats))):
+            box.set_facecolor(color)
+    else:
+        sns.boxplot(x=first_variable, y=second_variable, data=dataframe,
+                    palette=PALETTE, orient='h')
     plt.title(x_label + ' in regards to ' + y_label, fontsize=FONT_SIZE)
     plt.xlabel(x_label, fontsize=FONT_SIZE)
     plt.ylabel(y_label, fontsize=FONT_SIZE)
-    plt.savefig(
+    save_figure(
         f'{data_type.value}discrete_{first_variable}_{second_variable}.png')
-    plt.show()
+    _show_and_close()
+
+
+def _group_hue(
+        dataframe: pd.DataFrame, hue: str, weights: str, top_n: int
+) -> pd.Series:
+    """
+    Keep the top_n most frequent hue values and group the rest together
+    :param dataframe: Rows or distinct values with their counts
+    :type dataframe: pd.DataFrame
+    :param hue: Grouping variable
+    :type hue: str
+    :param weights: Column with the count of each row
+    :type weights: str
+    :param top_n: Number of hue values to keep
+    :type top_n: int
+    :return: The hue label of each row
+    :rtype: pd.Series
+    """
+    column: pd.Series = plain(dataframe[hue])
+    top: pd.Index = dataframe.groupby(column)[weights].sum().nlargest(
+        top_n).index
+    return column.astype(str).where(column.isin(top), OTHER_LABEL)
 
 
+@cached_figure
 def plot_scatter(
         dataframe: pd.DataFrame, x_array: str, y_array: str, hue: str,
-        data_type: DataType = DataType.FIGURES
+        data_type: DataType = DataType.FIGURES,
+        correlation: Optional[pd.DataFrame] = None,
+        weights: Optional[str] = None, top_n: int = TOP_HUE,
+        bins: int = DISTRIBUTION_BINS
 ) -> None:
     """
-    This method plots the relationship between x and y for hue subset
+    This method plots the relationship between x and y for hue subset.
+     The rows are aggregated into distinct points per hue group, keeping
+     the top_n hue values, with marker sizes by count. When there are
+     more than MAX_SCATTER_POINTS points, a 2-D binned density is drawn
     :param dataframe: dataframe containing tweets
     :type dataframe: pd.DataFrame
     :param x_array: x-axis column name from dataframe
@@ -120,21 +442,59 @@ def plot_scatter(
     :param data_type: Path where data will be saved: RAW or
      PROCESSED. The default is FIGURES
     :type data_type: DataType
+    :param correlation: Precomputed correlation matrix including x and y.
+     The default is None
+    :type correlation: pd.DataFrame
+    :param weights: Column with the count of each row when the dataframe
+     holds pre-aggregated frequencies. The default is None
+    :type weights: str
+    :param top_n: Number of hue values to draw apart. The default is
+     TOP_HUE
+    :type top_n: int
+    :param bins: Number of bins per axis of the density. The default is
+     DISTRIBUTION_BINS
+    :type bins: int
     :return: None
     :rtype: NoneType
     """
+    if weights is None:
+        if correlation is None:
+            correlation = STATS.corr(dataframe, [x_array, y_array])
+        weights = 'count'
+        dataframe = dataframe[[x_array, y_array, hue]].assign(count=1)
+    if correlation is None:
+        correlation = weighted_corr(dataframe, [x_array, y_array], weights)
+    points: pd.DataFrame = dataframe.assign(**{hue: _group_hue(
+        dataframe, hue, weights, top_n)}).groupby(
+        [x_array, y_array, hue], observed=True)[weights].sum().reset_index()
+    points = points[points[weights] > 0]
     plt.figure(figsize=FIG_SIZE)
-    sns.scatterplot(x=x_array, data=dataframe, y=y_array, hue=hue,
-                    palette=PALETTE)
+    if points.shape[0] <= MAX_SCATTER_POINTS:
+        sns.scatterplot(x=x_array, data=points, y=y_array, hue=hue,
+                        size=weights, palette=PALETTE)
+    else:
+        logger.info("Drawing the density of %s points", points.shape[0])
+        density, x_edges, y_edges = np.histogram2d(
+            points[x_array].to_numpy(dtype='float64'),
+            points[y_array].to_numpy(dtype='float64'), bins=bins,
+            weights=points[weights].to_numpy(dtype='float64'))
+        mesh = plt.pcolormesh(x_edges, y_edges,
+                              np.ma.masked_equal(density.T, 0), cmap='Blues')
+        plt.colorbar(mesh, label='Count')
+        plt.xlabel(x_array)
+        plt.ylabel(y_array)
     label: str = re.sub(pattern=RE_PATTERN, repl=RE_REPL, string=y_array)
     plt.title(f'{x_array} Wise {label} Distribution')
-    print(dataframe[[x_array, y_array]].corr())
-    plt.savefig(f'{data_type.value}{x_array}_{y_array}_{hue}.png')
-    plt.show()
+    logger.info("Correlation of %s and %s:\n%s", x_array, y_array,
+                correlation.loc[[x_array, y_array], [x_array, y_array]])
+    save_figure(f'{data_type.value}{x_array}_{y_array}_{hue}.png')
+    _show_and_close()
 
 
+@cached_figure
 def plot_heatmap(
-        dataframe: pd.DataFrame, data_type: DataType = DataType.FIGURES
+        dataframe: pd.DataFrame, data_type: DataType = DataType.FIGURES,
+        correlation: Optional[pd.DataFrame] = None
 ) -> None:
     """
     Plot heatmap to analyze correlation between features
@@ -143,17 +503,22 @@ def plot_heatmap(
     :param data_type: Path where data will be saved: RAW or
      PROCESSED. The default is FIGURES
     :type data_type: DataType
+    :param correlation: Precomputed correlation matrix. The default is None
+    :type correlation: pd.DataFrame
     :return: None
     :rtype: NoneType
     """
     plt.figure(figsize=FIG_SIZE)
-    sns.heatmap(data=dataframe.corr(), annot=True, cmap="RdYlGn")
+    if correlation is None:
+        correlation = STATS.corr(dataframe)
+    sns.heatmap(data=correlation, annot=True, cmap="RdYlGn")
     plt.title('Heatmap showing correlations among columns',
               fontsize=FONT_SIZE)
-    plt.savefig(f'{data_type.value}correlations_heatmap.png')
-    plt.show()
+    save_figure(f'{data_type.value}correlations_heatmap.png')
+    _show_and_close()
 
 
+@cached_figure
 def plot_confusion_matrix(
         conf_matrix: np.ndarray, classes: list[str], name: str,
         normalize: bool = False, data_type: DataType = DataType.FIGURES
@@ -201,5 +566,5 @@ def plot_confusion_matrix(
     plt.tight_layout()
     plt.ylabel('True label')
     plt.xlabel('Predicted label')
-    plt.savefig(f'{data_type.value}{name}_confusion_matrix.png')
-    plt.show()
+    save_figure(f'{data_type.value}{name}_confusion_matrix.png')
+    _show_and_close()
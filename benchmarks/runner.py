@@ -0,0 +1,212 @@
+"""
+Pipeline benchmark runner script
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import tempfile
+from datetime import datetime
+from typing import Any, Callable, Optional
+import numpy as np
+import pandas as pd
+from analysis import numerical_eda, visualize_data
+from analysis.visualization import set_headless
+from benchmarks.synthetic import MAX_WORKBOOK_ROWS, extracted_frame, \
+    generate_sheets, write_workbook
+from core.decorators import StageProfiler
+from engineering.extraction import extract_raw_data
+from engineering.persistence_manager import DataType, PersistenceManager
+from engineering.transformation import feature_engineering, \
+    filter_desired_columns
+
+logger: logging.Logger = logging.getLogger(__name__)
+SIZES: list[int] = [10000, 100000, 1000000]
+STAGES: list[str] = ['numerical_eda', 'visualize_data', 'save_to_csv']
+WORKBOOK_NAME: str = 'synthetic_ventas.xlsx'
+
+
+def measure(
+        function: Callable[..., Any], *args: Any, **kwargs: Any
+) -> tuple[Any, dict[str, Any]]:
+    """
+    Call a function measuring it as a stage with traced memory
+    :param function: The function to measure
+    :type function: Callable[..., Any]
+    :return: The value of the function and its measures
+    :rtype: tuple[Any, dict[str, Any]]
+    """
+    profiler: StageProfiler = StageProfiler(trace_memory=True)
+    value: Any = profiler.run(function, *args, **kwargs)
+    return value, profiler.stages[function.__name__]
+
+
+def run_benchmark(
+        rows: int, stages: Optional[list[str]] = None, seed: int = 0
+) -> dict[str, dict[str, Any]]:
+    """
+    Benchmark the pipeline stages on a synthetic dataset. Sizes that fit
+     in a workbook are extracted from one, larger sizes start from the
+     extracted frame
+    :param rows: Number of sales lines
+    :type rows: int
+    :param stages: Stages to run after filter_desired_columns. The default
+     is None (STAGES)
+    :type stages: list[str]
+    :param seed: Seed of the synthetic data. The default is 0
+    :type seed: int
+    :return: Measures of each stage
+    :rtype: dict[str, dict[str, Any]]
+    """
+    stages = STAGES if stages is None else stages
+    results: dict[str, dict[str, Any]] = {}
+    sheets: dict[str, pd.DataFrame] = generate_sheets(rows, seed)
+    dataframe: pd.DataFrame
+    if rows <= MAX_WORKBOOK_ROWS:
+        write_workbook(sheets, WORKBOOK_NAME)
+        dataframe, results['extract_raw_data'] = measure(
+            extract_raw_data, WORKBOOK_NAME, use_cache=False)
+    else:
+        dataframe, results['extracted_frame'] = measure(
+            extracted_frame, sheets)
+    del sheets
+    dataframe, results['feature_engineering'] = measure(
+        feature_engineering, dataframe)
+    dataframe, results['filter_desired_columns'] = measure(
+        filter_desired_columns, dataframe)
+    if 'numerical_eda' in stages:
+        _, results['numerical_eda'] = measure(numerical_eda, dataframe)
+    if 'visualize_data' in stages:
+        _, results['visualize_data'] = measure(
+            visualize_data, dataframe, refresh_cache=True)
+    if 'save_to_csv' in stages:
+        _, results['save_to_csv'] = measure(
+            PersistenceManager.save_to_csv, dataframe)
+    return results
+
+
+def _version() -> Optional[str]:
+    """
+    Commit of the code being benchmarked
+    :return: The short hash of HEAD or None outside a git checkout
+    :rtype: str
+    """
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+            text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(
+        sizes: Optional[list[int]] = None,
+        stages: Optional[list[str]] = None, seed: int = 0,
+        filename: Optional[str] = None
+) -> str:
+    """
+    Benchmark every size in a scratch working directory, so the
+     workbooks, reports and outputs of the stages do not touch the
+     project, and save the measures as JSON
+    :param sizes: Numbers of sales lines. The default is None (SIZES)
+    :type sizes: list[int]
+    :param stages: Stages to run after filter_desired_columns. The default
+     is None (STAGES)
+    :type stages: list[str]
+    :param seed: Seed of the synthetic data. The default is 0
+    :type seed: int
+    :param filename: Name of the results file without extension. The
+     default is None (benchmark and the current time)
+    :type filename: str
+    :return: Path of the results
+    :rtype: str
+    """
+    set_headless()
+    report: dict[str, Any] = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'version': _version(), 'python': platform.python_version(),
+        'pandas': pd.__version__, 'numpy': np.__version__,
+        'machine': platform.machine(), 'seed': seed, 'results': {}}
+    project: str = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        try:
+            for data_type in DataType:
+                os.makedirs(data_type.value, exist_ok=True)
+            for rows in sizes or SIZES:
+                logger.info("Benchmarking %s rows", rows)
+                report['results'][str(rows)] = run_benchmark(
+                    rows, stages, seed)
+        finally:
+            os.chdir(project)
+    os.makedirs(DataType.BENCHMARKS.value, exist_ok=True)
+    filename = filename or datetime.now().strftime('benchmark_%Y%m%d_%H%M%S')
+    filepath: str = f'{DataType.BENCHMARKS.value}{filename}.json'
+    with open(filepath, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=2)
+    logger.info("Benchmark results saved to %s", filepath)
+    return filepath
+
+
+def _results_frame(filepath: str) -> pd.DataFrame:
+    """
+    Load the measures of a results file indexed by size and stage
+    :param filepath: Path of the results
+    :type filepath: str
+    :return: The measures
+    :rtype: pd.DataFrame
+    """
+    with open(filepath, encoding='utf-8') as file:
+        results: dict[str, dict] = json.load(file)['results']
+    frame: pd.DataFrame = pd.DataFrame.from_dict({
+        (int(rows), stage): measures for rows, stages in results.items()
+        for stage, measures in stages.items()}, orient='index')
+    frame.index.names = ['rows', 'stage']
+    return frame
+
+
+def compare_benchmarks(baseline: str, current: str) -> pd.DataFrame:
+    """
+    Compare the wall time and peak memory of two results files
+    :param baseline: Path of the baseline results
+    :type baseline: str
+    :param current: Path of the current results
+    :type current: str
+    :return: The measures of both and their ratio for each size and stage
+    :rtype: pd.DataFrame
+    """
+    before: pd.DataFrame = _results_frame(baseline)
+    after: pd.DataFrame = _results_frame(current)
+    comparison: pd.DataFrame = pd.DataFrame({
+        'seconds_baseline': before['seconds'],
+        'seconds_current': after['seconds'],
+        'peak_baseline': before['peak_bytes'],
+        'peak_current': after['peak_bytes'],
+        'time_ratio': after['seconds'] / before['seconds'],
+        'peak_ratio': after['peak_bytes'] / before['peak_bytes']})
+    return comparison.dropna()
+
+
+if __name__ == '__main__':
+    from core import logging_config
+    logging_config.setup_logging()
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        description='Benchmark the pipeline stages on synthetic data')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES,
+                        help='numbers of sales lines to generate')
+    parser.add_argument('--stages', nargs='*', choices=STAGES,
+                        default=STAGES,
+                        help='stages to run after filter_desired_columns')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the synthetic data')
+    parser.add_argument('--output', help='name of the results file')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='results file to compare the new results to')
+    arguments: argparse.Namespace = parser.parse_args()
+    results_path: str = run_benchmarks(
+        arguments.sizes, arguments.stages, arguments.seed, arguments.output)
+    if arguments.compare:
+        logger.info("Comparison with %s:\n%s", arguments.compare,
+                    compare_benchmarks(arguments.compare, results_path))
@@ -0,0 +1,129 @@
+"""
+Synthetic sales data script
+"""
+import logging
+import os
+import pandas as pd
+import numpy as np
+from openpyxl import Workbook
+from engineering.dimension import ProductDimension
+from engineering.extraction import SALES_COLUMNS, SALES_TYPES
+from engineering.persistence_manager import DataType
+from engineering.transformation import PRODUCT_CLEANING_SPEC, clean_columns
+from engineering.validation import sales_validator
+from engineering.workbook_reader import apply_dtypes
+
+logger: logging.Logger = logging.getLogger(__name__)
+MAX_WORKBOOK_ROWS: int = 1048575
+FAMILIES: list[str] = ['A', 'B', 'C', 'D', 'E', 'F', 'G']
+START_DATE: str = '2019-01-01'
+DAYS: int = 639
+
+
+def generate_sheets(
+        rows: int, seed: int = 0, products: int = 45, clients: int = 420,
+        territories: int = 11, warehouses: int = 3
+) -> dict[str, pd.DataFrame]:
+    """
+    Generate the Ventas and Producto sheets of a Base_de_Ventas workbook
+     with the same column formats, such as 'Cliente 01001 - Territorio 1',
+     'Producto 23001', 'Familia A' and '$12.5'
+    :param rows: Number of sales lines
+    :type rows: int
+    :param seed: Seed of the random generator. The default is 0
+    :type seed: int
+    :param products: Number of products. The default is 45
+    :type products: int
+    :param clients: Number of clients. The default is 420
+    :type clients: int
+    :param territories: Number of territories. The default is 11
+    :type territories: int
+    :param warehouses: Number of warehouses. The default is 3
+    :type warehouses: int
+    :return: The raw sheets by name
+    :rtype: dict[str, pd.DataFrame]
+    """
+    generator: np.random.Generator = np.random.default_rng(seed)
+    skus: np.ndarray = np.arange(23001, 23001 + products)
+    prices: np.ndarray = np.round(generator.lognormal(0.5, 0.6, products), 1)
+    df_products: pd.DataFrame = pd.DataFrame({
+        'Producto': [f'Producto {sku}' for sku in skus],
+        'Familia': [f'Familia {family}' for family in
+                    generator.choice(FAMILIES, products)],
+        'PVP': [f'${price}' for price in prices]})
+    client_keys: np.ndarray = np.array([
+        f'Cliente {1001 + client:05d} - Territorio {territory}'
+        for client, territory in enumerate(
+            generator.integers(1, territories + 1, clients))])
+    popularity: np.ndarray = generator.zipf(1.5, products).astype(float)
+    ordered: pd.Series = pd.Timestamp(START_DATE) + pd.to_timedelta(
+        generator.integers(0, DAYS, rows), unit='D')
+    df_sales: pd.DataFrame = pd.DataFrame({
+        'Fecha de Pedido': ordered,
+        'Cliente - Territorio': client_keys[
+            generator.integers(0, clients, rows)],
+        'SKU': generator.choice(skus, rows, p=popularity / popularity.sum()),
+        'Cantidad facturada': np.round(
+            generator.lognormal(7.5, 1.0, rows), -1).astype(np.int64) * (
+                np.where(generator.random(rows) < 0.01, -1, 1)),
+        'Bodega': np.array([
+            f'BOD-{warehouse:03d}' for warehouse in range(
+                1, warehouses + 1)])[generator.integers(0, warehouses, rows)],
+        'Fecha de Entrega': ordered + pd.to_timedelta(
+            generator.integers(0, 8, rows), unit='D')})
+    return {'Ventas': df_sales, 'Producto': df_products}
+
+
+def write_workbook(
+        sheets: dict[str, pd.DataFrame], filename: str,
+        data_type: DataType = DataType.RAW
+) -> str:
+    """
+    Write the sheets to an XLSX workbook in write-only mode, so rows are
+     streamed to the archive instead of kept as cells in memory
+    :param sheets: The sheets by name
+    :type sheets: dict[str, pd.DataFrame]
+    :param filename: Name of the workbook
+    :type filename: str
+    :param data_type: Folder of the workbook. The default is RAW
+    :type data_type: DataType
+    :return: Path of the workbook
+    :rtype: str
+    """
+    largest: int = max(sheet.shape[0] for sheet in sheets.values())
+    if largest > MAX_WORKBOOK_ROWS:
+        raise ValueError(f'{largest} rows do not fit in a worksheet of '
+                         f'{MAX_WORKBOOK_ROWS} rows')
+    workbook: Workbook = Workbook(write_only=True)
+    for name, sheet in sheets.items():
+        worksheet = workbook.create_sheet(name)
+        worksheet.append(list(sheet.columns))
+        columns: list[list] = [
+            sheet[column].dt.to_pydatetime().tolist() if
+            sheet[column].dtype.kind == 'M' else sheet[column].tolist()
+            for column in sheet.columns]
+        for row in zip(*columns):
+            worksheet.append(row)
+    os.makedirs(data_type.value, exist_ok=True)
+    filepath: str = f'{data_type.value}{filename}'
+    workbook.save(filepath)
+    logger.info("Synthetic workbook with %s rows written to %s", largest,
+                filepath)
+    return filepath
+
+
+def extracted_frame(sheets: dict[str, pd.DataFrame]) -> pd.DataFrame:
+    """
+    Turn generated sheets into the frame extract_raw_data returns, for
+     sizes that do not fit in a workbook
+    :param sheets: The raw sheets by name
+    :type sheets: dict[str, pd.DataFrame]
+    :return: The sales joined with the products
+    :rtype: pd.DataFrame
+    """
+    df_sales: pd.DataFrame = apply_dtypes(
+        sheets['Ventas'].copy(), SALES_TYPES).rename(columns=SALES_COLUMNS)
+    products: ProductDimension = ProductDimension(clean_columns(
+        sheets['Producto'].copy(), PRODUCT_CLEANING_SPEC))
+    df_sales, _ = sales_validator().validate(df_sales, products)
+    return products.join(df_sales)
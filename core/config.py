@@ -1,21 +1,18 @@
 """
-Config script
+Config script. The settings read from the environment and the .env file
+ are loaded and cast on their first access
 """
+import functools
 import os
-from dotenv import load_dotenv
+from typing import Any, Callable
 from numpy import uint8, uint16
 
 dotenv_path: str = '.env'
-load_dotenv(dotenv_path=dotenv_path)
-
-MAX_COLUMNS: int = int(os.getenv('MAX_COLUMNS'))
-WIDTH: int = int(os.getenv('WIDTH'))
-CHUNK_SIZE: uint16 = uint16(os.getenv('CHUNK_SIZE'))
-PALETTE: str = os.getenv('PALETTE')
-FONT_SIZE: uint8 = uint8(os.getenv('FONT_SIZE'))
-ENCODING: str = os.getenv('ENCODING')
-RE_PATTERN: str = os.getenv('RE_PATTERN')
-RE_REPL: str = os.getenv('RE_REPL')
+ENV_SETTINGS: dict[str, tuple[Callable[[str], Any], str]] = {
+	'MAX_COLUMNS': (int, '50'), 'WIDTH': (int, '1000'),
+	'CHUNK_SIZE': (uint16, '5000'), 'PALETTE': (str, 'pastel'),
+	'FONT_SIZE': (uint8, '15'), 'ENCODING': (str, 'UTF-8'),
+	'RE_PATTERN': (str, '([a-z])([A-Z])'), 'RE_REPL': (str, r'\g<1> \g<2>')}
 
 COLORS: list[str] = ["lightskyblue", "coral", "palegreen"]
 FIG_SIZE: tuple[uint8, uint8] = (15, 8)
@@ -27,4 +24,33 @@ NUMERICS: list[str] = [
 RANGES: list[tuple] = [
 	(0, 255), (0, 65535), (0, 4294967295), (0, 18446744073709551615),
 	(-128, 127), (-32768, 32767), (-2147483648, 2147483647),
-	(-18446744073709551616, 18446744073709551615)]
+	(-9223372036854775808, 9223372036854775807)]
+
+
+@functools.lru_cache(maxsize=None)
+def load_settings() -> dict[str, Any]:
+    """
+    Load the .env file once and cast the settings of ENV_SETTINGS, using
+     the default of each one that is not set
+    :return: The value of each setting
+    :rtype: dict[str, Any]
+    """
+    from dotenv import load_dotenv
+    load_dotenv(dotenv_path=dotenv_path)
+    return {name: cast(os.getenv(name, default)) for name, (cast, default)
+            in ENV_SETTINGS.items()}
+
+
+def __getattr__(name: str) -> Any:
+    """
+    Value of a setting of ENV_SETTINGS on its first access
+    :param name: Name of the setting
+    :type name: str
+    :return: The value of the setting
+    :rtype: Any
+    """
+    if name not in ENV_SETTINGS:
+        raise AttributeError(f'module {__name__} has no attribute {name}')
+    value: Any = load_settings()[name]
+    globals()[name] = value
+    return value
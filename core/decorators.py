@@ -1,10 +1,26 @@
 """
 Decorator script
 """
+import cProfile
 import functools
+import io
+import json
 import logging
-from time import perf_counter
-from typing import Callable, Any
+import os
+import pstats
+import sys
+import threading
+import tracemalloc
+from datetime import datetime
+from time import perf_counter, process_time, thread_time
+from typing import Callable, Any, Iterator, Optional
+import pandas as pd
+from core.logging_config import log_every_seconds
+
+try:
+    import resource
+except ImportError:
+    resource = None
 
 logger: logging.Logger = logging.getLogger(__name__)
 
@@ -40,11 +56,310 @@ def benchmark(func: Callable[..., Any]) -> Callable[..., Any]:
     @functools.wraps(func)
     def wrapper(*args: Any, **kwargs: Any) -> Any:
         start_time = perf_counter()
+        cpu_start_time = process_time()
         value = func(*args, **kwargs)
         end_time = perf_counter()
         run_time = end_time - start_time
-        logger.info("Execution of %s took %s seconds.",
-                    func.__name__, run_time)
+        cpu_time = process_time() - cpu_start_time
+        logger.info("Execution of %s took %s seconds (%s seconds of CPU).",
+                    func.__name__, run_time, cpu_time)
         return value
 
     return wrapper
+
+
+def _max_rss() -> Optional[int]:
+    """
+    Highest resident set size of the process so far
+    :return: The size in bytes or None where the resource module is not
+     available
+    :rtype: int
+    """
+    if resource is None:
+        return None
+    max_rss: int = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def _frame(value: Any) -> Optional[pd.DataFrame]:
+    """
+    Dataframe of a value returned by a stage, which may be the first item
+     of a tuple like the one of optimize_memory or of a dictionary of
+     frames
+    :param value: Value passed to or returned by a stage
+    :type value: Any
+    :return: The dataframe or None if there is not one
+    :rtype: pd.DataFrame
+    """
+    if isinstance(value, dict):
+        value = tuple(value.values())
+    if isinstance(value, tuple) and value:
+        value = value[0]
+    return value if isinstance(value, pd.DataFrame) else None
+
+
+def _frame_measures(value: Any, suffix: str) -> dict[str, Optional[int]]:
+    """
+    Rows, columns and memory of the dataframe of a value
+    :param value: Value passed to or returned by a stage
+    :type value: Any
+    :param suffix: Suffix of the measure names, 'in' or 'out'
+    :type suffix: str
+    :return: The measures or None for each one if there is no dataframe
+    :rtype: dict[str, Optional[int]]
+    """
+    dataframe: Optional[pd.DataFrame] = _frame(value)
+    if dataframe is None:
+        return {f'rows_{suffix}': None, f'columns_{suffix}': None,
+                f'memory_{suffix}': None}
+    return {f'rows_{suffix}': dataframe.shape[0],
+            f'columns_{suffix}': dataframe.shape[1],
+            f'memory_{suffix}': int(
+                dataframe.memory_usage(deep=True).sum())}
+
+
+class StageProfiler:
+    """
+    Profiler of the stages of a pipeline run. Each stage records its wall
+     time, the CPU time of the thread that ran it, so stages running at
+     the same time do not count each other, the highest resident set size
+     of the process after it,
+     and the rows, columns and memory of the dataframes it takes and
+     returns. Tracing memory adds the peak of traced memory above the
+     memory held when the stage started, at the cost of slowing down the
+     stages several times. Calls of the same stage, such as one per chunk,
+     are added up. Stages may be nested, their measures include the inner
+     ones. Stages may run in several threads at the same time, each thread
+     with its own cProfile capture
+    """
+
+    def __init__(
+            self, cprofile_stages: Optional[list[str]] = None,
+            trace_memory: bool = False
+    ):
+        self.cprofile_stages: list[str] = cprofile_stages or []
+        self.trace_memory: bool = trace_memory
+        self.created: str = datetime.now().isoformat(timespec='seconds')
+        self.stages: dict[str, dict[str, Any]] = {}
+        self.profiles: dict[str, cProfile.Profile] = {}
+        self._peaks: list[int] = []
+        self._active: set[str] = set()
+        self._lock: threading.Lock = threading.Lock()
+        self._local: threading.local = threading.local()
+
+    def _start_memory(self) -> int:
+        """
+        Start measuring the memory of a stage, keeping the peak reached so
+         far by the stage that contains it
+        :return: The traced memory when the stage starts
+        :rtype: int
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        current, peak = tracemalloc.get_traced_memory()
+        if self._peaks:
+            self._peaks[-1] = max(self._peaks[-1], peak)
+        tracemalloc.reset_peak()
+        self._peaks.append(current)
+        return current
+
+    def _stop_memory(self, start: int) -> int:
+        """
+        Stop measuring the memory of a stage and pass its peak on to the
+         stage that contains it
+        :param start: The traced memory when the stage started
+        :type start: int
+        :return: The peak above the memory held when the stage started
+        :rtype: int
+        """
+        peak: int = max(self._peaks.pop(), tracemalloc.get_traced_memory()[1])
+        if self._peaks:
+            self._peaks[-1] = max(self._peaks[-1], peak)
+        else:
+            tracemalloc.stop()
+        return peak - start
+
+    def _record(self, name: str, measures: dict[str, Any]) -> None:
+        """
+        Add the measures of a call to the totals of its stage
+        :param name: Name of the stage
+        :type name: str
+        :param measures: Measures of the call
+        :type measures: dict[str, Any]
+        :return: None
+        :rtype: NoneType
+        """
+        with self._lock:
+            totals: Optional[dict[str, Any]] = self.stages.get(name)
+            if totals is None:
+                self.stages[name] = {'calls': 1, **measures}
+                return
+            totals['calls'] += 1
+            for key, value in measures.items():
+                if value is None:
+                    continue
+                if key.startswith('columns'):
+                    totals[key] = value
+                elif key in ('peak_bytes', 'max_rss_bytes'):
+                    totals[key] = max(totals[key] or 0, value)
+                else:
+                    totals[key] = (totals[key] or 0) + value
+
+    def _start_profile(self, name: str) -> Optional[cProfile.Profile]:
+        """
+        Start the cProfile capture of a stage in the current thread. A
+         stage nested in a captured one of the same thread is part of the
+         outer capture, and a stage already captured in another thread is
+         not captured again
+        :param name: Name of the stage
+        :type name: str
+        :return: The started capture or None
+        :rtype: cProfile.Profile
+        """
+        if name not in self.cprofile_stages or getattr(
+                self._local, 'profiling', False):
+            return None
+        with self._lock:
+            if name in self._active:
+                logger.warning("Stage %s is already captured by cProfile in "
+                               "another thread", name)
+                return None
+            self._active.add(name)
+            profile: cProfile.Profile = self.profiles.setdefault(
+                name, cProfile.Profile())
+        try:
+            profile.enable()
+        except ValueError:
+            logger.warning("Stage %s cannot be captured by cProfile while "
+                           "another capture is active", name)
+            with self._lock:
+                self._active.discard(name)
+            return None
+        self._local.profiling = True
+        return profile
+
+    def _stop_profile(self, name: str, profile: cProfile.Profile) -> None:
+        """
+        Stop the cProfile capture of a stage in the current thread
+        :param name: Name of the stage
+        :type name: str
+        :param profile: The capture returned by _start_profile
+        :type profile: cProfile.Profile
+        :return: None
+        :rtype: NoneType
+        """
+        profile.disable()
+        self._local.profiling = False
+        with self._lock:
+            self._active.discard(name)
+
+    def run(
+            self, func: Callable[..., Any], *args: Any,
+            name: Optional[str] = None, **kwargs: Any
+    ) -> Any:
+        """
+        Call a stage measuring it
+        :param func: Function of the stage
+        :type func: Callable[..., Any]
+        :param name: Name of the stage. The default is None (the name of
+         the function)
+        :type name: str
+        :return: The value of the function
+        :rtype: Any
+        """
+        name = name or func.__name__
+        measures: dict[str, Any] = _frame_measures(
+            args[0] if args else None, 'in')
+        memory_start: int = self._start_memory() if self.trace_memory \
+            else 0
+        wall_start: float = perf_counter()
+        cpu_start: float = thread_time()
+        profile: Optional[cProfile.Profile] = self._start_profile(name)
+        try:
+            value: Any = func(*args, **kwargs)
+        finally:
+            if profile is not None:
+                self._stop_profile(name, profile)
+            measures['seconds'] = perf_counter() - wall_start
+            measures['cpu_seconds'] = thread_time() - cpu_start
+            measures['peak_bytes'] = self._stop_memory(memory_start) if \
+                self.trace_memory else None
+            measures['max_rss_bytes'] = _max_rss()
+        measures.update(_frame_measures(value, 'out'))
+        self._record(name, measures)
+        log_every_seconds(logger, logging.INFO, 1.0, "Stage %s took %.3f s",
+                          name, measures['seconds'], key=name)
+        return value
+
+    def __call__(self, func: Callable[..., Any]) -> Callable[..., Any]:
+        """
+        Decorator that measures every call of a stage
+        :param func: Function of the stage
+        :type func: Callable[..., Any]
+        :return: Wrapped function
+        :rtype: Callable[..., Any]
+        """
+
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            return self.run(func, *args, **kwargs)
+
+        return wrapper
+
+    def iterate(self, items: Iterator[Any], name: str) -> Iterator[Any]:
+        """
+        Measure the production of each item of a generator as a call of a
+         stage, such as reading each chunk of a workbook
+        :param items: The generator
+        :type items: Iterator[Any]
+        :param name: Name of the stage
+        :type name: str
+        :return: Generator of the same items
+        :rtype: Iterator[Any]
+        """
+        iterator: Iterator[Any] = iter(items)
+        while True:
+            try:
+                item: Any = self.run(next, iterator, name=name)
+            except StopIteration:
+                return
+            yield item
+
+    def report(self, top: int = 25) -> dict[str, Any]:
+        """
+        Report of the run
+        :param top: Number of functions listed for each cProfile capture,
+         by cumulative time. The default is 25
+        :type top: int
+        :return: The totals of each stage in the order they first ran, with
+         the CPU seconds of the thread that ran each call, and the functions
+         of the captured stages
+        :rtype: dict[str, Any]
+        """
+        captures: dict[str, str] = {}
+        for name, profile in self.profiles.items():
+            stream: io.StringIO = io.StringIO()
+            pstats.Stats(profile, stream=stream).sort_stats(
+                pstats.SortKey.CUMULATIVE).print_stats(top)
+            captures[name] = stream.getvalue()
+        return {'created': self.created, 'trace_memory': self.trace_memory,
+                'cpu_clock': 'thread', 'stages': self.stages,
+                'cprofile': captures}
+
+    def save(self, filepath: str) -> str:
+        """
+        Save the report as JSON and the cProfile captures next to it as
+         .prof files for pstats or snakeviz
+        :param filepath: Path of the report
+        :type filepath: str
+        :return: Path of the report
+        :rtype: str
+        """
+        os.makedirs(os.path.dirname(filepath) or '.', exist_ok=True)
+        with open(filepath, 'w', encoding='utf-8') as file:
+            json.dump(self.report(), file, indent=2)
+        for name, profile in self.profiles.items():
+            profile.dump_stats(f'{os.path.splitext(filepath)[0]}_{name}.prof')
+        logger.info("Stage profile saved to %s:\n%s", filepath,
+                    pd.DataFrame.from_dict(self.stages, orient='index'))
+        return filepath
@@ -1,39 +1,252 @@
 """
 Logging script for Core module
 """
+import atexit
+import copy
+import json
 import logging
+import logging.handlers
+import multiprocessing
 import os
+import threading
 from datetime import datetime
+from time import monotonic
+from typing import Any, Optional
 
+LOG_FORMAT: str = '[%(name)s][%(asctime)s][%(levelname)s][%(module)s][%(' \
+                  'funcName)s][%(lineno)d]: %(message)s'
+DATE_FORMAT: str = '%Y-%m-%d %H:%M:%S'
+ROTATIONS: list[str] = ['size', 'time']
+MAX_BYTES: int = 10 * 1024 * 1024
+BACKUP_COUNT: int = 7
+RECORD_ATTRIBUTES: set[str] = set(vars(logging.LogRecord(
+    '', logging.INFO, '', 0, '', None, None))).union({'message', 'asctime'})
+_listeners: list[logging.handlers.QueueListener] = []
+_counts: dict[tuple[str, str], int] = {}
+_windows: dict[tuple[str, str], list[float]] = {}
+_lock: threading.Lock = threading.Lock()
 
-def setup_logging(log_level: int = logging.DEBUG) -> None:
+
+class JsonFormatter(logging.Formatter):
     """
-    Setup logging
-    :param log_level: Level of logging
-    :type log_level: int
+    Formatter of one JSON object per line with the fields of the record
+     and the extra ones passed to the logging call
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        """
+        Format a record as a JSON line
+        :param record: The record to format
+        :type record: logging.LogRecord
+        :return: The JSON object of the record
+        :rtype: str
+        """
+        entry: dict[str, Any] = {
+            'time': datetime.fromtimestamp(record.created).isoformat(
+                timespec='milliseconds'),
+            'level': record.levelname, 'name': record.name,
+            'module': record.module, 'function': record.funcName,
+            'line': record.lineno, 'process': record.process,
+            'thread': record.threadName, 'message': record.getMessage()}
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        entry.update({key: value for key, value in vars(record).items()
+                      if key not in RECORD_ATTRIBUTES})
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class RecordQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that keeps the traceback of a record apart from its
+     message, so the listener can format it as a field of its own
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Merge the arguments into the message and render the traceback, so
+         the record can be pickled into the queue
+        :param record: The record to enqueue
+        :type record: logging.LogRecord
+        :return: A picklable copy of the record
+        :rtype: logging.LogRecord
+        """
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+        record.exc_info = None
+        return record
+
+
+def _file_handler(
+        filename_path: str, rotation: Optional[str]
+) -> logging.Handler:
+    """
+    Handler of the log file with the rotation to use
+    :param filename_path: Path of the log file
+    :type filename_path: str
+    :param rotation: 'size' to rotate every MAX_BYTES, 'time' to rotate
+     every midnight or None to write a new file per run
+    :type rotation: str
+    :return: The file handler
+    :rtype: logging.Handler
+    """
+    if rotation == 'size':
+        return logging.handlers.RotatingFileHandler(
+            filename_path, maxBytes=MAX_BYTES, backupCount=BACKUP_COUNT,
+            encoding='utf-8')
+    if rotation == 'time':
+        return logging.handlers.TimedRotatingFileHandler(
+            filename_path, when='midnight', backupCount=BACKUP_COUNT,
+            encoding='utf-8')
+    if rotation is not None:
+        raise ValueError(f'Unknown rotation {rotation}, use one of '
+                         f'{ROTATIONS}')
+    return logging.FileHandler(filename_path, encoding='utf-8')
+
+
+def stop_logging() -> None:
+    """
+    Write the records left in the queue and stop the listener
     :return: None
     :rtype: NoneType
     """
-    current_date: str = datetime.today().strftime('%d-%b-%Y-%H-%M-%S')
-    current_file_directory: str = os.path.dirname(os.path.abspath(__file__))
-    project_root: str = current_file_directory
-    while os.path.basename(project_root) != "ventas-facturas":
-        project_root = os.path.dirname(project_root)
-    log_filename: str = f'log-{current_date}.log'
-    filename_path: str = f'{project_root}/logs/{log_filename}'
+    while _listeners:
+        listener: logging.handlers.QueueListener = _listeners.pop()
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
 
-    logger: logging.Logger = logging.getLogger()
-    logger.setLevel(log_level)
 
+def setup_logging(
+        log_level: int = logging.DEBUG, json_lines: bool = False,
+        rotation: Optional[str] = None
+) -> logging.handlers.QueueListener:
+    """
+    Setup logging. The loggers only put the records in a queue and a
+     background listener formats them and writes them to the console and
+     the log file, so logging calls do not wait for the disk. The queue is
+     shared with forked worker processes
+    :param log_level: Level of logging
+    :type log_level: int
+    :param json_lines: Write the log file as JSON lines. The default is
+     False
+    :type json_lines: bool
+    :param rotation: 'size' or 'time' to rotate a single log file, or None
+     to write a new file per run. The default is None
+    :type rotation: str
+    :return: The listener of the queue
+    :rtype: logging.handlers.QueueListener
+    """
+    stop_logging()
+    project_root: str = os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__)))
+    os.makedirs(f'{project_root}/logs', exist_ok=True)
+    extension: str = 'jsonl' if json_lines else 'log'
+    log_filename: str = f'log.{extension}' if rotation else \
+        f'log-{datetime.today().strftime("%d-%b-%Y-%H-%M-%S")}.{extension}'
+    filename_path: str = f'{project_root}/logs/{log_filename}'
+
+    formatter: logging.Formatter = logging.Formatter(
+        LOG_FORMAT, datefmt=DATE_FORMAT)
     console_handler: logging.StreamHandler = logging.StreamHandler()
     console_handler.setLevel(log_level)
-    logger.addHandler(console_handler)
-
-    formatter = logging.Formatter(
-        '[%(name)s][%(asctime)s][%(levelname)s][%(module)s][%(funcName)s][%('
-        'lineno)d]: %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
-    file_handler: logging.FileHandler = logging.FileHandler(filename_path)
+    file_handler: logging.Handler = _file_handler(filename_path, rotation)
     file_handler.setLevel(log_level)
-    file_handler.setFormatter(formatter)
-    logger.addHandler(file_handler)
+    file_handler.setFormatter(JsonFormatter() if json_lines else formatter)
+
+    records: multiprocessing.Queue = multiprocessing.Queue()
+    queue_handler: RecordQueueHandler = RecordQueueHandler(records)
+    logger: logging.Logger = logging.getLogger()
+    logger.setLevel(log_level)
+    for handler in [handler for handler in logger.handlers if isinstance(
+            handler, logging.handlers.QueueHandler)]:
+        logger.removeHandler(handler)
+    logger.addHandler(queue_handler)
+
+    listener: logging.handlers.QueueListener = \
+        logging.handlers.QueueListener(
+            records, console_handler, file_handler,
+            respect_handler_level=True)
+    listener.start()
+    _listeners.append(listener)
+    atexit.register(stop_logging)
     logger.info('Logger started')
+    return listener
+
+
+def log_every_n(
+        logger: logging.Logger, level: int, n: int, msg: str, *args: Any,
+        key: Optional[str] = None
+) -> bool:
+    """
+    Log a message inside a loop only on its first call and every n-th
+     call after it. The number of calls so far is added to the record as
+     occurrences
+    :param logger: Logger of the message
+    :type logger: logging.Logger
+    :param level: Level of the message
+    :type level: int
+    :param n: Number of calls per logged message
+    :type n: int
+    :param msg: The message
+    :type msg: str
+    :param key: Key of the calls counted together. The default is None
+     (the message)
+    :type key: str
+    :return: True if the message was logged
+    :rtype: bool
+    """
+    if not logger.isEnabledFor(level):
+        return False
+    counter: tuple[str, str] = (logger.name, key or msg)
+    with _lock:
+        count: int = _counts.get(counter, 0) + 1
+        _counts[counter] = count
+    if (count - 1) % n:
+        return False
+    logger.log(level, msg, *args, extra={'occurrences': count},
+               stacklevel=2)
+    return True
+
+
+def log_every_seconds(
+        logger: logging.Logger, level: int, seconds: float, msg: str,
+        *args: Any, key: Optional[str] = None
+) -> bool:
+    """
+    Log a message inside a loop at most once every some seconds. The
+     number of calls skipped since the last logged one is added to the
+     record as suppressed
+    :param logger: Logger of the message
+    :type logger: logging.Logger
+    :param level: Level of the message
+    :type level: int
+    :param seconds: Minimum seconds between logged messages
+    :type seconds: float
+    :param msg: The message
+    :type msg: str
+    :param key: Key of the calls limited together. The default is None
+     (the message)
+    :type key: str
+    :return: True if the message was logged
+    :rtype: bool
+    """
+    if not logger.isEnabledFor(level):
+        return False
+    counter: tuple[str, str] = (logger.name, key or msg)
+    now: float = monotonic()
+    with _lock:
+        window: list[float] = _windows.setdefault(counter, [-seconds, 0])
+        if now - window[0] < seconds:
+            window[1] += 1
+            return False
+        suppressed: int = int(window[1])
+        window[0], window[1] = now, 0
+    logger.log(level, msg, *args, extra={'suppressed': suppressed},
+               stacklevel=2)
+    return True
@@ -0,0 +1,179 @@
+"""
+Cache script for parsed workbooks
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Any, Optional
+import pandas as pd
+
+logger: logging.Logger = logging.getLogger(__name__)
+HASH_BLOCK_SIZE: int = 1 << 20
+READER_VERSION: int = 2
+
+
+def _describe(value: Any) -> str:
+    """
+    Stable textual description of a dtype or converter for the cache key
+    :param value: Type, numpy dtype or callable to describe
+    :type value: Any
+    :return: The qualified name of the value
+    :rtype: str
+    """
+    if callable(value) and hasattr(value, '__qualname__'):
+        return f'{value.__module__}.{value.__qualname__}'
+    return str(value)
+
+
+def file_fingerprint(filepath: str) -> dict[str, Any]:
+    """
+    Compute the size, modification time and content hash of a file
+    :param filepath: Path of the file to fingerprint
+    :type filepath: str
+    :return: Dictionary with size, mtime_ns and sha256 of the file
+    :rtype: dict[str, Any]
+    """
+    stat: os.stat_result = os.stat(filepath)
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as file:
+        for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+            'sha256': digest.hexdigest()}
+
+
+def build_cache_key(
+        fingerprint: dict[str, Any], sheet_name: str,
+        dtypes: Optional[dict] = None, converter: Optional[dict] = None,
+        parse_dates: Optional[list[str]] = None
+) -> str:
+    """
+    Build the cache key for a (file, sheet, dtypes, converters) combination.
+     The key includes READER_VERSION, so frames parsed by an older reader
+     are parsed again
+    :param fingerprint: Fingerprint of the source file
+    :type fingerprint: dict[str, Any]
+    :param sheet_name: Name of the sheet
+    :type sheet_name: str
+    :param dtypes: Dictionary of columns and datatypes
+    :type dtypes: dict
+    :param converter: Dictionary with converter functions
+    :type converter: dict
+    :param parse_dates: List of date columns to parse
+    :type parse_dates: list[str]
+    :return: Hexadecimal key for the cache entry
+    :rtype: str
+    """
+    options: dict[str, Any] = {
+        'reader': READER_VERSION, 'file': fingerprint, 'sheet': sheet_name,
+        'dtypes': {key: _describe(value) for key, value in
+                   (dtypes or {}).items()},
+        'converter': {key: _describe(value) for key, value in
+                      (converter or {}).items()},
+        'parse_dates': list(parse_dates or [])}
+    serialized: str = json.dumps(options, sort_keys=True)
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()[:32]
+
+
+def load_cached_frame(directory: str, key: str) -> Optional[pd.DataFrame]:
+    """
+    Load a dataframe from the cache
+    :param directory: Folder of the cache
+    :type directory: str
+    :param key: Key of the cache entry
+    :type key: str
+    :return: The cached dataframe or None if there is no entry
+    :rtype: Optional[pd.DataFrame]
+    """
+    data_path: str = f'{directory}{key}.parquet'
+    if not os.path.exists(data_path):
+        return None
+    try:
+        dataframe: pd.DataFrame = pd.read_parquet(data_path)
+    except (OSError, ValueError, ImportError) as exc:
+        logger.warning("Discarding unreadable cache entry %s: %s", key, exc)
+        return None
+    metadata_path: str = f'{directory}{key}.json'
+    if os.path.exists(metadata_path):
+        os.utime(metadata_path)
+    return dataframe
+
+
+def save_cached_frame(
+        dataframe: pd.DataFrame, directory: str, key: str,
+        metadata: dict[str, Any]
+) -> bool:
+    """
+    Save a dataframe into the cache
+    :param dataframe: Parsed dataframe to store
+    :type dataframe: pd.DataFrame
+    :param directory: Folder of the cache
+    :type directory: str
+    :param key: Key of the cache entry
+    :type key: str
+    :param metadata: Information of the source used for eviction
+    :type metadata: dict[str, Any]
+    :return: confirmation for the cache entry created
+    :rtype: bool
+    """
+    os.makedirs(directory, exist_ok=True)
+    data_path: str = f'{directory}{key}.parquet'
+    try:
+        dataframe.to_parquet(data_path, index=False)
+    except (ValueError, TypeError, ImportError) as exc:
+        logger.warning("Could not cache %s: %s", metadata.get('source'), exc)
+        if os.path.exists(data_path):
+            os.remove(data_path)
+        return False
+    with open(f'{directory}{key}.json', 'w', encoding='utf-8') as file:
+        json.dump(metadata, file)
+    return True
+
+
+def evict_cache(
+        directory: str, max_age_days: Optional[float] = None,
+        clear: bool = False
+) -> int:
+    """
+    Evict stale cache entries. An entry is stale when its source file
+    was modified or removed, or when it was not used in max_age_days
+    :param directory: Folder of the cache
+    :type directory: str
+    :param max_age_days: Maximum days since the last use of an entry.
+     The default is None (no age limit)
+    :type max_age_days: float
+    :param clear: Whether to remove every entry. The default is False
+    :type clear: bool
+    :return: Number of evicted entries
+    :rtype: int
+    """
+    if not os.path.isdir(directory):
+        return 0
+    evicted: int = 0
+    now: float = time.time()
+    for entry in os.listdir(directory):
+        if not entry.endswith('.json'):
+            continue
+        metadata_path: str = f'{directory}{entry}'
+        with open(metadata_path, encoding='utf-8') as file:
+            metadata: dict[str, Any] = json.load(file)
+        source: str = metadata.get('source', '')
+        stale: bool = clear or not os.path.exists(source)
+        if not stale:
+            stat: os.stat_result = os.stat(source)
+            fingerprint: dict[str, Any] = metadata.get('fingerprint', {})
+            stale = (stat.st_size != fingerprint.get('size') or
+                     stat.st_mtime_ns != fingerprint.get('mtime_ns'))
+        if not stale and max_age_days is not None:
+            stale = now - os.path.getmtime(metadata_path) > \
+                    max_age_days * 86400
+        if stale:
+            data_path: str = metadata_path[:-len('.json')] + '.parquet'
+            for path in (data_path, metadata_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            evicted += 1
+    logger.info("Evicted %s cache entries from %s", evicted, directory)
+    return evicted
@@ -0,0 +1,123 @@
+"""
+Product dimension script
+"""
+import hashlib
+import logging
+from typing import Any
+import numpy as np
+import pandas as pd
+from pandas.api.extensions import take
+
+logger: logging.Logger = logging.getLogger(__name__)
+UNMATCHED_POLICIES: list[str] = ['keep', 'drop', 'raise']
+
+
+class ProductDimension:
+    """
+    Product dimension indexed by its key. The keys map to integer codes
+     and each attribute is stored as an array, so joining the sales is a
+     vectorized lookup of the codes of their SKUs
+    """
+
+    def __init__(self, products: pd.DataFrame, key: str = 'Producto'):
+        products = products[products[key].notna()]
+        duplicated: pd.Series = products[key].duplicated(keep='first')
+        distinct: pd.DataFrame = products.drop_duplicates()
+        self.key: str = key
+        self.duplicate_keys: list = products.loc[
+            duplicated, key].unique().tolist()
+        self.conflicting_keys: list = distinct.loc[
+            distinct[key].duplicated(), key].unique().tolist()
+        if self.duplicate_keys:
+            logger.warning("Duplicated product keys %s, keeping the first "
+                           "row", self.duplicate_keys)
+        if self.conflicting_keys:
+            logger.warning("Duplicated product keys with different "
+                           "attributes: %s", self.conflicting_keys)
+        products = products[~duplicated]
+        self.incomplete_keys: list = products.loc[
+            products.isna().any(axis=1), key].tolist()
+        if self.incomplete_keys:
+            logger.warning("Products with missing attributes: %s",
+                           self.incomplete_keys)
+        self.index: pd.Index = pd.Index(products[key])
+        self.attributes: dict[str, np.ndarray] = {
+            column: products[column].to_numpy() for column in
+            products.columns if column != key}
+        self.unmatched: pd.Series = pd.Series(dtype='int64')
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def codes(self, keys: pd.Series) -> np.ndarray:
+        """
+        Look up the integer code of each key
+        :param keys: Keys to look up
+        :type keys: pd.Series
+        :return: The code of each key or -1 if it is not in the dimension
+        :rtype: np.ndarray
+        """
+        return self.index.get_indexer(keys)
+
+    def join(
+            self, dataframe: pd.DataFrame, on: str = 'SKU',
+            unmatched: str = 'keep'
+    ) -> pd.DataFrame:
+        """
+        Add the product attributes to the rows of the dataframe without
+         copying its columns
+        :param dataframe: The sales to join
+        :type dataframe: pd.DataFrame
+        :param on: Column with the product keys. The default is 'SKU'
+        :type on: str
+        :param unmatched: What to do with rows whose key is not in the
+         dimension: 'keep' them with missing attributes, 'drop' them or
+         'raise' a ValueError. The default is 'keep'
+        :type unmatched: str
+        :return: The dataframe with the product attributes
+        :rtype: pd.DataFrame
+        """
+        if unmatched not in UNMATCHED_POLICIES:
+            raise ValueError(f'unmatched must be one of {UNMATCHED_POLICIES}')
+        codes: np.ndarray = self.codes(dataframe[on])
+        missing: np.ndarray = codes < 0
+        if missing.any():
+            counts: pd.Series = dataframe.loc[missing, on].value_counts()
+            counts = counts[counts > 0]
+            self.unmatched = self.unmatched.add(counts, fill_value=0).astype(
+                'int64')
+            if unmatched == 'raise':
+                raise ValueError(
+                    f'SKUs not in the product dimension: {counts.to_dict()}')
+            logger.warning("%s rows with SKUs not in the product dimension:"
+                           " %s", int(missing.sum()), counts.to_dict())
+            if unmatched == 'drop':
+                dataframe = dataframe[~missing].copy()
+                codes = codes[~missing]
+        for column, values in self.attributes.items():
+            dataframe[column] = take(values, codes, allow_fill=True)
+        return dataframe
+
+    def fingerprint(self) -> str:
+        """
+        Hash of the keys and attributes of the dimension
+        :return: Hexadecimal fingerprint
+        :rtype: str
+        """
+        table: pd.DataFrame = pd.DataFrame(
+            {self.key: self.index, **self.attributes})
+        return hashlib.sha256(pd.util.hash_pandas_object(
+            table, index=False).to_numpy().tobytes()).hexdigest()[:32]
+
+    def report(self) -> dict[str, Any]:
+        """
+        Report of the keys that could not be joined cleanly
+        :return: Duplicated, conflicting and incomplete product keys and
+         the number of rows of each unmatched SKU
+        :rtype: dict[str, Any]
+        """
+        return {'duplicate_keys': self.duplicate_keys,
+                'conflicting_keys': self.conflicting_keys,
+                'incomplete_keys': self.incomplete_keys,
+                'unmatched_skus': self.unmatched.to_dict(),
+                'unmatched_rows': int(self.unmatched.sum())}
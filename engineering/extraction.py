@@ -1,21 +1,109 @@
 """
 Extraction script
 """
-from typing import Optional
+import glob
+import hashlib
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, Optional
 import pandas as pd
 from numpy import float32
-from analysis import find_missing_values
+from pandas.api.types import union_categoricals
+from core.config import CHUNK_SIZE
+from engineering.dimension import ProductDimension
 from engineering.persistence_manager import PersistenceManager, DataType
-from engineering.transformation import remove_product_prefix, \
-    remove_dollar_prefix, remove_family_prefix
+from engineering.transformation import PRODUCT_CLEANING_SPEC, clean_columns
+from engineering.validation import Validator, sales_validator, \
+    save_quarantine, validate_sales
+from engineering.workbook_reader import WorkbookReader
 
+logger: logging.Logger = logging.getLogger(__name__)
 pd.set_option('display.max_columns', 20)
 pd.set_option('display.max_rows', 101)
+SALES_TYPES: dict = {
+    'Cliente - Territorio': str, 'SKU': str,
+    'Cantidad facturada': float32, 'Bodega': str}
+SALES_DATES: list[str] = ['Fecha de Pedido', 'Fecha de Entrega']
+SALES_COLUMNS: dict[str, str] = {
+    'Fecha de Pedido': 'Fecha_Pedido',
+    'Fecha de Entrega': 'Fecha_Entrega',
+    'Cantidad facturada': 'Cantidad_Facturada'}
+SALES_CATEGORIES: list[str] = ['Cliente - Territorio', 'SKU', 'Bodega']
+
+
+def load_raw_sheets(
+        filename: str = 'Base_de_Ventas.xlsx',
+        data_type: DataType = DataType.RAW, use_cache: bool = True,
+        refresh_cache: bool = False
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Engineering method to load the sales and products sheets of the
+     workbook as they are, with the sales columns renamed
+    :param filename: Filename to extract data from. The default is
+     'Base_de_Ventas.xlsx'
+    :type filename: str
+    :param data_type: Path where data will be saved: RAW or
+     PROCESSED. The default is RAW
+    :type data_type: DataType
+    :param use_cache: Whether to use the parsed workbook cache. The
+     default is True
+    :type use_cache: bool
+    :param refresh_cache: Whether to rebuild the parsed workbook cache.
+     The default is False
+    :type refresh_cache: bool
+    :return: The raw sales and products
+    :rtype: tuple[pd.DataFrame, pd.DataFrame]
+    """
+    sheets: dict[str, pd.DataFrame] = \
+        PersistenceManager.load_sheets_from_xlsx(
+            filename, {
+                'Ventas': {'dtypes': SALES_TYPES, 'parse_dates': SALES_DATES},
+                'Producto': {}},
+            data_type, use_cache, refresh_cache)
+    return sheets['Ventas'].rename(columns=SALES_COLUMNS), sheets['Producto']
+
+
+def extract_raw_sheets(
+        filename: str = 'Base_de_Ventas.xlsx',
+        data_type: DataType = DataType.RAW,
+        cleaning_spec: Optional[dict] = None,
+        use_cache: bool = True, refresh_cache: bool = False
+) -> tuple[pd.DataFrame, ProductDimension]:
+    """
+    Engineering method to extract the raw sales and the product dimension
+     from the workbook
+    :param filename: Filename to extract data from. The default is
+     'Base_de_Ventas.xlsx'
+    :type filename: str
+    :param data_type: Path where data will be saved: RAW or
+     PROCESSED. The default is RAW
+    :type data_type: DataType
+    :param cleaning_spec: Declarative cleaning rules for the product
+     columns. The default is None (PRODUCT_CLEANING_SPEC)
+    :type cleaning_spec: dict
+    :param use_cache: Whether to use the parsed workbook cache. The
+     default is True
+    :type use_cache: bool
+    :param refresh_cache: Whether to rebuild the parsed workbook cache.
+     The default is False
+    :type refresh_cache: bool
+    :return: The raw sales and the product dimension
+    :rtype: tuple[pd.DataFrame, ProductDimension]
+    """
+    df_sales, df_products = load_raw_sheets(
+        filename, data_type, use_cache, refresh_cache)
+    products: ProductDimension = ProductDimension(clean_columns(
+        df_products, cleaning_spec or PRODUCT_CLEANING_SPEC))
+    return df_sales, products
 
 
 def extract_raw_data(
         filename: str = 'Base_de_Ventas.xlsx',
-        data_type: DataType = DataType.RAW, converter: Optional[dict] = None
+        data_type: DataType = DataType.RAW,
+        cleaning_spec: Optional[dict] = None,
+        use_cache: bool = True, refresh_cache: bool = False,
+        unmatched: str = 'keep'
 ) -> pd.DataFrame:
     """
     Engineering method to extract raw data from csv file
@@ -25,35 +113,237 @@ def extract_raw_data(
     :param data_type: Path where data will be saved: RAW or
      PROCESSED. The default is RAW
     :type data_type: DataType
-    :param converter: Dictionary with converter functions. The default
-     is None
-    :type converter: dict
+    :param cleaning_spec: Declarative cleaning rules for the product
+     columns. The default is None (PRODUCT_CLEANING_SPEC)
+    :type cleaning_spec: dict
+    :param use_cache: Whether to use the parsed workbook cache. The
+     default is True
+    :type use_cache: bool
+    :param refresh_cache: Whether to rebuild the parsed workbook cache.
+     The default is False
+    :type refresh_cache: bool
+    :param unmatched: What to do with sales whose SKU is not a product:
+     'keep', 'drop' or 'raise'. The default is 'keep'
+    :type unmatched: str
     :return: Dataframe with raw data
     :rtype: pd.DataFrame
     """
-    sales_types = {
-        'Cliente - Territorio': str, 'SKU': str,
-        'Cantidad facturada': float32, 'Bodega': str}
-    parse_dates: list[str] = [
-        'Fecha de Pedido', 'Fecha de Entrega']
-    if not converter:
-        converter: dict = {
-            'Producto': remove_product_prefix,
-            'Familia': remove_family_prefix,
-            'PVP': remove_dollar_prefix}
-    df_sales: pd.DataFrame = PersistenceManager.load_from_xlsx(
-        filename=filename, sheet_name='Ventas', data_type=data_type,
-        dtypes=sales_types, parse_dates=parse_dates)
-    df_sales = df_sales.rename(columns={
-        'Fecha de Pedido': 'Fecha_Pedido',
-        'Fecha de Entrega': 'Fecha_Entrega',
-        'Cantidad facturada': 'Cantidad_Facturada'})
-    df_products: pd.DataFrame = PersistenceManager.load_from_xlsx(
-        filename=filename, sheet_name='Producto', data_type=data_type,
-        converter=converter)
-    df_sales = find_missing_values(df_sales)
-    df_products = find_missing_values(df_products)
-    # Fixme: Merge created NaN
-    dataframe = df_sales.merge(
-        df_products, left_on='SKU', right_on='Producto', how='left')
+    df_sales, products = extract_raw_sheets(
+        filename, data_type, cleaning_spec, use_cache, refresh_cache)
+    df_sales = validate_sales(df_sales, products, unmatched)
+    dataframe: pd.DataFrame = products.join(df_sales, unmatched=unmatched)
+    logger.info("Product dimension report: %s", products.report())
+    return dataframe
+
+
+def iter_raw_data(
+        filename: str = 'Base_de_Ventas.xlsx',
+        data_type: DataType = DataType.RAW,
+        cleaning_spec: Optional[dict] = None, chunk_size: int = CHUNK_SIZE,
+        unmatched: str = 'keep'
+) -> Iterator[pd.DataFrame]:
+    """
+    Engineering method to stream the raw sales data joined with the
+     products in chunks of bounded size
+    :param filename: Filename to extract data from. The default is
+     'Base_de_Ventas.xlsx'
+    :type filename: str
+    :param data_type: Path where data will be saved: RAW or
+     PROCESSED. The default is RAW
+    :type data_type: DataType
+    :param cleaning_spec: Declarative cleaning rules for the product
+     columns. The default is None (PRODUCT_CLEANING_SPEC)
+    :type cleaning_spec: dict
+    :param chunk_size: Number of sales rows per chunk. The default is
+     CHUNK_SIZE
+    :type chunk_size: int
+    :param unmatched: What to do with sales whose SKU is not a product:
+     'keep', 'drop' or 'raise'. The default is 'keep'
+    :type unmatched: str
+    :return: Generator of dataframe chunks with raw data
+    :rtype: Iterator[pd.DataFrame]
+    """
+    with WorkbookReader(f'{data_type.value}{filename}') as reader:
+        products: ProductDimension = ProductDimension(clean_columns(
+            reader.read_sheet('Producto'),
+            cleaning_spec or PRODUCT_CLEANING_SPEC))
+        validator: Validator = sales_validator(unmatched)
+        for index, chunk in enumerate(reader.iter_chunks(
+                'Ventas', chunk_size, dtypes=SALES_TYPES,
+                parse_dates=SALES_DATES)):
+            chunk, rejected = validator.validate(
+                chunk.rename(columns=SALES_COLUMNS), products)
+            save_quarantine(rejected, append=index > 0)
+            yield products.join(chunk, unmatched=unmatched)
+    validator.log_report()
+    logger.info("Product dimension report: %s", products.report())
+
+
+def workbook_paths(
+        pattern: str, data_type: DataType = DataType.RAW
+) -> list[str]:
+    """
+    Find the workbooks of a directory or glob pattern
+    :param pattern: Directory, glob pattern such as 'ventas/*/*.xlsx' or
+     filename relative to the folder of the data type
+    :type pattern: str
+    :param data_type: Folder of the workbooks. The default is RAW
+    :type data_type: DataType
+    :return: Sorted filenames relative to the folder of the data type
+    :rtype: list[str]
+    """
+    path: str = f'{data_type.value}{pattern}'
+    if os.path.isdir(path):
+        path = os.path.join(path, '*.xlsx')
+    return [os.path.relpath(filepath, data_type.value) for filepath in
+            sorted(glob.glob(path, recursive=True))
+            if not os.path.basename(filepath).startswith('~$')]
+
+
+def _load_workbook(
+        filename: str, data_type: DataType, use_cache: bool
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Load the sheets of one workbook in a worker process. The text columns
+     of the sales are sent back as categoricals, which are smaller to
+     pickle than the repeated strings
+    :param filename: Filename of the workbook
+    :type filename: str
+    :param data_type: Folder of the workbook
+    :type data_type: DataType
+    :param use_cache: Whether to use the parsed workbook cache
+    :type use_cache: bool
+    :return: The raw sales and products
+    :rtype: tuple[pd.DataFrame, pd.DataFrame]
+    """
+    df_sales, df_products = load_raw_sheets(filename, data_type, use_cache)
+    df_sales[SALES_CATEGORIES] = df_sales[SALES_CATEGORIES].astype(
+        'category')
+    return df_sales, df_products
+
+
+def concat_aligned(dataframes: list[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Concatenate dataframes keeping their categorical columns categorical,
+     with the union of the categories of every dataframe
+    :param dataframes: Dataframes with the same columns
+    :type dataframes: list[pd.DataFrame]
+    :return: The concatenated dataframe
+    :rtype: pd.DataFrame
+    """
+    categorical: list[str] = [
+        column for column, dtype in dataframes[0].dtypes.items() if
+        isinstance(dtype, pd.CategoricalDtype)]
+    categories: dict[str, pd.Index] = {
+        column: union_categoricals(
+            [dataframe[column] for dataframe in dataframes],
+            sort_categories=True).categories for column in categorical}
+    return pd.concat([dataframe.assign(**{
+        column: dataframe[column].cat.set_categories(values)
+        for column, values in categories.items()})
+        for dataframe in dataframes], ignore_index=True)
+
+
+def _sheet_hash(dataframe: pd.DataFrame) -> str:
+    """
+    Hash of the columns and values of a sheet
+    :param dataframe: The sheet
+    :type dataframe: pd.DataFrame
+    :return: Hexadecimal hash
+    :rtype: str
+    """
+    digest = hashlib.sha256(repr(list(dataframe.columns)).encode())
+    digest.update(pd.util.hash_pandas_object(
+        dataframe, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def load_workbooks(
+        pattern: str, data_type: DataType = DataType.RAW,
+        workers: Optional[int] = None, use_cache: bool = True
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Engineering method to load the sales and products of many workbooks,
+     such as one per month and region, parsing them over a process pool.
+     Product sheets shared by several workbooks are kept once, and so are
+     the rows of a product sheet already found in a previous one
+    :param pattern: Directory or glob pattern of the workbooks relative to
+     the folder of the data type
+    :type pattern: str
+    :param data_type: Folder of the workbooks. The default is RAW
+    :type data_type: DataType
+    :param workers: Number of processes. The default is None (number of
+     CPUs)
+    :type workers: int
+    :param use_cache: Whether to use the parsed workbook cache. The
+     default is True
+    :type use_cache: bool
+    :return: The raw sales of every workbook, with categorical text
+     columns, and the distinct products
+    :rtype: tuple[pd.DataFrame, pd.DataFrame]
+    """
+    filenames: list[str] = workbook_paths(pattern, data_type)
+    if not filenames:
+        raise FileNotFoundError(
+            f'No workbooks match {data_type.value}{pattern}')
+    sheets: list[tuple[pd.DataFrame, pd.DataFrame]]
+    if len(filenames) == 1 or workers == 1:
+        sheets = [_load_workbook(filename, data_type, use_cache)
+                  for filename in filenames]
+    else:
+        with ProcessPoolExecutor(workers) as executor:
+            sheets = list(executor.map(
+                _load_workbook, filenames, [data_type] * len(filenames),
+                [use_cache] * len(filenames)))
+    products: dict[str, pd.DataFrame] = {}
+    for _, df_products in sheets:
+        products.setdefault(_sheet_hash(df_products), df_products)
+    logger.info("Loaded %s workbooks with %s distinct product sheets",
+                len(filenames), len(products))
+    df_sales: pd.DataFrame = concat_aligned(
+        [df_sales for df_sales, _ in sheets])
+    df_products: pd.DataFrame = pd.concat(
+        products.values(), keys=range(len(products)))
+    sheet: pd.Series = pd.Series(
+        df_products.index.get_level_values(0), index=df_products.index)
+    first_sheet: pd.Series = sheet.groupby(pd.util.hash_pandas_object(
+        df_products, index=False)).transform('min')
+    return df_sales, df_products[sheet == first_sheet].reset_index(drop=True)
+
+
+def extract_workbooks(
+        pattern: str, data_type: DataType = DataType.RAW,
+        cleaning_spec: Optional[dict] = None, workers: Optional[int] = None,
+        use_cache: bool = True, unmatched: str = 'keep'
+) -> pd.DataFrame:
+    """
+    Engineering method to extract the raw data of many workbooks into one
+     dataframe, like extract_raw_data does for a single workbook
+    :param pattern: Directory or glob pattern of the workbooks relative to
+     the folder of the data type
+    :type pattern: str
+    :param data_type: Folder of the workbooks. The default is RAW
+    :type data_type: DataType
+    :param cleaning_spec: Declarative cleaning rules for the product
+     columns. The default is None (PRODUCT_CLEANING_SPEC)
+    :type cleaning_spec: dict
+    :param workers: Number of processes. The default is None (number of
+     CPUs)
+    :type workers: int
+    :param use_cache: Whether to use the parsed workbook cache. The
+     default is True
+    :type use_cache: bool
+    :param unmatched: What to do with sales whose SKU is not a product:
+     'keep', 'drop' or 'raise'. The default is 'keep'
+    :type unmatched: str
+    :return: Dataframe with the raw data of every workbook
+    :rtype: pd.DataFrame
+    """
+    df_sales, df_products = load_workbooks(
+        pattern, data_type, workers, use_cache)
+    products: ProductDimension = ProductDimension(clean_columns(
+        df_products, cleaning_spec or PRODUCT_CLEANING_SPEC))
+    df_sales = validate_sales(df_sales, products, unmatched)
+    dataframe: pd.DataFrame = products.join(df_sales, unmatched=unmatched)
+    logger.info("Product dimension report: %s", products.report())
     return dataframe
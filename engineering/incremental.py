@@ -0,0 +1,185 @@
+"""
+Incremental ingestion script
+"""
+import json
+import logging
+import os
+from typing import Any, Optional
+import numpy as np
+import pandas as pd
+from analysis import SalesCube, load_cube
+from engineering.extraction import extract_raw_sheets
+from engineering.optimization import optimize_memory
+from engineering.persistence_manager import DataType, MONTH_COLUMN, \
+    PersistenceManager
+from engineering.transformation import OUTPUT_DTYPES, \
+    feature_engineering, filter_desired_columns
+from engineering.validation import validate_sales
+
+logger: logging.Logger = logging.getLogger(__name__)
+STATE_FILENAME: str = 'ingestion_state.json'
+INDEX_FILENAME: str = 'row_index.parquet'
+LOOKBACK_DAYS: int = 31
+
+
+def row_hashes(dataframe: pd.DataFrame) -> np.ndarray:
+    """
+    Hash every row of the dataframe from the values of all its columns
+    :param dataframe: The rows to hash
+    :type dataframe: pd.DataFrame
+    :return: The hash of each row
+    :rtype: np.ndarray
+    """
+    return pd.util.hash_pandas_object(dataframe, index=False).to_numpy()
+
+
+def load_state(data_type: DataType = DataType.PROCESSED) -> dict[str, Any]:
+    """
+    Load the watermark and the product fingerprint of the last ingestion
+    :param data_type: Folder of the processed store. The default is
+     PROCESSED
+    :type data_type: DataType
+    :return: The state or an empty dictionary before the first ingestion
+    :rtype: dict[str, Any]
+    """
+    filepath: str = f'{data_type.value}{STATE_FILENAME}'
+    if not os.path.exists(filepath):
+        return {}
+    with open(filepath, encoding='utf-8') as file:
+        return json.load(file)
+
+
+def _sorted_hashes(months: np.ndarray, hashes: np.ndarray) -> dict:
+    """
+    Group the row hashes by month
+    :param months: Month of each row
+    :type months: np.ndarray
+    :param hashes: Hash of each row
+    :type hashes: np.ndarray
+    :return: The sorted hashes of each month
+    :rtype: dict
+    """
+    return {month: np.sort(values.to_numpy()) for month, values in
+            pd.Series(hashes).groupby(months)}
+
+
+def _changed_months(
+        months: pd.Series, hashes: np.ndarray, index: pd.DataFrame
+) -> list[str]:
+    """
+    Find the months whose rows differ from the rows of the index
+    :param months: Month of each row of the workbook
+    :type months: pd.Series
+    :param hashes: Hash of each row of the workbook
+    :type hashes: np.ndarray
+    :param index: Month and hash of each processed row
+    :type index: pd.DataFrame
+    :return: The months with new, changed or removed rows
+    :rtype: list[str]
+    """
+    current: dict = _sorted_hashes(months.to_numpy(), hashes)
+    previous: dict = _sorted_hashes(index[MONTH_COLUMN].to_numpy(),
+                                    index['hash'].to_numpy())
+    return sorted(
+        month for month in set(current) | set(previous)
+        if month not in current or month not in previous or
+        not np.array_equal(current[month], previous[month]))
+
+
+def ingest_incremental(
+        filename: str = 'Base_de_Ventas.xlsx',
+        raw_type: DataType = DataType.RAW,
+        store_type: DataType = DataType.PROCESSED, dataset: str = 'data',
+        partition_cols: Optional[list[str]] = None,
+        month_column: str = 'Fecha_Pedido',
+        lookback_days: int = LOOKBACK_DAYS, full: bool = False
+) -> dict[str, Any]:
+    """
+    Ingest only the new or changed sales lines into the partitioned store.
+     The rows from lookback_days before the watermark on are hashed and
+     compared per month with the row-hash index, and only the months that
+     differ are transformed and replace their partitions. The previous
+     files of those months are deleted once the new ones are written and
+     the cells of those months are refreshed in the sales cube. A change
+     in the products rebuilds the whole store
+    :param filename: Workbook to ingest. The default is
+     'Base_de_Ventas.xlsx'
+    :type filename: str
+    :param raw_type: Folder of the workbook. The default is RAW
+    :type raw_type: DataType
+    :param store_type: Folder of the processed store. The default is
+     PROCESSED
+    :type store_type: DataType
+    :param dataset: Name of the processed dataset. The default is 'data'
+    :type dataset: str
+    :param partition_cols: Partition columns after the month. The default
+     is None
+    :type partition_cols: list[str]
+    :param month_column: Date column of the watermark and the month
+     partitions. The default is 'Fecha_Pedido'
+    :type month_column: str
+    :param lookback_days: Days before the watermark where lines may still
+     change. The default is LOOKBACK_DAYS
+    :type lookback_days: int
+    :param full: Whether to rebuild the whole store. The default is False
+    :type full: bool
+    :return: Report with the watermark and the ingested months and rows
+    :rtype: dict[str, Any]
+    """
+    df_sales, products = extract_raw_sheets(filename, raw_type)
+    state: dict[str, Any] = load_state(store_type)
+    index_path: str = f'{store_type.value}{INDEX_FILENAME}'
+    full = full or not state or not os.path.exists(index_path) or \
+        state.get('products') != products.fingerprint()
+    months: pd.Series = df_sales[month_column].dt.strftime('%Y-%m')
+    index: pd.DataFrame = pd.DataFrame(
+        {MONTH_COLUMN: pd.Series(dtype=str), 'hash': pd.Series(
+            dtype='uint64')}) if full else pd.read_parquet(index_path)
+    start: str = '' if full else (
+            pd.Timestamp(state['watermark']) -
+            pd.Timedelta(days=lookback_days)).strftime('%Y-%m')
+    window: pd.Series = months >= start
+    hashes: np.ndarray = row_hashes(df_sales[window])
+    changed: list[str] = _changed_months(
+        months[window], hashes, index[index[MONTH_COLUMN] >= start])
+    delta: pd.Series = window & months.isin(changed)
+    logger.info("Ingesting %s rows of months %s", int(delta.sum()), changed)
+    previous: list[str] = [] if full else PersistenceManager.dataset_files(
+        store_type, dataset, column=MONTH_COLUMN, values=changed)
+    if delta.any():
+        dataframe: pd.DataFrame = validate_sales(
+            df_sales[delta].copy(), products, filename='incremental')
+        dataframe = products.join(dataframe)
+        dataframe = filter_desired_columns(feature_engineering(dataframe))
+        dataframe, _ = optimize_memory(dataframe, dtypes=OUTPUT_DTYPES)
+        PersistenceManager.save_to_parquet(
+            dataframe, store_type, dataset, partition_cols, month_column,
+            append=not full)
+    PersistenceManager.delete_files(previous, store_type, dataset)
+    if changed:
+        cube: Optional[SalesCube] = None if full else load_cube(
+            data_type=store_type, month_column=month_column)
+        if cube is None:
+            cube = SalesCube(PersistenceManager.load_from_parquet(
+                store_type, dataset), month_column)
+        else:
+            cube.drop(MONTH_COLUMN, changed)
+            if delta.any():
+                cube.update(dataframe)
+        cube.save(data_type=store_type)
+        index = pd.concat([
+            index[~index[MONTH_COLUMN].isin(changed)],
+            pd.DataFrame({MONTH_COLUMN: months[delta].to_numpy(),
+                          'hash': hashes[delta[window].to_numpy()]})],
+            ignore_index=True)
+        index.to_parquet(index_path, index=False)
+    state = {'watermark': df_sales[month_column].max().isoformat(),
+             'products': products.fingerprint()}
+    with open(f'{store_type.value}{STATE_FILENAME}', 'w',
+              encoding='utf-8') as file:
+        json.dump(state, file)
+    report: dict[str, Any] = {
+        'full': full, 'watermark': state['watermark'], 'months': changed,
+        'rows': int(delta.sum())}
+    logger.info("Incremental ingestion report: %s", report)
+    return report
@@ -0,0 +1,132 @@
+"""
+Memory optimization script
+"""
+import logging
+from typing import Optional
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_bool_dtype, is_float_dtype, \
+    is_integer_dtype, is_numeric_dtype, is_object_dtype, \
+    is_string_dtype
+from core.config import NUMERICS, RANGES
+
+logger: logging.Logger = logging.getLogger(__name__)
+INTEGER_RANGES: dict[str, tuple] = dict(zip(NUMERICS, RANGES))
+FLOATS: list[str] = [dtype for dtype in NUMERICS if dtype.startswith('float')]
+
+
+def _smallest_integer(series: pd.Series) -> str:
+    """
+    Find the smallest integer type that holds the observed values
+    :param series: Integer column without nulls
+    :type series: pd.Series
+    :return: Name of the integer type
+    :rtype: str
+    """
+    minimum, maximum = series.min(), series.max()
+    for dtype, (low, high) in INTEGER_RANGES.items():
+        if low <= minimum and maximum <= high:
+            return dtype
+    return str(series.dtype)
+
+
+def _smallest_float(series: pd.Series, tolerance: float) -> str:
+    """
+    Find the smallest float type that keeps the values within the relative
+     tolerance
+    :param series: Float column
+    :type series: pd.Series
+    :param tolerance: Maximum relative error allowed by the cast
+    :type tolerance: float
+    :return: Name of the float type
+    :rtype: str
+    """
+    values: np.ndarray = series.to_numpy(dtype='float64')
+    finite: np.ndarray = values[np.isfinite(values)]
+    for dtype in FLOATS:
+        if finite.size and np.abs(finite).max() > np.finfo(dtype).max:
+            continue
+        if np.allclose(values.astype(dtype), values, rtol=tolerance, atol=0,
+                       equal_nan=True):
+            return dtype
+    return str(series.dtype)
+
+
+def _cast_exactly(series: pd.Series, dtype: str) -> pd.Series:
+    """
+    Cast a column to a fixed type, refusing casts that change its values
+    :param series: The column to cast
+    :type series: pd.Series
+    :param dtype: Name of the target type
+    :type dtype: str
+    :return: The cast column
+    :rtype: pd.Series
+    """
+    cast: pd.Series = series.astype(dtype)
+    if is_numeric_dtype(cast) and not is_bool_dtype(cast) and \
+            not np.array_equal(cast.to_numpy(dtype='float64'),
+                               series.to_numpy(dtype='float64'),
+                               equal_nan=True):
+        raise ValueError(f'Casting {series.name} to {dtype} changes its '
+                         f'values')
+    return cast
+
+
+def optimize_memory(
+        dataframe: pd.DataFrame, categorical_ratio: float = 0.5,
+        float_tolerance: Optional[float] = None,
+        dtypes: Optional[dict[str, str]] = None
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Downcast each numeric column to the smallest safe type from its
+     observed minimum and maximum and convert low cardinality text
+     columns to categoricals. Columns with a fixed type in dtypes are cast
+     to it instead, so chunks of the same data get the same types
+    :param dataframe: The dataframe to optimize
+    :type dataframe: pd.DataFrame
+    :param categorical_ratio: Maximum ratio of distinct values to rows for
+     a text column to become categorical. The default is 0.5
+    :type categorical_ratio: float
+    :param float_tolerance: Maximum relative error allowed when
+     downcasting floats. Downcasting floats is lossy, so it only happens
+     when a tolerance is given. The default is None
+    :type float_tolerance: float
+    :param dtypes: Fixed type of some columns. The default is None
+    :type dtypes: dict[str, str]
+    :return: The optimized dataframe and its memory report per column
+    :rtype: tuple[pd.DataFrame, pd.DataFrame]
+    """
+    dtypes_before: pd.Series = dataframe.dtypes.astype(str)
+    memory_before: pd.Series = dataframe.memory_usage(deep=True)
+    dataframe = dataframe.copy()
+    for column in dataframe.columns:
+        series: pd.Series = dataframe[column]
+        if dtypes and column in dtypes:
+            dataframe[column] = _cast_exactly(series, dtypes[column])
+            continue
+        if is_bool_dtype(series):
+            continue
+        if is_float_dtype(series) and series.notna().all() and \
+                series.abs().max() < 2 ** 53 and \
+                np.array_equal(series, np.round(series)):
+            series = series.astype('int64')
+        if is_integer_dtype(series):
+            dataframe[column] = series.astype(_smallest_integer(series))
+        elif is_float_dtype(series) and float_tolerance is not None:
+            dataframe[column] = series.astype(
+                _smallest_float(series, float_tolerance))
+        elif (is_object_dtype(series) or is_string_dtype(series)) and \
+                len(series) and \
+                series.nunique() / len(series) <= categorical_ratio:
+            dataframe[column] = series.astype('category')
+    memory_after: pd.Series = dataframe.memory_usage(deep=True)
+    report: pd.DataFrame = pd.DataFrame({
+        'dtype_before': dtypes_before,
+        'dtype_after': dataframe.dtypes.astype(str),
+        'bytes_before': memory_before, 'bytes_after': memory_after},
+        index=memory_before.index)
+    report['reduction_%'] = (
+            1 - report['bytes_after'] / report['bytes_before']) * 100
+    logger.info("Memory reduced from %s to %s bytes", memory_before.sum(),
+                memory_after.sum())
+    return dataframe, report
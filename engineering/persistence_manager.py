@@ -1,13 +1,27 @@
 """
 Persistence script
 """
+import itertools
 import logging
+import os
+import uuid
 from enum import Enum
-from typing import Union, Optional
+from typing import Any, Iterable, Iterator, Union, Optional
 import pandas as pd
-from core.config import ENCODING, NUMERICS
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from core.config import CHUNK_SIZE, ENCODING
+from engineering.cache import build_cache_key, evict_cache, \
+    file_fingerprint, load_cached_frame, save_cached_frame
+from engineering.sqlite_backend import get_pool, quote, sql_type, \
+    to_records, where_clause
+from engineering.workbook_reader import WorkbookReader
 
 logger: logging.Logger = logging.getLogger(__name__)
+MONTH_COLUMN: str = 'Mes'
+SCHEMA_FILENAME: str = '_common_metadata'
+INDEX_COLUMNS: list[str] = ['ID_Cliente', 'ID_SKU', 'Fecha_Pedido']
 
 
 class DataType(Enum):
@@ -17,6 +31,67 @@ class DataType(Enum):
     RAW: str = 'data/raw/'
     PROCESSED: str = 'data/processed/'
     FIGURES: str = 'reports/figures/'
+    CACHE: str = 'data/cache/'
+    STAGES: str = 'data/cache/stages/'
+    PROFILES: str = 'reports/profiles/'
+    BENCHMARKS: str = 'reports/benchmarks/'
+    QUARANTINE: str = 'data/quarantine/'
+
+
+def _to_table(
+        dataframe: pd.DataFrame, month_column: Optional[str] = None
+) -> pa.Table:
+    """
+    Convert a dataframe to an Arrow table with the month partition column
+    :param dataframe: The dataframe to convert
+    :type dataframe: pd.DataFrame
+    :param month_column: Date column whose year and month are added as
+     MONTH_COLUMN. The default is None
+    :type month_column: str
+    :return: The Arrow table
+    :rtype: pa.Table
+    """
+    table: pa.Table = pa.Table.from_pandas(dataframe, preserve_index=False)
+    if month_column:
+        table = table.append_column(MONTH_COLUMN, pa.array(
+            dataframe[month_column].dt.strftime('%Y-%m'), pa.string()))
+    return table
+
+
+def _widen_dictionaries(schema: pa.Schema) -> pa.Schema:
+    """
+    Store the dictionary columns with 32-bit indices, so chunks with more
+     categories than the first one still fit the schema
+    :param schema: Schema of the first table of a dataset
+    :type schema: pa.Schema
+    :return: The schema of the dataset
+    :rtype: pa.Schema
+    """
+    return pa.schema([
+        field.with_type(pa.dictionary(pa.int32(), field.type.value_type))
+        if pa.types.is_dictionary(field.type) else field
+        for field in schema], metadata=schema.metadata)
+
+
+def _conform(table: pa.Table, schema: pa.Schema) -> pa.Table:
+    """
+    Select and cast the columns of a table to the schema of a dataset,
+     encoding the text columns the schema stores as dictionaries
+    :param table: The table to conform
+    :type table: pa.Table
+    :param schema: Schema of the dataset
+    :type schema: pa.Schema
+    :return: The table with the schema of the dataset
+    :rtype: pa.Table
+    """
+    columns: list[pa.ChunkedArray] = []
+    for field in schema:
+        column: pa.ChunkedArray = table.column(field.name)
+        if pa.types.is_dictionary(field.type) and \
+                not pa.types.is_dictionary(column.type):
+            column = column.dictionary_encode()
+        columns.append(column.cast(field.type))
+    return pa.Table.from_arrays(columns, schema=schema)
 
 
 class PersistenceManager:
@@ -27,7 +102,8 @@ class PersistenceManager:
     @staticmethod
     def save_to_csv(
             data: Union[list[dict], pd.DataFrame],
-            data_type: DataType = DataType.PROCESSED, filename: str = 'data'
+            data_type: DataType = DataType.PROCESSED, filename: str = 'data',
+            append: bool = False
     ) -> bool:
         """
         Save list of dictionaries as csv file
@@ -37,6 +113,9 @@ class PersistenceManager:
         :type data_type: DataType
         :param filename: name of the file
         :type filename: str
+        :param append: Whether to append rows without header to an existing
+         file. The default is False
+        :type append: bool
         :return: confirmation for csv file created
         :rtype: bool
         """
@@ -48,17 +127,211 @@ class PersistenceManager:
                 return False
             dataframe = pd.DataFrame(data)
         dataframe.to_csv(f'{str(data_type.value)}{filename}.csv', index=False,
-                         encoding=ENCODING)
+                         encoding=ENCODING, mode='a' if append else 'w',
+                         header=not append)
         return True
 
+    @staticmethod
+    def save_to_parquet(
+            data: Union[pd.DataFrame, Iterable[pd.DataFrame]],
+            data_type: DataType = DataType.PROCESSED, filename: str = 'data',
+            partition_cols: Optional[list[str]] = None,
+            month_column: Optional[str] = None, append: bool = False,
+            compression: str = 'zstd', file_format: str = 'parquet'
+    ) -> bool:
+        """
+        Save dataframe as a compressed columnar dataset partitioned in Hive
+         folders. Each write adds files with a unique name, so appending
+         only creates new files in the affected partitions and replacing
+         only removes the previous files once the new ones are written.
+         The chunks of an iterable are streamed into a single file per
+         partition. The schema is kept in _common_metadata to restore the
+         dtypes when loading
+        :param data: dataframe or chunks of a dataframe to save
+        :type data: Union[pd.DataFrame, Iterable[pd.DataFrame]]
+        :param data_type: folder where data will be saved. The default is
+         PROCESSED
+        :type data_type: DataType
+        :param filename: name of the dataset folder without extension. The
+         default is 'data'
+        :type filename: str
+        :param partition_cols: Columns to partition by. The default is None
+        :type partition_cols: list[str]
+        :param month_column: Date column whose year and month are added as
+         the first partition column, named MONTH_COLUMN. The default is
+         None
+        :type month_column: str
+        :param append: Whether to add files to an existing dataset instead
+         of replacing it. The default is False
+        :type append: bool
+        :param compression: Compression codec. The default is 'zstd'
+        :type compression: str
+        :param file_format: 'parquet' or 'feather'. The default is
+         'parquet'
+        :type file_format: str
+        :return: confirmation for the dataset files created
+        :rtype: bool
+        """
+        frames: Iterator[pd.DataFrame] = (
+            frame for frame in ([data] if isinstance(data, pd.DataFrame)
+                                else data) if not frame.empty)
+        first: Optional[pd.DataFrame] = next(frames, None)
+        if first is None:
+            return False
+        directory: str = f'{data_type.value}{filename}.{file_format}/'
+        previous: list[str] = [] if append else \
+            PersistenceManager.dataset_files(data_type, filename, file_format)
+        table: pa.Table = _to_table(first, month_column)
+        partitions: list[str] = list(partition_cols or [])
+        if month_column:
+            partitions.insert(0, MONTH_COLUMN)
+        schema_path: str = f'{directory}{SCHEMA_FILENAME}'
+        schema: pa.Schema = pq.read_schema(schema_path) if append and \
+            os.path.exists(schema_path) else _widen_dictionaries(
+                table.schema)
+        tables: Iterator[pa.Table] = itertools.chain([table], (
+            _to_table(frame, month_column) for frame in frames))
+        file_options: ds.FileWriteOptions = (
+            ds.ParquetFileFormat() if file_format == 'parquet' else
+            ds.IpcFileFormat()).make_write_options(compression=compression)
+        ds.write_dataset(
+            (batch for chunk in tables
+             for batch in _conform(chunk, schema).to_batches()),
+            directory, schema=schema, format=file_format,
+            partitioning=partitions or None, partitioning_flavor='hive',
+            basename_template=f'part-{uuid.uuid4().hex}-{{i}}.{file_format}',
+            existing_data_behavior='overwrite_or_ignore',
+            file_options=file_options)
+        pq.write_metadata(schema.with_metadata({
+            **(schema.metadata or {}),
+            b'partition_cols': ','.join(partitions).encode()}),
+            schema_path)
+        PersistenceManager.delete_files(previous, data_type, filename,
+                                        file_format)
+        logger.info("Saved the dataset partitioned by %s to %s", partitions,
+                    directory)
+        return True
+
+    @staticmethod
+    def load_from_parquet(
+            data_type: DataType = DataType.PROCESSED, filename: str = 'data',
+            columns: Optional[list[str]] = None,
+            filters: Optional[list[tuple]] = None,
+            file_format: str = 'parquet'
+    ) -> pd.DataFrame:
+        """
+        Load dataframe from a partitioned columnar dataset reading only the
+         requested columns and the partitions that match the filters
+        :param data_type: folder where data is stored. The default is
+         PROCESSED
+        :type data_type: DataType
+        :param filename: name of the dataset folder without extension. The
+         default is 'data'
+        :type filename: str
+        :param columns: Columns to read. The default is None (all)
+        :type columns: list[str]
+        :param filters: Conditions like [('ID_Territorio', '=', 3)] or a
+         list of such lists to combine with OR. The default is None
+        :type filters: list[tuple]
+        :param file_format: 'parquet' or 'feather'. The default is
+         'parquet'
+        :type file_format: str
+        :return: dataframe read from the dataset
+        :rtype: pd.DataFrame
+        """
+        directory: str = f'{data_type.value}{filename}.{file_format}/'
+        schema: pa.Schema = pq.read_schema(f'{directory}{SCHEMA_FILENAME}')
+        partitions: bytes = schema.metadata.get(b'partition_cols', b'')
+        partition_fields: list[pa.Field] = [
+            schema.field(name) for name in partitions.decode().split(',')
+            if name]
+        dataset: ds.Dataset = ds.dataset(
+            directory, schema=schema, format=file_format,
+            partitioning=ds.partitioning(pa.schema(partition_fields),
+                                         flavor='hive'))
+        table: pa.Table = dataset.to_table(
+            columns=columns,
+            filter=pq.filters_to_expression(filters) if filters else None)
+        return table.to_pandas()
+
+    @staticmethod
+    def dataset_files(
+            data_type: DataType = DataType.PROCESSED, filename: str = 'data',
+            file_format: str = 'parquet', column: Optional[str] = None,
+            values: Optional[list] = None
+    ) -> list[str]:
+        """
+        List the data files of a dataset, optionally only those of some top
+         level partitions
+        :param data_type: folder where data is stored. The default is
+         PROCESSED
+        :type data_type: DataType
+        :param filename: name of the dataset folder without extension. The
+         default is 'data'
+        :type filename: str
+        :param file_format: 'parquet' or 'feather'. The default is
+         'parquet'
+        :type file_format: str
+        :param column: First partition column of the dataset. The default
+         is None
+        :type column: str
+        :param values: Values of the partitions to list. The default is
+         None (every partition)
+        :type values: list
+        :return: Paths of the data files
+        :rtype: list[str]
+        """
+        directory: str = f'{data_type.value}{filename}.{file_format}'
+        roots: list[str] = [directory] if values is None else [
+            f'{directory}/{column}={value}' for value in values]
+        return [os.path.join(path, name) for root in roots
+                for path, _, names in os.walk(root) for name in names
+                if name.endswith(f'.{file_format}')]
+
+    @staticmethod
+    def delete_files(
+            paths: list[str], data_type: DataType = DataType.PROCESSED,
+            filename: str = 'data', file_format: str = 'parquet'
+    ) -> int:
+        """
+        Delete data files of a dataset and the partition folders they leave
+         empty
+        :param paths: Paths of the data files to delete
+        :type paths: list[str]
+        :param data_type: folder where data is stored. The default is
+         PROCESSED
+        :type data_type: DataType
+        :param filename: name of the dataset folder without extension. The
+         default is 'data'
+        :type filename: str
+        :param file_format: 'parquet' or 'feather'. The default is
+         'parquet'
+        :type file_format: str
+        :return: Number of deleted files
+        :rtype: int
+        """
+        directory: str = os.path.normpath(
+            f'{data_type.value}{filename}.{file_format}')
+        for path in paths:
+            os.remove(path)
+            folder: str = os.path.dirname(os.path.normpath(path))
+            while folder != directory and os.path.isdir(folder) and \
+                    not os.listdir(folder):
+                os.rmdir(folder)
+                folder = os.path.dirname(folder)
+        return len(paths)
+
     @staticmethod
     def load_from_xlsx(
             filename: str, sheet_name: str, data_type: DataType,
             dtypes: Optional[dict] = None, converter: Optional[dict] = None,
-            parse_dates: Optional[list[str]] = None
+            parse_dates: Optional[list[str]] = None, use_cache: bool = True,
+            refresh_cache: bool = False
     ) -> pd.DataFrame:
         """
-        Load dataframe from XLSX using chunk scheme
+        Load dataframe from XLSX using chunk scheme. Parsed sheets are kept
+         in a Parquet cache keyed on the file size, modification time and
+         content hash plus the dtypes, converters and dates to parse
         :param filename: name of the file
         :type filename: str
         :param sheet_name: Name of the sheet to load
@@ -71,26 +344,220 @@ class PersistenceManager:
         :type converter: dict
         :param parse_dates: List of date columns to parse
         :type parse_dates: list[str]
+        :param use_cache: Whether to read and write the parsed sheet cache.
+         The default is True
+        :type use_cache: bool
+        :param refresh_cache: Whether to rebuild the cache entry even if it
+         exists. The default is False
+        :type refresh_cache: bool
         :return: dataframe retrieved from XLSX after optimization with chunks
         :rtype: pd.DataFrame
         """
+        return PersistenceManager.load_sheets_from_xlsx(
+            filename, {sheet_name: {
+                'dtypes': dtypes, 'converter': converter,
+                'parse_dates': parse_dates}}, data_type, use_cache,
+            refresh_cache)[sheet_name]
+
+    @staticmethod
+    def load_sheets_from_xlsx(
+            filename: str, sheets: dict[str, dict[str, Any]],
+            data_type: DataType, use_cache: bool = True,
+            refresh_cache: bool = False
+    ) -> dict[str, pd.DataFrame]:
+        """
+        Load several sheets from XLSX opening the workbook at most once.
+         Sheets found in the cache are not parsed again
+        :param filename: name of the file
+        :type filename: str
+        :param sheets: Dictionary of sheet names and their dtypes,
+         converter and parse_dates options
+        :type sheets: dict[str, dict[str, Any]]
+        :param data_type: Path where data will be saved
+        :type data_type: DataType
+        :param use_cache: Whether to read and write the parsed sheet cache.
+         The default is True
+        :type use_cache: bool
+        :param refresh_cache: Whether to rebuild the cache entries even if
+         they exist. The default is False
+        :type refresh_cache: bool
+        :return: Dictionary of sheet names and their dataframes
+        :rtype: dict[str, pd.DataFrame]
+        """
         filepath: str = f'{data_type.value}{filename}'
-        dataframe: pd.DataFrame = pd.read_excel(
-            filepath, sheet_name=sheet_name,
-            converters=converter, parse_dates=parse_dates)
-        if dtypes:
-            for key, value in dtypes.items():
-                if value in NUMERICS:
-                    dataframe[key] = pd.to_numeric(
-                        dataframe[key], errors='coerce')
-                    dataframe[key] = dataframe[key].astype(value)
-                else:
-                    dataframe[key] = dataframe[key].astype(value)
-        return dataframe
+        fingerprint: Optional[dict] = file_fingerprint(
+            filepath) if use_cache else None
+        cache_keys: dict[str, str] = {}
+        dataframes: dict[str, pd.DataFrame] = {}
+        for sheet_name, options in sheets.items():
+            if not use_cache:
+                continue
+            cache_keys[sheet_name] = build_cache_key(
+                fingerprint, sheet_name, **options)
+            if refresh_cache:
+                continue
+            cached: Optional[pd.DataFrame] = load_cached_frame(
+                DataType.CACHE.value, cache_keys[sheet_name])
+            if cached is not None:
+                logger.info("Loaded sheet %s of %s from cache",
+                            sheet_name, filename)
+                dataframes[sheet_name] = cached
+        missing: list[str] = [
+            sheet_name for sheet_name in sheets
+            if sheet_name not in dataframes]
+        if not missing:
+            return dataframes
+        with WorkbookReader(filepath) as reader:
+            for sheet_name in missing:
+                dataframe: pd.DataFrame = reader.read_sheet(
+                    sheet_name, **sheets[sheet_name])
+                if use_cache:
+                    save_cached_frame(
+                        dataframe, DataType.CACHE.value,
+                        cache_keys[sheet_name],
+                        {'source': os.path.abspath(filepath),
+                         'sheet': sheet_name, 'fingerprint': fingerprint})
+                dataframes[sheet_name] = dataframe
+        return dataframes
+
+    @staticmethod
+    def evict_xlsx_cache(
+            max_age_days: Optional[float] = None, clear: bool = False
+    ) -> int:
+        """
+        Evict parsed workbook cache entries whose source changed, or that
+         were not used in the given number of days
+        :param max_age_days: Maximum days since the last use of an entry.
+         The default is None (no age limit)
+        :type max_age_days: float
+        :param clear: Whether to remove every entry. The default is False
+        :type clear: bool
+        :return: Number of evicted entries
+        :rtype: int
+        """
+        return evict_cache(DataType.CACHE.value, max_age_days, clear)
+
+    @staticmethod
+    def save_to_sqlite(
+            data: Union[pd.DataFrame, Iterable[pd.DataFrame]],
+            data_type: DataType = DataType.PROCESSED, filename: str = 'data',
+            table: str = 'ventas', append: bool = False,
+            index_columns: Optional[list[str]] = None,
+            chunk_size: int = int(CHUNK_SIZE)
+    ) -> bool:
+        """
+        Save dataframe to a table of a SQLite database with executemany in
+         one transaction per chunk of rows. A replaced table is loaded into
+         a staging table that takes its place in a single transaction, and
+         the indexes are built after the bulk load
+        :param data: dataframe or chunks of a dataframe to save
+        :type data: Union[pd.DataFrame, Iterable[pd.DataFrame]]
+        :param data_type: folder where data will be saved. The default is
+         PROCESSED
+        :type data_type: DataType
+        :param filename: name of the database without extension. The
+         default is 'data'
+        :type filename: str
+        :param table: Name of the table. The default is 'ventas'
+        :type table: str
+        :param append: Whether to add the rows to an existing table instead
+         of replacing it. The default is False
+        :type append: bool
+        :param index_columns: Columns to index. The default is None
+         (INDEX_COLUMNS)
+        :type index_columns: list[str]
+        :param chunk_size: Rows per transaction. The default is CHUNK_SIZE
+        :type chunk_size: int
+        :return: confirmation for the rows saved
+        :rtype: bool
+        """
+        frames: Iterator[pd.DataFrame] = (
+            frame for frame in ([data] if isinstance(data, pd.DataFrame)
+                                else data) if not frame.empty)
+        first: Optional[pd.DataFrame] = next(frames, None)
+        if first is None:
+            return False
+        target: str = table if append else f'{table}__staging'
+        definition: str = ', '.join(
+            f'{quote(column)} {sql_type(first[column])}' for column in
+            first.columns)
+        insert: str = f'INSERT INTO {quote(target)} VALUES ' \
+                      f'({", ".join("?" * first.shape[1])})'
+        rows: int = 0
+        with get_pool(f'{data_type.value}{filename}.sqlite').connection(
+        ) as connection:
+            with connection:
+                if not append:
+                    connection.execute(f'DROP TABLE IF EXISTS {quote(target)}')
+                connection.execute(f'CREATE TABLE IF NOT EXISTS '
+                                   f'{quote(target)} ({definition})')
+            for frame in itertools.chain([first], frames):
+                for start in range(0, frame.shape[0], chunk_size):
+                    with connection:
+                        connection.executemany(insert, to_records(
+                            frame.iloc[start:start + chunk_size]))
+                rows += frame.shape[0]
+            with connection:
+                if not append:
+                    connection.execute(f'DROP TABLE IF EXISTS {quote(table)}')
+                    connection.execute(f'ALTER TABLE {quote(target)} '
+                                       f'RENAME TO {quote(table)}')
+                for column in index_columns or INDEX_COLUMNS:
+                    if column in first.columns:
+                        connection.execute(
+                            f'CREATE INDEX IF NOT EXISTS '
+                            f'{quote(f"idx_{table}_{column}")} ON '
+                            f'{quote(table)} ({quote(column)})')
+        logger.info("Saved %s rows to table %s of %s.sqlite", rows, table,
+                    filename)
+        return True
+
+    @staticmethod
+    def load_from_sqlite(
+            data_type: DataType = DataType.PROCESSED, filename: str = 'data',
+            table: str = 'ventas', columns: Optional[list[str]] = None,
+            filters: Optional[list] = None
+    ) -> pd.DataFrame:
+        """
+        Load dataframe from a table of a SQLite database, selecting only the
+         requested columns and the rows that match the filters in SQL so
+         the indexes are used
+        :param data_type: folder where data is stored. The default is
+         PROCESSED
+        :type data_type: DataType
+        :param filename: name of the database without extension. The
+         default is 'data'
+        :type filename: str
+        :param table: Name of the table. The default is 'ventas'
+        :type table: str
+        :param columns: Columns to read. The default is None (all)
+        :type columns: list[str]
+        :param filters: Conditions like [('ID_Territorio', '=', 3)] or a
+         list of such lists to combine with OR. The default is None
+        :type filters: list
+        :return: dataframe read from the table
+        :rtype: pd.DataFrame
+        """
+        where, parameters = where_clause(filters)
+        with get_pool(f'{data_type.value}{filename}.sqlite').connection(
+        ) as connection:
+            declared: dict[str, str] = {
+                row[1]: row[2] for row in connection.execute(
+                    f'PRAGMA table_info({quote(table)})')}
+            if not declared:
+                raise ValueError(f'Table {table} not found in {filename}')
+            selected: list[str] = columns or list(declared)
+            query: str = f'SELECT {", ".join(map(quote, selected))} FROM ' \
+                         f'{quote(table)}{where}'
+            return pd.read_sql_query(
+                query, connection, params=parameters,
+                parse_dates=[column for column in selected
+                             if declared[column] == 'TIMESTAMP'])
 
     @staticmethod
     def save_to_pickle(
-            dataframe: pd.DataFrame, filename: str = 'optimized_df.pkl'
+            dataframe: pd.DataFrame, filename: str = 'optimized_df.pkl',
+            data_type: DataType = DataType.PROCESSED
     ) -> None:
         """
         Save dataframe to pickle file
@@ -98,19 +565,29 @@ class PersistenceManager:
         :type dataframe: pd.DataFrame
         :param filename: name of the file
         :type filename: str
+        :param data_type: folder where data will be saved. The default is
+         PROCESSED
+        :type data_type: DataType
         :return: None
         :rtype: NoneType
         """
-        dataframe.to_pickle(f'data/processed/{filename}')
+        dataframe.to_pickle(f'{data_type.value}{filename}')
 
     @staticmethod
-    def load_from_pickle(filename: str = 'optimized_df.pkl') -> pd.DataFrame:
+    def load_from_pickle(
+            filename: str = 'optimized_df.pkl',
+            data_type: DataType = DataType.PROCESSED
+    ) -> pd.DataFrame:
         """
         Load dataframe from Pickle file
         :param filename: name of the file to search and load
         :type filename: str
+        :param data_type: folder where data is stored. The default is
+         PROCESSED
+        :type data_type: DataType
         :return: dataframe read from pickle
         :rtype: pd.DataFrame
         """
-        dataframe: pd.DataFrame = pd.read_pickle(f'data/processed/{filename}')
+        dataframe: pd.DataFrame = pd.read_pickle(
+            f'{data_type.value}{filename}')
         return dataframe
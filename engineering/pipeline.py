@@ -0,0 +1,517 @@
+"""
+Pipeline stage graph script
+"""
+import hashlib
+import inspect
+import json
+import logging
+import os
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, \
+    wait
+from datetime import datetime
+from types import ModuleType
+from typing import Any, Callable, Optional
+import pandas as pd
+from analysis import SalesCube, cube as cube_module, numerical_eda, \
+    save_segments, segment_table, segmentation, visualize_data
+from core.decorators import StageProfiler
+from engineering import dimension, extraction, optimization, \
+    persistence_manager, transformation, validation, workbook_reader
+from engineering.cache import file_fingerprint, load_cached_frame, \
+    save_cached_frame
+from engineering.dimension import ProductDimension
+from engineering.extraction import load_raw_sheets, load_workbooks, \
+    workbook_paths
+from engineering.optimization import optimize_memory
+from engineering.persistence_manager import DataType, PersistenceManager
+from engineering.transformation import OUTPUT_DTYPES, \
+    PRODUCT_CLEANING_SPEC, clean_columns, feature_engineering, \
+    filter_desired_columns, time_features
+from engineering.validation import Validator, save_quarantine, \
+    sales_validator
+
+logger: logging.Logger = logging.getLogger(__name__)
+Frames = dict[str, pd.DataFrame]
+DEFAULT_OPTIONS: dict[str, Any] = {
+    'filename': 'Base_de_Ventas.xlsx', 'data_type': DataType.RAW,
+    'unmatched': 'keep', 'batch_plots': False, 'refresh_figures': False,
+    'partition_cols': [], 'month_column': 'Fecha_Pedido',
+    'segment_by': None}
+
+
+class Stage:
+    """
+    Named stage of the pipeline. A stage takes the frames of its input
+     stages and the options of the run, and returns its own frames. The
+     saved outputs of a stage are stored under a key derived from the keys
+     of its inputs, the options it reads and the source code it runs, so
+     a rerun loads them until one of those changes. Stages that show
+     figures run on the main thread, since GUI backends require it
+    """
+
+    def __init__(
+            self, name: str, function: Callable[[Frames, dict], Frames],
+            inputs: Optional[list[str]] = None,
+            modules: Optional[list[ModuleType]] = None,
+            options: Optional[list[str]] = None,
+            outputs: Optional[list[str]] = None, main_thread: bool = False
+    ):
+        self.name: str = name
+        self.function: Callable[[Frames, dict], Frames] = function
+        self.inputs: list[str] = inputs or []
+        self.modules: list[ModuleType] = modules or []
+        self.options: list[str] = options or []
+        self.outputs: list[str] = outputs or []
+        self.main_thread: bool = main_thread
+
+    def filename(self, key: str, frame: str) -> str:
+        """
+        Name of the cache entry of a saved output
+        :param key: Key of the stage
+        :type key: str
+        :param frame: Name of the output
+        :type frame: str
+        :return: The name of the entry without extension
+        :rtype: str
+        """
+        return f'{self.name}_{key}_{frame}'
+
+    def code_version(self) -> str:
+        """
+        Hash of the source of the stage function and of the modules it
+         relies on
+        :return: Hexadecimal hash
+        :rtype: str
+        """
+        digest = hashlib.sha256(inspect.getsource(self.function).encode())
+        for module in self.modules:
+            digest.update(inspect.getsource(module).encode())
+        return digest.hexdigest()[:32]
+
+    def key(self, options: dict[str, Any], input_keys: list[str]) -> str:
+        """
+        Key of the frames of the stage
+        :param options: Options of the run
+        :type options: dict[str, Any]
+        :param input_keys: Keys of the input stages
+        :type input_keys: list[str]
+        :return: Hexadecimal key
+        :rtype: str
+        """
+        serialized: str = json.dumps({
+            'stage': self.name, 'code': self.code_version(),
+            'inputs': input_keys,
+            'options': {option: options[option] for option in self.options}},
+            sort_keys=True, default=str)
+        return hashlib.sha256(serialized.encode('utf-8')).hexdigest()[:32]
+
+
+def _extract(_frames: Frames, options: dict[str, Any]) -> Frames:
+    """
+    Load the sales and products sheets of the workbook, or of every
+     workbook when the filename is a directory or glob pattern
+    :param _frames: Frames of the input stages
+    :type _frames: Frames
+    :param options: Options of the run
+    :type options: dict[str, Any]
+    :return: The raw sales and products
+    :rtype: Frames
+    """
+    if workbook_paths(options['filename'], options['data_type']) == [
+            options['filename']]:
+        df_sales, df_products = load_raw_sheets(
+            options['filename'], options['data_type'])
+    else:
+        df_sales, df_products = load_workbooks(
+            options['filename'], options['data_type'])
+    return {'sales': df_sales, 'products': df_products}
+
+
+def _clean(frames: Frames, options: dict[str, Any]) -> Frames:
+    """
+    Clean the product columns and validate the sales against them,
+     keeping the rows that broke a rule apart
+    :param frames: Frames of the input stages
+    :type frames: Frames
+    :param options: Options of the run
+    :type options: dict[str, Any]
+    :return: The valid sales, the clean products and the rows that broke
+     a rule
+    :rtype: Frames
+    """
+    df_products: pd.DataFrame = clean_columns(
+        frames['products'], PRODUCT_CLEANING_SPEC)
+    validator: Validator = sales_validator(options['unmatched'])
+    df_sales, rejected = validator.validate(
+        frames['sales'], ProductDimension(df_products))
+    validator.log_report()
+    return {'sales': df_sales, 'products': df_products,
+            'quarantine': rejected}
+
+
+def _quarantine(frames: Frames, _options: dict[str, Any]) -> Frames:
+    """
+    Save the rows that broke a rule with their reasons
+    :param frames: Frames of the input stages
+    :type frames: Frames
+    :param _options: Options of the run
+    :type _options: dict[str, Any]
+    :return: No frames
+    :rtype: Frames
+    """
+    save_quarantine(frames['quarantine'])
+    return {}
+
+
+def _join(frames: Frames, options: dict[str, Any]) -> Frames:
+    """
+    Join the sales to the product dimension
+    :param frames: Frames of the input stages
+    :type frames: Frames
+    :param options: Options of the run
+    :type options: dict[str, Any]
+    :return: The sales with the product attributes
+    :rtype: Frames
+    """
+    products: ProductDimension = ProductDimension(frames['products'])
+    dataframe: pd.DataFrame = products.join(
+        frames['sales'], unmatched=options['unmatched'])
+    logger.info("Product dimension report: %s", products.report())
+    return {'sales': dataframe}
+
+
+def _features(frames: Frames, _options: dict[str, Any]) -> Frames:
+    """
+    Derive the feature columns
+    :param frames: Frames of the input stages
+    :type frames: Frames
+    :param _options: Options of the run
+    :type _options: dict[str, Any]
+    :return: The sales with the features
+    :rtype: Frames
+    """
+    return {'sales': feature_engineering(frames['sales'])}
+
+
+def _filter(frames: Frames, _options: dict[str, Any]) -> Frames:
+    """
+    Keep the output columns with their fixed dtypes
+    :param frames: Frames of the input stages
+    :type frames: Frames
+    :param _options: Options of the run
+    :type _options: dict[str, Any]
+    :return: The sales ready for analysis and storage
+    :rtype: Frames
+    """
+    dataframe, memory_report = optimize_memory(
+        filter_desired_columns(frames['sales']), dtypes=OUTPUT_DTYPES)
+    logger.info("Memory optimization report:\n%s", memory_report)
+    return {'sales': dataframe}
+
+
+def _time_features(frames: Frames, _options: dict[str, Any]) -> Frames:
+    """
+    Save the lead time, calendar fields and client and SKU activity of
+     each sale as Parquet
+    :param frames: Frames of the input stages
+    :type frames: Frames
+    :param _options: Options of the run
+    :type _options: dict[str, Any]
+    :return: No frames
+    :rtype: Frames
+    """
+    dataframe: pd.DataFrame = time_features(frames['sales'])
+    filepath: str = f'{DataType.PROCESSED.value}time_features.parquet'
+    dataframe.to_parquet(filepath, index=False)
+    logger.info("Time features of %s rows saved to %s", len(dataframe),
+                filepath)
+    return {}
+
+
+def _segments(frames: Frames, options: dict[str, Any]) -> Frames:
+    """
+    Save the RFM segments of the clients and the ABC classes of the SKUs
+     and families
+    :param frames: Frames of the input stages
+    :type frames: Frames
+    :param options: Options of the run
+    :type options: dict[str, Any]
+    :return: No frames
+    :rtype: Frames
+    """
+    save_segments(segment_table(frames['sales'], options['segment_by']))
+    return {}
+
+
+def _eda(frames: Frames, _options: dict[str, Any]) -> Frames:
+    """
+    Exploratory data analysis of the sales
+    :param frames: Frames of the input stages
+    :type frames: Frames
+    :param _options: Options of the run
+    :type _options: dict[str, Any]
+    :return: No frames
+    :rtype: Frames
+    """
+    numerical_eda(frames['sales'])
+    return {}
+
+
+def _visualize(frames: Frames, options: dict[str, Any]) -> Frames:
+    """
+    Render the figures of the sales
+    :param frames: Frames of the input stages
+    :type frames: Frames
+    :param options: Options of the run
+    :type options: dict[str, Any]
+    :return: No frames
+    :rtype: Frames
+    """
+    visualize_data(frames['sales'], options['batch_plots'],
+                   refresh_cache=options['refresh_figures'])
+    return {}
+
+
+def _persist(frames: Frames, options: dict[str, Any]) -> Frames:
+    """
+    Save the sales as CSV, SQLite and Parquet, and their cube
+    :param frames: Frames of the input stages
+    :type frames: Frames
+    :param options: Options of the run
+    :type options: dict[str, Any]
+    :return: No frames
+    :rtype: Frames
+    """
+    dataframe: pd.DataFrame = frames['sales']
+    PersistenceManager.save_to_csv(dataframe)
+    PersistenceManager.save_to_sqlite(dataframe)
+    PersistenceManager.save_to_parquet(
+        dataframe, partition_cols=options['partition_cols'],
+        month_column=options['month_column'])
+    SalesCube(dataframe, options['month_column']).save()
+    return {}
+
+
+STAGES: dict[str, Stage] = {stage.name: stage for stage in [
+    Stage('extract', _extract, modules=[extraction, workbook_reader],
+          options=['filename', 'data_type']),
+    Stage('clean', _clean, ['extract'],
+          [dimension, transformation, validation], ['unmatched'],
+          ['sales', 'products', 'quarantine']),
+    Stage('quarantine', _quarantine, ['clean'], [validation]),
+    Stage('join', _join, ['clean'], [dimension], ['unmatched'], ['sales']),
+    Stage('features', _features, ['join'], [transformation],
+          outputs=['sales']),
+    Stage('filter', _filter, ['features'], [transformation, optimization],
+          outputs=['sales']),
+    Stage('time_features', _time_features, ['filter'], [transformation]),
+    Stage('segments', _segments, ['filter'], [segmentation],
+          ['segment_by']),
+    Stage('eda', _eda, ['filter']),
+    Stage('visualize', _visualize, ['filter'], main_thread=True),
+    Stage('persist', _persist, ['filter'],
+          [persistence_manager, cube_module])]}
+FINAL_STAGES: list[str] = [
+    name for name in STAGES if not any(
+        name in stage.inputs for stage in STAGES.values())]
+
+
+def _stage_keys(stages: list[str], options: dict[str, Any]) -> dict[str, str]:
+    """
+    Keys of the stages, which only depend on the workbooks, the options
+     and the code, so they are known before anything runs
+    :param stages: Stages in topological order
+    :type stages: list[str]
+    :param options: Options of the run
+    :type options: dict[str, Any]
+    :return: Key of each stage
+    :rtype: dict[str, str]
+    """
+    workbooks: list[str] = [
+        file_fingerprint(f'{options["data_type"].value}{filename}')[
+            'sha256'] for filename in workbook_paths(
+            options['filename'], options['data_type'])]
+    keys: dict[str, str] = {}
+    for name in stages:
+        stage: Stage = STAGES[name]
+        input_keys: list[str] = [keys[item] for item in stage.inputs]
+        if not stage.inputs:
+            input_keys = workbooks
+        keys[name] = stage.key(options, input_keys)
+    return keys
+
+
+def _is_saved(stage: Stage, key: str) -> bool:
+    """
+    Whether every output of a stage is saved under its key
+    :param stage: The stage
+    :type stage: Stage
+    :param key: Key of the stage
+    :type key: str
+    :return: True if the outputs can be loaded instead of run
+    :rtype: bool
+    """
+    return bool(stage.outputs) and all(os.path.exists(
+        f'{DataType.STAGES.value}{stage.filename(key, frame)}.parquet')
+        for frame in stage.outputs)
+
+
+def _load_frames(stage: Stage, key: str) -> Frames:
+    """
+    Load the saved outputs of a stage
+    :param stage: The stage
+    :type stage: Stage
+    :param key: Key of the stage
+    :type key: str
+    :return: The frames
+    :rtype: Frames
+    """
+    frames: Frames = {}
+    for frame in stage.outputs:
+        dataframe: Optional[pd.DataFrame] = load_cached_frame(
+            DataType.STAGES.value, stage.filename(key, frame))
+        if dataframe is None:
+            raise ValueError(f'Output {frame} of stage {stage.name} could '
+                             f'not be loaded')
+        frames[frame] = dataframe
+    return frames
+
+
+def _save_frames(stage: Stage, key: str, frames: Frames) -> None:
+    """
+    Save the outputs of a stage, removing the ones of its previous keys
+    :param stage: The stage
+    :type stage: Stage
+    :param key: Key of the stage
+    :type key: str
+    :param frames: The frames returned by the stage
+    :type frames: Frames
+    :return: None
+    :rtype: NoneType
+    """
+    directory: str = DataType.STAGES.value
+    if os.path.isdir(directory):
+        for entry in os.listdir(directory):
+            if entry.startswith(f'{stage.name}_') and \
+                    not entry.startswith(stage.filename(key, '')):
+                os.remove(f'{directory}{entry}')
+    for frame in stage.outputs:
+        save_cached_frame(
+            frames[frame], directory, stage.filename(key, frame), {
+                'stage': stage.name, 'key': key,
+                'created': datetime.now().isoformat(timespec='seconds')})
+
+
+def _plan(
+        targets: list[str], keys: dict[str, str], refresh: bool
+) -> tuple[list[str], list[str]]:
+    """
+    Find the stages to run and the saved stages to load, walking back
+     from the targets until every input is saved and valid
+    :param targets: Stages requested
+    :type targets: list[str]
+    :param keys: Key of each needed stage
+    :type keys: dict[str, str]
+    :param refresh: Whether to run every needed stage again
+    :type refresh: bool
+    :return: Stages to run and stages to load in topological order
+    :rtype: tuple[list[str], list[str]]
+    """
+    demanded: set[str] = set(targets)
+    inputs: set[str] = set()
+    run: list[str] = []
+    load: list[str] = []
+    for name in reversed(list(keys)):
+        if name not in demanded:
+            continue
+        stage: Stage = STAGES[name]
+        if not refresh and _is_saved(stage, keys[name]):
+            if name in inputs:
+                load.insert(0, name)
+            else:
+                logger.info("Stage %s is up to date", name)
+            continue
+        run.insert(0, name)
+        demanded.update(stage.inputs)
+        inputs.update(stage.inputs)
+    return run, load
+
+
+def run_pipeline(
+        targets: Optional[list[str]] = None,
+        options: Optional[dict[str, Any]] = None,
+        profiler: Optional[StageProfiler] = None,
+        workers: Optional[int] = None, refresh: bool = False
+) -> dict[str, str]:
+    """
+    Run the stages requested and the ones they need. Saved frames of the
+     needed stages are loaded when their keys match, so the run resumes
+     from the first stage invalidated by a change of the workbook, the
+     options or the code. Stages whose inputs are ready run concurrently,
+     unless the profiler traces memory
+    :param targets: Stages to run. The default is None (FINAL_STAGES)
+    :type targets: list[str]
+    :param options: Options of the run, see DEFAULT_OPTIONS. The default
+     is None
+    :type options: dict[str, Any]
+    :param profiler: Profiler of the stages. The default is None
+    :type profiler: StageProfiler
+    :param workers: Number of threads for concurrent stages. The default
+     is None (one per stage that can run at the same time)
+    :type workers: int
+    :param refresh: Whether to run every needed stage again instead of
+     loading its saved frames. The default is False
+    :type refresh: bool
+    :return: What was done for each needed stage: 'run', 'loaded' or
+     'up to date'
+    :rtype: dict[str, str]
+    """
+    targets = FINAL_STAGES if targets is None else list(targets)
+    unknown: set[str] = set(targets).difference(STAGES)
+    if unknown:
+        raise ValueError(f'Unknown stages {sorted(unknown)}')
+    options = {**DEFAULT_OPTIONS, **(options or {})}
+    profiler = profiler or StageProfiler()
+    needed: set[str] = set(targets)
+    for name in reversed(list(STAGES)):
+        if name in needed:
+            needed.update(STAGES[name].inputs)
+    keys: dict[str, str] = _stage_keys(
+        [name for name in STAGES if name in needed], options)
+    run, load = _plan(targets, keys, refresh)
+    status: dict[str, str] = {name: 'up to date' for name in keys}
+    frames: dict[str, Frames] = {}
+    for name in load:
+        frames[name] = profiler.run(_load_frames, STAGES[name], keys[name],
+                                    name=f'load_{name}')
+        status[name] = 'loaded'
+    pending: list[str] = list(run)
+    running: dict[Future, str] = {}
+    with ThreadPoolExecutor(workers or max(len(run), 1)) as executor:
+        while pending or running:
+            ready: list[str] = [name for name in pending if all(
+                item in frames for item in STAGES[name].inputs)]
+            for name in sorted(ready, key=lambda item: STAGES[
+                    item].main_thread or profiler.trace_memory):
+                stage_frames: Frames = {
+                    frame: dataframe.copy(deep=False) for item in
+                    STAGES[name].inputs for frame, dataframe in
+                    frames[item].items()}
+                arguments: tuple = (
+                    STAGES[name].function, stage_frames, options)
+                if STAGES[name].main_thread or profiler.trace_memory:
+                    future: Future = Future()
+                    future.set_result(profiler.run(*arguments, name=name))
+                else:
+                    future = executor.submit(profiler.run, *arguments,
+                                             name=name)
+                running[future] = name
+                pending.remove(name)
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                frames[name] = future.result()
+                status[name] = 'run'
+                _save_frames(STAGES[name], keys[name], frames[name])
+    logger.info("Pipeline stages: %s", status)
+    return status
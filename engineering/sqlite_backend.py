@@ -0,0 +1,207 @@
+"""
+SQLite backend script
+"""
+import logging
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Iterator, Optional
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_bool_dtype, is_datetime64_any_dtype, \
+    is_float_dtype, is_integer_dtype
+
+logger: logging.Logger = logging.getLogger(__name__)
+POOL_SIZE: int = 4
+TIMESTAMP_FORMAT: str = '%Y-%m-%d %H:%M:%S'
+OPERATORS: dict[str, str] = {
+    '=': '=', '==': '=', '!=': '!=', '<': '<', '<=': '<=', '>': '>',
+    '>=': '>=', 'in': 'IN', 'not in': 'NOT IN'}
+_pools: dict[str, 'ConnectionPool'] = {}
+_pools_lock: threading.Lock = threading.Lock()
+
+
+class ConnectionPool:
+    """
+    Pool of reusable connections to a SQLite database. Connections are
+     opened on demand up to the size of the pool and returned to it after
+     use
+    """
+
+    def __init__(self, database: str, size: int = POOL_SIZE):
+        self.database: str = database
+        self.size: int = size
+        self.opened: int = 0
+        self.idle: queue.LifoQueue = queue.LifoQueue(maxsize=size)
+        self.lock: threading.Lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Open a connection in WAL mode so readers do not block the writer
+        :return: The new connection
+        :rtype: sqlite3.Connection
+        """
+        connection: sqlite3.Connection = sqlite3.connect(
+            self.database, check_same_thread=False)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """
+        Borrow a connection, waiting for one when every connection is in
+         use
+        :return: Context manager that yields the connection
+        :rtype: Iterator[sqlite3.Connection]
+        """
+        try:
+            connection: sqlite3.Connection = self.idle.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                create: bool = self.opened < self.size
+                self.opened += int(create)
+            connection = self._connect() if create else self.idle.get()
+        try:
+            yield connection
+        finally:
+            if connection.in_transaction:
+                connection.rollback()
+            self.idle.put(connection)
+
+    def close(self) -> None:
+        """
+        Close the idle connections of the pool
+        :return: None
+        :rtype: NoneType
+        """
+        while not self.idle.empty():
+            self.idle.get_nowait().close()
+            self.opened -= 1
+
+
+def get_pool(database: str, size: int = POOL_SIZE) -> ConnectionPool:
+    """
+    Get the shared connection pool of a database
+    :param database: Path of the database file
+    :type database: str
+    :param size: Maximum number of connections of a new pool. The default
+     is POOL_SIZE
+    :type size: int
+    :return: The connection pool
+    :rtype: ConnectionPool
+    """
+    with _pools_lock:
+        if database not in _pools:
+            _pools[database] = ConnectionPool(database, size)
+        return _pools[database]
+
+
+def close_pools() -> None:
+    """
+    Close the idle connections of every pool
+    :return: None
+    :rtype: NoneType
+    """
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+
+
+def quote(identifier: str) -> str:
+    """
+    Quote a table or column name for SQL
+    :param identifier: The name to quote
+    :type identifier: str
+    :return: The quoted name
+    :rtype: str
+    """
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def sql_type(series: pd.Series) -> str:
+    """
+    Declared SQLite type of a column. Dates are stored as sortable text
+     declared as TIMESTAMP so they can be parsed back when loading
+    :param series: The column
+    :type series: pd.Series
+    :return: The declared type
+    :rtype: str
+    """
+    if is_datetime64_any_dtype(series):
+        return 'TIMESTAMP'
+    if is_bool_dtype(series) or is_integer_dtype(series):
+        return 'INTEGER'
+    if is_float_dtype(series):
+        return 'REAL'
+    return 'TEXT'
+
+
+def to_records(dataframe: pd.DataFrame) -> list[tuple]:
+    """
+    Convert the rows of a dataframe to tuples of values SQLite can bind
+    :param dataframe: The rows to convert
+    :type dataframe: pd.DataFrame
+    :return: One tuple per row with None for the missing values
+    :rtype: list[tuple]
+    """
+    columns: dict[str, pd.Series] = {}
+    for column in dataframe.columns:
+        series: pd.Series = dataframe[column]
+        if is_datetime64_any_dtype(series):
+            series = series.dt.strftime(TIMESTAMP_FORMAT)
+        values: np.ndarray = series.to_numpy(dtype=object)
+        values[pd.isna(values)] = None
+        columns[column] = values
+    return list(zip(*columns.values()))
+
+
+def sql_value(value: Any) -> Any:
+    """
+    Convert a filter value to a value SQLite can bind
+    :param value: The value of the filter
+    :type value: Any
+    :return: The value to bind
+    :rtype: Any
+    """
+    if isinstance(value, datetime):
+        return value.strftime(TIMESTAMP_FORMAT)
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def where_clause(
+        filters: Optional[list]
+) -> tuple[str, list[Any]]:
+    """
+    Translate filters like [('ID_Territorio', '=', 3)], or a list of such
+     lists to combine with OR, into a parameterized WHERE clause
+    :param filters: The filters or None
+    :type filters: list
+    :return: The WHERE clause and its parameters
+    :rtype: tuple[str, list[Any]]
+    """
+    if not filters:
+        return '', []
+    groups: list = filters if isinstance(filters[0], list) else [filters]
+    clauses: list[str] = []
+    parameters: list[Any] = []
+    for group in groups:
+        conditions: list[str] = []
+        for column, operator, value in group:
+            if operator not in OPERATORS:
+                raise ValueError(f'Unsupported filter operator {operator}')
+            if operator in ('in', 'not in'):
+                values: list[Any] = [sql_value(item) for item in value]
+                conditions.append(f'{quote(column)} {OPERATORS[operator]} '
+                                  f'({", ".join("?" * len(values))})')
+                parameters.extend(values)
+            else:
+                conditions.append(f'{quote(column)} {OPERATORS[operator]} ?')
+                parameters.append(sql_value(value))
+        clauses.append(f'({" AND ".join(conditions)})')
+    return f' WHERE {" OR ".join(clauses)}', parameters
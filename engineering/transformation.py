@@ -1,62 +1,183 @@
 """
 Transformation script
 """
+import logging
+from typing import Any, Callable, Optional
 import pandas as pd
-from numpy import uint8
+import numpy as np
+from numpy import float64, uint8
+
+logger: logging.Logger = logging.getLogger(__name__)
 
 pd.set_option('display.max_columns', 20)
 pd.set_option('display.max_rows', 101)
 
 
-def remove_product_prefix(value: str) -> str:
+PRODUCT_CLEANING_SPEC: dict[str, dict[str, Any]] = {
+    'Producto': {'strip_prefix': 'Producto ', 'dtype': str},
+    'Familia': {'strip_prefix': 'Familia ', 'dtype': str},
+    'PVP': {'currency': '$', 'dtype': float64}}
+
+OUTPUT_DTYPES: dict[str, str] = {
+    'ID_Cliente': 'category', 'ID_Territorio': 'uint8',
+    'ID_Bodega': 'category', 'ID_SKU': 'category',
+    'Familia_SKU': 'category', 'Cantidad_Facturada': 'float32',
+    'Monto_Facturado $': 'float64', 'Fecha_Pedido': 'datetime64[ns]',
+    'Fecha_Entrega': 'datetime64[ns]'}
+TIME_WINDOWS: dict[str, int] = {'Dia': 1, 'Semana': 7, 'Mes': 30}
+ACTIVITY_KEYS: dict[str, str] = {'ID_Cliente': 'Cliente', 'ID_SKU': 'SKU'}
+
+
+def _as_text(series: pd.Series) -> pd.Series:
+    """
+    Represent the non-null values of the column as strings
+    :param series: The column to represent
+    :type series: pd.Series
+    :return: The column with its values as strings and nulls untouched
+    :rtype: pd.Series
+    """
+    return series.astype(str).where(series.notna())
+
+
+def _broadcast(
+        values: pd.Series, codes: np.ndarray, index: pd.Index,
+        categorical: bool = False
+) -> pd.Series:
     """
-    Removes the 'Producto' prefix
-    :param value: The cell value
-    :type value: str
-    :return: The new product cell value
-    :rtype: str
+    Broadcast the values computed for each distinct key back to the rows
+     through their factorized codes. Code -1 stands for a null key
+    :param values: Values computed for each distinct key
+    :type values: pd.Series
+    :param codes: Factorized code of each row
+    :type codes: np.ndarray
+    :param index: Index of the rows
+    :type index: pd.Index
+    :param categorical: Whether to return a categorical column. The
+     default is False
+    :type categorical: bool
+    :return: The column with one value per row
+    :rtype: pd.Series
     """
-    return value.replace('Producto ', '')
+    values = values.reset_index(drop=True)
+    if categorical:
+        keys: pd.Categorical = pd.Categorical(values)
+        key_codes: np.ndarray = np.append(keys.codes, -1)[codes]
+        return pd.Series(pd.Categorical.from_codes(
+            key_codes, keys.categories), index=index)
+    return values.reindex(codes).set_axis(index)
 
 
-def remove_family_prefix(value: str) -> str:
+def _map_unique(
+        series: pd.Series, function: Callable[[pd.Series], pd.Series]
+) -> pd.Series:
     """
-    Removes the 'Familia ' prefix
-    :param value: The cell value
-    :type value: str
-    :return: The new family cell value
-    :rtype: str
+    Apply a vectorized function only to the distinct values of the column
+     and broadcast the results back through the factorized codes
+    :param series: The column to transform
+    :type series: pd.Series
+    :param function: Vectorized function over a series of distinct values
+    :type function: Callable[[pd.Series], pd.Series]
+    :return: The transformed column with nulls untouched
+    :rtype: pd.Series
     """
-    return value.replace('Familia ', '')
+    codes, uniques = pd.factorize(series)
+    return _broadcast(function(pd.Series(uniques)), codes,
+                      series.index).rename(series.name)
 
 
-def remove_dollar_prefix(value: str) -> str:
+def _strip_prefix(series: pd.Series, prefix: str) -> pd.Series:
     """
-    Removes the '$' prefix
-    :param value: The cell value
-    :type value: str
-    :return: The new pvp cell value
-    :rtype: str
+    Remove the prefix from the text values of the column
+    :param series: The column to clean
+    :type series: pd.Series
+    :param prefix: The prefix to remove
+    :type prefix: str
+    :return: The column without the prefix
+    :rtype: pd.Series
     """
-    return value.replace('$', '')
+    return _as_text(series).str.removeprefix(prefix)
+
+
+def _parse_currency(series: pd.Series, symbol: str) -> pd.Series:
+    """
+    Parse amounts such as '$1,234.5' into numbers
+    :param series: The column to parse
+    :type series: pd.Series
+    :param symbol: The currency symbol to remove
+    :type symbol: str
+    :return: The numeric column, with NaN for invalid amounts
+    :rtype: pd.Series
+    """
+    text: pd.Series = _as_text(series).str.replace(
+        symbol, '', regex=False).str.replace(',', '', regex=False).str.strip()
+    return pd.to_numeric(text, errors='coerce')
+
+
+def clean_columns(
+        dataframe: pd.DataFrame, spec: dict[str, dict[str, Any]]
+) -> pd.DataFrame:
+    """
+    Clean whole columns with vectorized operations from a declarative
+     spec. Each column may define a 'strip_prefix' to remove, a
+     'currency' symbol to parse as number and the 'dtype' to cast to.
+     Text rules run once per distinct value of the column
+    :param dataframe: The dataframe to clean
+    :type dataframe: pd.DataFrame
+    :param spec: Dictionary of columns and their cleaning rules
+    :type spec: dict[str, dict[str, Any]]
+    :return: The cleaned dataframe
+    :rtype: pd.DataFrame
+    """
+    for column, rules in spec.items():
+        series: pd.Series = dataframe[column]
+        if 'strip_prefix' in rules:
+            series = _map_unique(series, lambda values, prefix=rules[
+                'strip_prefix']: _strip_prefix(values, prefix))
+        if 'currency' in rules:
+            nulls: int = int(series.isna().sum())
+            series = _map_unique(series, lambda values, symbol=rules[
+                'currency']: _parse_currency(values, symbol))
+            invalid: int = int(series.isna().sum()) - nulls
+            if invalid:
+                logger.warning("%s values of %s are not valid amounts",
+                               invalid, column)
+        dtype: Any = rules.get('dtype')
+        if dtype is str:
+            series = _map_unique(series, _as_text)
+        elif dtype is not None:
+            series = series.astype(dtype)
+        dataframe[column] = series
+    return dataframe
 
 
 def feature_engineering(dataframe: pd.DataFrame) -> pd.DataFrame:
     """
-    Performs a feature engineering by generating new columns
+    Performs a feature engineering by generating new columns. The
+     composite keys are parsed once per distinct value, so ID_Cliente and
+     ID_Bodega are categoricals and ID_Territorio is uint8. Rows without
+     Cliente - Territorio raise a ValueError
     :param dataframe: The dataframe to transform
     :type dataframe: pd.DataFrame
     :return: The new dataframe
     :rtype: pd.DataFrame
     """
-    dataframe['ID_Cliente'] = dataframe[
-        'Cliente - Territorio'].str.split(' ').str[1]
-    dataframe['ID_Territorio'] = dataframe[
-        'Cliente - Territorio'].str.split(' ').str[-1].astype(uint8)
+    client_codes, clients = pd.factorize(dataframe['Cliente - Territorio'])
+    if (client_codes < 0).any():
+        raise ValueError(
+            f'{int((client_codes < 0).sum())} rows without Cliente - '
+            f'Territorio, their ID_Territorio cannot be derived')
+    client_parts: pd.Series = pd.Series(clients).str.split(' ')
+    dataframe['ID_Cliente'] = _broadcast(
+        client_parts.str[1], client_codes, dataframe.index, True)
+    dataframe['ID_Territorio'] = client_parts.str[-1].astype(
+        uint8).to_numpy()[client_codes]
     dataframe['Monto_Facturado $'] = dataframe[
                                          'Cantidad_Facturada'] * dataframe[
         'PVP']
-    dataframe['ID_Bodega'] = dataframe['Bodega'].str.split('-').str[-1]
+    warehouse_codes, warehouses = pd.factorize(dataframe['Bodega'])
+    dataframe['ID_Bodega'] = _broadcast(
+        pd.Series(warehouses).str.split('-').str[-1], warehouse_codes,
+        dataframe.index, True)
     dataframe = dataframe.rename(columns={
         'SKU': 'ID_SKU',
         'Familia': 'Familia_SKU'})
@@ -75,3 +196,110 @@ def filter_desired_columns(dataframe: pd.DataFrame) -> pd.DataFrame:
         ['ID_Cliente', 'ID_Territorio', 'ID_Bodega', 'ID_SKU', 'Familia_SKU',
          'Cantidad_Facturada', 'Monto_Facturado $', 'Fecha_Pedido',
          'Fecha_Entrega']]
+
+
+def calendar_features(
+        dataframe: pd.DataFrame, date_column: str = 'Fecha_Pedido'
+) -> pd.DataFrame:
+    """
+    Calendar fields of a date column, computed once per distinct date and
+     broadcast to the rows through their factorized codes
+    :param dataframe: The rows with the date column
+    :type dataframe: pd.DataFrame
+    :param date_column: Date column of the fields. The default is
+     'Fecha_Pedido'
+    :type date_column: str
+    :return: Year, quarter, month, ISO week, day of the week and weekend
+     flag of each row
+    :rtype: pd.DataFrame
+    """
+    codes, dates = pd.factorize(dataframe[date_column])
+    if (codes < 0).any():
+        raise ValueError(f'{int((codes < 0).sum())} rows without '
+                         f'{date_column}')
+    days: pd.Series = pd.Series(dates)
+    suffix: str = date_column.split('_')[-1]
+    fields: pd.DataFrame = pd.DataFrame({
+        f'Anio_{suffix}': days.dt.year.astype('uint16'),
+        f'Trimestre_{suffix}': days.dt.quarter.astype(uint8),
+        f'Mes_{suffix}': days.dt.month.astype(uint8),
+        f'Semana_{suffix}': days.dt.isocalendar().week.astype(uint8),
+        f'Dia_Semana_{suffix}': days.dt.dayofweek.astype(uint8),
+        f'Fin_De_Semana_{suffix}': days.dt.dayofweek >= 5})
+    return fields.take(codes).set_axis(dataframe.index)
+
+
+def activity_features(
+        dataframe: pd.DataFrame, key: str, prefix: str,
+        date_column: str = 'Fecha_Pedido',
+        value_column: str = 'Monto_Facturado $',
+        windows: Optional[dict[str, int]] = None
+) -> pd.DataFrame:
+    """
+    Sales and order lines of the key of each row over trailing windows of
+     days that end on the date of the row, and cumulative up to it. The
+     rows are totalled on a grid of key and day sorted by both, so every
+     window is the difference of two prefix sums found with a binary
+     search, without grouping by key
+    :param dataframe: The rows with the key, date and value columns
+    :type dataframe: pd.DataFrame
+    :param key: Column of the entity, such as 'ID_Cliente'
+    :type key: str
+    :param prefix: Prefix of the new columns, such as 'Cliente'
+    :type prefix: str
+    :param date_column: Date column of the windows. The default is
+     'Fecha_Pedido'
+    :type date_column: str
+    :param value_column: Column of the sales. Missing values count as
+     zero. The default is 'Monto_Facturado $'
+    :type value_column: str
+    :param windows: Days of each window by name. The default is None
+     (TIME_WINDOWS)
+    :type windows: dict[str, int]
+    :return: The sales and order lines of each window and cumulative
+    :rtype: pd.DataFrame
+    """
+    key_codes: np.ndarray = pd.factorize(dataframe[key])[0].astype(np.int64)
+    if (key_codes < 0).any():
+        raise ValueError(f'{int((key_codes < 0).sum())} rows without {key}')
+    days: np.ndarray = dataframe[date_column].to_numpy(
+        'datetime64[D]').astype(np.int64)
+    days -= days.min(initial=0)
+    span: int = int(days.max(initial=0)) + 1
+    cells, inverse = np.unique(key_codes * span + days, return_inverse=True)
+    sales: np.ndarray = np.concatenate(([0.0], np.cumsum(np.bincount(
+        inverse, np.nan_to_num(dataframe[value_column].to_numpy(
+            'float64')), len(cells)))))
+    orders: np.ndarray = np.concatenate(([0], np.cumsum(np.bincount(
+        inverse, minlength=len(cells)))))
+    first_day: np.ndarray = cells - cells % span
+    end: np.ndarray = np.arange(1, len(cells) + 1)
+    features: dict[str, np.ndarray] = {}
+    for name, length in {**(windows or TIME_WINDOWS), 'Acum': None}.items():
+        lower: np.ndarray = first_day if length is None else np.maximum(
+            cells - length + 1, first_day)
+        start: np.ndarray = np.searchsorted(cells, lower)
+        features[f'{prefix}_Ventas_{name}'] = (sales[end] - sales[start])[
+            inverse]
+        features[f'{prefix}_Pedidos_{name}'] = (orders[end] - orders[start])[
+            inverse]
+    return pd.DataFrame(features, index=dataframe.index)
+
+
+def time_features(dataframe: pd.DataFrame) -> pd.DataFrame:
+    """
+    Time features of each sale: delivery lead time in days, calendar
+     fields of the order date and the activity of its client and SKU
+    :param dataframe: The rows with the columns of filter_desired_columns
+    :type dataframe: pd.DataFrame
+    :return: The keys and order date of each row with its time features
+    :rtype: pd.DataFrame
+    """
+    lead_time: pd.Series = (dataframe['Fecha_Entrega'] - dataframe[
+        'Fecha_Pedido']).dt.days.rename('Dias_Entrega')
+    return pd.concat([
+        dataframe[list(ACTIVITY_KEYS) + ['Fecha_Pedido']],
+        lead_time.astype('Int16' if lead_time.hasnans else 'int16'),
+        calendar_features(dataframe), *[
+            activity_features(dataframe, key, prefix) for key, prefix in
+            ACTIVITY_KEYS.items()]], axis=1)
@@ -0,0 +1,307 @@
+"""
+Sales validation script
+"""
+import logging
+import os
+from typing import Any, Callable, Optional
+import numpy as np
+import pandas as pd
+from engineering.dimension import ProductDimension
+from engineering.persistence_manager import DataType, PersistenceManager
+
+logger: logging.Logger = logging.getLogger(__name__)
+ACTIONS: list[str] = ['quarantine', 'flag']
+REQUIRED_COLUMNS: list[str] = [
+    'Fecha_Pedido', 'Cliente - Territorio', 'SKU', 'Cantidad_Facturada',
+    'Bodega', 'Fecha_Entrega']
+Check = Callable[[pd.DataFrame, Optional[ProductDimension], np.ndarray],
+                 np.ndarray]
+
+
+class Rule:
+    """
+    Named data quality rule. Its check returns a boolean mask of the rows
+     that break it, computed over whole columns. Rows breaking a
+     'quarantine' rule are removed from the data, rows breaking a 'flag'
+     rule are kept, and both are recorded in the quarantine file
+    """
+
+    def __init__(
+            self, name: str, check: Check, action: str = 'quarantine',
+            products: bool = False
+    ):
+        if action not in ACTIONS:
+            raise ValueError(f'action must be one of {ACTIONS}')
+        self.name: str = name
+        self.check: Check = check
+        self.action: str = action
+        self.products: bool = products
+
+
+def _missing(column: str) -> Check:
+    """
+    Check of the rows without a value in a column
+    :param column: The required column
+    :type column: str
+    :return: The check
+    :rtype: Check
+    """
+    return lambda dataframe, _products, _codes: dataframe[
+        column].isna().to_numpy()
+
+
+def _delivery_before_order(
+        dataframe: pd.DataFrame, _products: Optional[ProductDimension],
+        _codes: np.ndarray
+) -> np.ndarray:
+    """
+    Rows delivered before they were ordered
+    :param dataframe: The rows to validate
+    :type dataframe: pd.DataFrame
+    :param _products: The product dimension or None
+    :type _products: ProductDimension
+    :param _codes: Code of the product of each row
+    :type _codes: np.ndarray
+    :return: True for the rows breaking the rule
+    :rtype: np.ndarray
+    """
+    return (dataframe['Fecha_Entrega'] < dataframe[
+        'Fecha_Pedido']).to_numpy()
+
+
+def _non_positive_quantity(
+        dataframe: pd.DataFrame, _products: Optional[ProductDimension],
+        _codes: np.ndarray
+) -> np.ndarray:
+    """
+    Rows with a zero or negative invoiced quantity
+    :param dataframe: The rows to validate
+    :type dataframe: pd.DataFrame
+    :param _products: The product dimension or None
+    :type _products: ProductDimension
+    :param _codes: Code of the product of each row
+    :type _codes: np.ndarray
+    :return: True for the rows breaking the rule
+    :rtype: np.ndarray
+    """
+    return (dataframe['Cantidad_Facturada'] <= 0).to_numpy()
+
+
+def _unknown_sku(
+        dataframe: pd.DataFrame, _products: Optional[ProductDimension],
+        codes: np.ndarray
+) -> np.ndarray:
+    """
+    Rows whose SKU is not in the product dimension
+    :param dataframe: The rows to validate
+    :type dataframe: pd.DataFrame
+    :param _products: The product dimension or None
+    :type _products: ProductDimension
+    :param codes: Code of the product of each row
+    :type codes: np.ndarray
+    :return: True for the rows breaking the rule
+    :rtype: np.ndarray
+    """
+    return (codes < 0) & dataframe['SKU'].notna().to_numpy()
+
+
+def _invalid_pvp(
+        _dataframe: pd.DataFrame, products: Optional[ProductDimension],
+        codes: np.ndarray
+) -> np.ndarray:
+    """
+    Rows of a known product without a valid PVP
+    :param _dataframe: The rows to validate
+    :type _dataframe: pd.DataFrame
+    :param products: The product dimension or None
+    :type products: ProductDimension
+    :param codes: Code of the product of each row
+    :type codes: np.ndarray
+    :return: True for the rows breaking the rule
+    :rtype: np.ndarray
+    """
+    prices: np.ndarray = products.attributes['PVP'].astype('float64')
+    return (codes >= 0) & np.isnan(prices[np.maximum(codes, 0)])
+
+
+SALES_RULES: list[Rule] = [
+    *[Rule(f'missing_{column}', _missing(column)) for column in
+      REQUIRED_COLUMNS],
+    Rule('delivery_before_order', _delivery_before_order),
+    Rule('non_positive_quantity', _non_positive_quantity, 'flag'),
+    Rule('unknown_sku', _unknown_sku, 'flag', True),
+    Rule('invalid_pvp', _invalid_pvp, 'flag', True)]
+
+
+def _reasons(failures: np.ndarray, names: list[str]) -> np.ndarray:
+    """
+    Names of the broken rules of each row, built once per distinct
+     combination of broken rules
+    :param failures: Boolean matrix with a row per record and a column
+     per rule
+    :type failures: np.ndarray
+    :param names: Name of each rule
+    :type names: list[str]
+    :return: The rules broken by each row separated by '; '
+    :rtype: np.ndarray
+    """
+    weights: np.ndarray = np.left_shift(1, np.arange(len(names),
+                                                     dtype=np.int64))
+    combinations, inverse = np.unique(
+        failures.astype(np.int64) @ weights, return_inverse=True)
+    labels: list[str] = ['; '.join(
+        name for bit, name in enumerate(names) if combination >> bit & 1)
+        for combination in combinations.tolist()]
+    return np.array(labels, dtype=object)[inverse]
+
+
+class Validator:
+    """
+    Validator of every rule of a rule set in a single pass. The masks of
+     the rules form one boolean matrix, so the rows to quarantine, the
+     rows to flag and their reasons come from the same evaluation. The
+     number of rows breaking each rule is accumulated across calls, so
+     the chunks of a stream share one report
+    """
+
+    def __init__(
+            self, rules: Optional[list[Rule]] = None,
+            actions: Optional[dict[str, str]] = None, on: str = 'SKU'
+    ):
+        self.rules: list[Rule] = [
+            Rule(rule.name, rule.check, (actions or {}).get(
+                rule.name, rule.action), rule.products)
+            for rule in (SALES_RULES if rules is None else rules)]
+        self.on: str = on
+        self.rows: int = 0
+        self.quarantined: int = 0
+        self.flagged: int = 0
+        self.failures: dict[str, int] = {rule.name: 0 for rule in self.rules}
+
+    def validate(
+            self, dataframe: pd.DataFrame,
+            products: Optional[ProductDimension] = None
+    ) -> tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        Evaluate the rules on the rows of a dataframe. Rules on the
+         products are skipped without a product dimension
+        :param dataframe: The rows to validate
+        :type dataframe: pd.DataFrame
+        :param products: Product dimension of the SKUs. The default is None
+        :type products: ProductDimension
+        :return: The rows without the quarantined ones, and the rows that
+         broke any rule with their reasons and whether they were
+         quarantined
+        :rtype: tuple[pd.DataFrame, pd.DataFrame]
+        """
+        rules: list[Rule] = [rule for rule in self.rules if
+                             products is not None or not rule.products]
+        codes: np.ndarray = products.codes(dataframe[self.on]) if \
+            products is not None else np.zeros(len(dataframe), np.intp)
+        failures: np.ndarray = np.zeros((len(dataframe), len(rules)), bool)
+        for position, rule in enumerate(rules):
+            failures[:, position] = rule.check(dataframe, products, codes)
+        failing: np.ndarray = failures.any(axis=1)
+        quarantined: np.ndarray = failures[:, [
+            rule.action == 'quarantine' for rule in rules]].any(axis=1)
+        for rule, count in zip(rules, failures.sum(axis=0).tolist()):
+            self.failures[rule.name] += count
+        self.rows += len(dataframe)
+        self.quarantined += int(quarantined.sum())
+        self.flagged += int(failing.sum() - quarantined.sum())
+        rejected: pd.DataFrame = dataframe.take(np.flatnonzero(failing))
+        rejected['reasons'] = _reasons(
+            failures[failing], [rule.name for rule in rules])
+        rejected['quarantined'] = quarantined[failing]
+        if quarantined.any():
+            dataframe = dataframe.take(np.flatnonzero(~quarantined))
+        return dataframe, rejected
+
+    def report(self) -> dict[str, Any]:
+        """
+        Report of the rows validated so far
+        :return: Rows validated, quarantined and flagged, and the rows
+         breaking each rule
+        :rtype: dict[str, Any]
+        """
+        return {'rows': self.rows, 'quarantined': self.quarantined,
+                'flagged': self.flagged, 'failures': {
+                    name: count for name, count in self.failures.items()
+                    if count}}
+
+    def log_report(self) -> None:
+        """
+        Log the report, as a warning if any row broke a rule
+        :return: None
+        :rtype: NoneType
+        """
+        report: dict[str, Any] = self.report()
+        logger.log(logging.WARNING if report['failures'] else logging.INFO,
+                   "Validation report: %s", report)
+
+
+def sales_validator(unmatched: str = 'keep') -> Validator:
+    """
+    Validator of the sales with the SALES_RULES
+    :param unmatched: What to do with sales whose SKU is not a product.
+     'drop' quarantines them, otherwise they are flagged and left to the
+     join. The default is 'keep'
+    :type unmatched: str
+    :return: The validator
+    :rtype: Validator
+    """
+    return Validator(actions={
+        'unknown_sku': 'quarantine' if unmatched == 'drop' else 'flag'})
+
+
+def save_quarantine(
+        rejected: pd.DataFrame, filename: str = 'sales',
+        append: bool = False
+) -> str:
+    """
+    Save the rows that broke a rule with their reasons as CSV
+    :param rejected: The rows returned by Validator.validate
+    :type rejected: pd.DataFrame
+    :param filename: Name of the file without extension. The default is
+     'sales'
+    :type filename: str
+    :param append: Whether to append the rows to an existing file. The
+     default is False
+    :type append: bool
+    :return: Path of the quarantine file
+    :rtype: str
+    """
+    os.makedirs(DataType.QUARANTINE.value, exist_ok=True)
+    PersistenceManager.save_to_csv(
+        rejected, DataType.QUARANTINE, filename, append)
+    filepath: str = f'{DataType.QUARANTINE.value}{filename}.csv'
+    if len(rejected):
+        logger.info("%s rows that broke a rule saved to %s", len(rejected),
+                    filepath)
+    return filepath
+
+
+def validate_sales(
+        df_sales: pd.DataFrame, products: ProductDimension,
+        unmatched: str = 'keep', filename: str = 'sales'
+) -> pd.DataFrame:
+    """
+    Validate the sales, save the rows that broke a rule to the quarantine
+     file and log the report
+    :param df_sales: The raw sales with renamed columns
+    :type df_sales: pd.DataFrame
+    :param products: The product dimension
+    :type products: ProductDimension
+    :param unmatched: What to do with sales whose SKU is not a product:
+     'keep', 'drop' or 'raise'. The default is 'keep'
+    :type unmatched: str
+    :param filename: Name of the quarantine file. The default is 'sales'
+    :type filename: str
+    :return: The sales without the quarantined rows
+    :rtype: pd.DataFrame
+    """
+    validator: Validator = sales_validator(unmatched)
+    df_sales, rejected = validator.validate(df_sales, products)
+    save_quarantine(rejected, filename)
+    validator.log_report()
+    return df_sales
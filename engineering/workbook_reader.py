@@ -0,0 +1,135 @@
+"""
+Workbook reader script
+"""
+import logging
+from itertools import islice
+from typing import Any, Iterator, Optional
+import pandas as pd
+from openpyxl import load_workbook
+from openpyxl.workbook import Workbook
+from core.config import CHUNK_SIZE, NUMERICS
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+def apply_dtypes(
+        dataframe: pd.DataFrame, dtypes: Optional[dict] = None
+) -> pd.DataFrame:
+    """
+    Cast the columns of the dataframe to the given datatypes
+    :param dataframe: Dataframe to cast
+    :type dataframe: pd.DataFrame
+    :param dtypes: Dictionary of columns and datatypes
+    :type dtypes: dict
+    :return: The typed dataframe
+    :rtype: pd.DataFrame
+    """
+    if not dtypes:
+        return dataframe
+    for key, value in dtypes.items():
+        if value in NUMERICS:
+            dataframe[key] = pd.to_numeric(dataframe[key], errors='coerce')
+            dataframe[key] = dataframe[key].astype(value)
+        elif value is str:
+            dataframe[key] = dataframe[key].astype(value).where(
+                dataframe[key].notna())
+        else:
+            dataframe[key] = dataframe[key].astype(value)
+    return dataframe
+
+
+class WorkbookReader:
+    """
+    Read-only streaming reader that opens an XLSX workbook once and serves
+     its sheets as typed dataframe chunks
+    """
+
+    def __init__(self, filepath: str):
+        self.filepath: str = filepath
+        self.workbook: Workbook = load_workbook(
+            filepath, read_only=True, data_only=True)
+
+    def __enter__(self) -> 'WorkbookReader':
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Close the underlying workbook archive
+        :return: None
+        :rtype: NoneType
+        """
+        self.workbook.close()
+
+    def iter_chunks(
+            self, sheet_name: str, chunk_size: int = CHUNK_SIZE,
+            dtypes: Optional[dict] = None, converter: Optional[dict] = None,
+            parse_dates: Optional[list[str]] = None
+    ) -> Iterator[pd.DataFrame]:
+        """
+        Stream a sheet as typed dataframes of at most chunk_size rows
+        :param sheet_name: Name of the sheet to read
+        :type sheet_name: str
+        :param chunk_size: Number of rows per chunk. The default is
+         CHUNK_SIZE
+        :type chunk_size: int
+        :param dtypes: Dictionary of columns and datatypes
+        :type dtypes: dict
+        :param converter: Dictionary with converter functions
+        :type converter: dict
+        :param parse_dates: List of date columns to parse
+        :type parse_dates: list[str]
+        :return: Generator of dataframe chunks
+        :rtype: Iterator[pd.DataFrame]
+        """
+        rows: Iterator[tuple] = self.workbook[sheet_name].iter_rows(
+            values_only=True)
+        header: Optional[tuple] = next(rows, None)
+        if header is None:
+            return
+        columns: list[str] = [str(column) for column in header]
+        chunk_size = int(chunk_size)
+        while True:
+            batch: list[tuple] = list(islice(rows, chunk_size))
+            if not batch:
+                break
+            records: list[tuple] = [
+                row for row in batch if any(
+                    value is not None for value in row)]
+            if not records:
+                continue
+            chunk: pd.DataFrame = pd.DataFrame(
+                records, columns=columns, dtype=object)
+            for key, function in (converter or {}).items():
+                chunk[key] = chunk[key].map(function, na_action='ignore')
+            for key in parse_dates or []:
+                chunk[key] = pd.to_datetime(chunk[key])
+            yield apply_dtypes(chunk, dtypes).infer_objects()
+
+    def read_sheet(
+            self, sheet_name: str, dtypes: Optional[dict] = None,
+            converter: Optional[dict] = None,
+            parse_dates: Optional[list[str]] = None
+    ) -> pd.DataFrame:
+        """
+        Read a whole sheet by concatenating its chunks
+        :param sheet_name: Name of the sheet to read
+        :type sheet_name: str
+        :param dtypes: Dictionary of columns and datatypes
+        :type dtypes: dict
+        :param converter: Dictionary with converter functions
+        :type converter: dict
+        :param parse_dates: List of date columns to parse
+        :type parse_dates: list[str]
+        :return: The typed dataframe of the sheet
+        :rtype: pd.DataFrame
+        """
+        chunks: list[pd.DataFrame] = list(self.iter_chunks(
+            sheet_name, dtypes=dtypes, converter=converter,
+            parse_dates=parse_dates))
+        logger.info("Read %s chunks from sheet %s", len(chunks), sheet_name)
+        if not chunks:
+            return pd.DataFrame()
+        return pd.concat(chunks, ignore_index=True)
@@ -1,35 +1,234 @@
 """
 Main script
 """
+import argparse
 import logging
+from datetime import datetime
+from typing import Iterator, Optional
 import pandas as pd
-from analysis import numerical_eda, visualize_data
+from analysis import CONTINUOUS_COLUMNS, PLOT_FREQUENCIES, SalesCube, \
+    SummaryAccumulator, summarize_eda, visualize_summary
 from core import logging_config
-from engineering.extraction import extract_raw_data
-from engineering.persistence_manager import PersistenceManager
-from engineering.transformation import feature_engineering, \
-    filter_desired_columns
+from core.decorators import StageProfiler
+from engineering.extraction import iter_raw_data
+from engineering.incremental import ingest_incremental
+from engineering.optimization import optimize_memory
+from engineering.persistence_manager import DataType, PersistenceManager
+from engineering.pipeline import DEFAULT_OPTIONS, FINAL_STAGES, STAGES, \
+    run_pipeline
+from engineering.transformation import OUTPUT_DTYPES, \
+    feature_engineering, filter_desired_columns
 
-logging_config.setup_logging()
 logger: logging.Logger = logging.getLogger(__name__)
+PARTITION_COLUMNS: list[str] = []
+MONTH_COLUMN: str = 'Fecha_Pedido'
 
 
-def main() -> None:
+def _transform_chunks(
+        accumulator: Optional[SummaryAccumulator], cube: SalesCube,
+        profiler: StageProfiler
+) -> Iterator[pd.DataFrame]:
+    """
+    Transform the chunks of the workbook, accumulating their statistics
+     and cells and appending them to the CSV and SQLite outputs
+    :param accumulator: Accumulator of the statistics of the chunks or
+     None if no statistics are needed
+    :type accumulator: SummaryAccumulator
+    :param cube: Sales cube to update with the chunks
+    :type cube: SalesCube
+    :param profiler: Profiler of the stages of the run
+    :type profiler: StageProfiler
+    :return: Generator of the transformed chunks
+    :rtype: Iterator[pd.DataFrame]
+    """
+    for index, chunk in enumerate(profiler.iterate(
+            iter_raw_data(), 'iter_raw_data')):
+        chunk = profiler.run(feature_engineering, chunk)
+        chunk = profiler.run(filter_desired_columns, chunk)
+        chunk, _ = profiler.run(optimize_memory, chunk, dtypes=OUTPUT_DTYPES)
+        if accumulator is not None:
+            profiler.run(accumulator.update, chunk, name='summarize_chunk')
+        profiler.run(cube.update, chunk, name='update_cube')
+        profiler.run(PersistenceManager.save_to_csv, chunk,
+                     append=index > 0)
+        profiler.run(PersistenceManager.save_to_sqlite, chunk,
+                     append=index > 0)
+        yield chunk
+
+
+def run_streaming(
+        batch_plots: bool = False, refresh_figures: bool = False,
+        profiler: Optional[StageProfiler] = None, eda: bool = True,
+        plots: bool = True
+) -> None:
+    """
+    Run the pipeline over bounded-size chunks, keeping only mergeable
+     summaries in memory for the EDA and the figures
+    :param batch_plots: Whether to render the figures headless over a
+     process pool. The default is False
+    :type batch_plots: bool
+    :param refresh_figures: Whether to render the figures even if they are
+     unchanged. The default is False
+    :type refresh_figures: bool
+    :param profiler: Profiler of the stages of the run. The default is
+     None (a profiler that is not saved)
+    :type profiler: StageProfiler
+    :param eda: Whether to run the EDA. The default is True
+    :type eda: bool
+    :param plots: Whether to render the figures. The default is True
+    :type plots: bool
+    :return: None
+    :rtype: NoneType
+    """
+    profiler = profiler or StageProfiler()
+    accumulator: Optional[SummaryAccumulator] = SummaryAccumulator(
+        PLOT_FREQUENCIES, CONTINUOUS_COLUMNS) if eda or plots else None
+    cube: SalesCube = SalesCube(month_column=MONTH_COLUMN)
+    profiler.run(
+        PersistenceManager.save_to_parquet,
+        _transform_chunks(accumulator, cube, profiler),
+        partition_cols=PARTITION_COLUMNS, month_column=MONTH_COLUMN)
+    profiler.run(cube.save, name='save_cube')
+    if eda:
+        profiler.run(summarize_eda, accumulator)
+    if plots:
+        profiler.run(visualize_summary, accumulator, batch_plots,
+                     refresh_cache=refresh_figures)
+
+
+def main(
+        streaming: bool = False, batch_plots: bool = False,
+        refresh_figures: bool = False, incremental: bool = False,
+        cprofile_stages: Optional[list[str]] = None,
+        trace_memory: bool = False, eda: bool = True, plots: bool = True,
+        stages: Optional[list[str]] = None, refresh_stages: bool = False,
+        workbooks: Optional[str] = None, segment_by: Optional[str] = None
+) -> None:
     """
     Main function to execute
+    :param streaming: Whether to process the data in chunks. The default
+     is False
+    :type streaming: bool
+    :param batch_plots: Whether to render the figures headless over a
+     process pool. The default is False
+    :type batch_plots: bool
+    :param refresh_figures: Whether to render the figures even if they are
+     unchanged. The default is False
+    :type refresh_figures: bool
+    :param incremental: Whether to only ingest the new or changed sales
+     into the partitioned store. The default is False
+    :type incremental: bool
+    :param cprofile_stages: Stages to capture with cProfile. The default
+     is None
+    :type cprofile_stages: list[str]
+    :param trace_memory: Whether to trace the peak memory of the stages.
+     The default is False
+    :type trace_memory: bool
+    :param eda: Whether to run the EDA. The default is True
+    :type eda: bool
+    :param plots: Whether to render the figures, without importing
+     matplotlib or seaborn when False. The default is True
+    :type plots: bool
+    :param stages: Stages of the pipeline to run with the ones they need.
+     The default is None (FINAL_STAGES)
+    :type stages: list[str]
+    :param refresh_stages: Whether to run the needed stages again instead
+     of loading their saved frames. The default is False
+    :type refresh_stages: bool
+    :param workbooks: Directory or glob pattern of the workbooks in the
+     raw folder to ingest together. The default is None (the
+     Base_de_Ventas workbook)
+    :type workbooks: str
+    :param segment_by: Column to compute the segments of each partition
+     apart, such as 'ID_Territorio'. The default is None
+    :type segment_by: str
     :return: None
     :rtype: NoneType
     """
     logger.info("Running main method")
-    dataframe: pd.Dataframe = extract_raw_data()
-    dataframe = feature_engineering(dataframe)
-    dataframe = filter_desired_columns(dataframe)
-    dataframe = numerical_eda(dataframe)
-    visualize_data(dataframe)
-    PersistenceManager.save_to_csv(dataframe)
+    profiler: StageProfiler = StageProfiler(cprofile_stages, trace_memory)
+    try:
+        if incremental:
+            profiler.run(ingest_incremental, partition_cols=PARTITION_COLUMNS,
+                         month_column=MONTH_COLUMN)
+            return
+        if streaming:
+            run_streaming(batch_plots, refresh_figures, profiler, eda,
+                          plots)
+            return
+        skipped: list[str] = [stage for stage, enabled in [
+            ('eda', eda), ('visualize', plots)] if not enabled]
+        run_pipeline(
+            [stage for stage in stages or FINAL_STAGES if
+             stage not in skipped], {
+                'filename': workbooks or DEFAULT_OPTIONS['filename'],
+                'batch_plots': batch_plots,
+                'refresh_figures': refresh_figures,
+                'partition_cols': PARTITION_COLUMNS,
+                'month_column': MONTH_COLUMN,
+                'segment_by': segment_by}, profiler,
+            refresh=refresh_stages)
+    finally:
+        profiler.save(f'{DataType.PROFILES.value}'
+                      f'{datetime.now().strftime("run_%Y%m%d_%H%M%S")}.json')
 
 
 if __name__ == '__main__':
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        description='Ventas facturas pipeline')
+    parser.add_argument(
+        '--streaming', action='store_true',
+        help='process the workbook in chunks of CHUNK_SIZE rows')
+    parser.add_argument(
+        '--batch-plots', action='store_true',
+        help='render the figures headless over a process pool')
+    parser.add_argument(
+        '--refresh-figures', action='store_true',
+        help='render every figure even if its data did not change')
+    parser.add_argument(
+        '--incremental', action='store_true',
+        help='only ingest the sales added or changed since the last run')
+    parser.add_argument(
+        '--cprofile', nargs='+', default=[], metavar='STAGE',
+        help='capture these stages with cProfile in the run profile')
+    parser.add_argument(
+        '--trace-memory', action='store_true',
+        help='trace the peak memory of each stage, which is several times '
+             'slower')
+    parser.add_argument(
+        '--no-eda', action='store_true',
+        help='skip the exploratory data analysis')
+    parser.add_argument(
+        '--no-plots', action='store_true',
+        help='skip the figures without importing matplotlib or seaborn')
+    parser.add_argument(
+        '--stages', nargs='+', choices=list(STAGES), metavar='STAGE',
+        help=f'stages to run with the ones they need, from '
+             f'{", ".join(STAGES)}')
+    parser.add_argument(
+        '--refresh-stages', action='store_true',
+        help='run the needed stages again instead of loading their frames')
+    parser.add_argument(
+        '--workbooks', metavar='PATTERN',
+        help='directory or glob pattern of the workbooks in data/raw/ to '
+             'parse in parallel and ingest together')
+    parser.add_argument(
+        '--segment-by', choices=['ID_Territorio'],
+        help='compute the RFM and ABC segments of each partition apart')
+    parser.add_argument(
+        '--log-json', action='store_true',
+        help='write the log file as JSON lines')
+    parser.add_argument(
+        '--log-rotation', choices=logging_config.ROTATIONS,
+        help='rotate a single log file by size or daily instead of writing '
+             'one per run')
+    arguments: argparse.Namespace = parser.parse_args()
+    logging_config.setup_logging(json_lines=arguments.log_json,
+                                 rotation=arguments.log_rotation)
     logger.info("First log message")
-    main()
+    main(arguments.streaming, arguments.batch_plots,
+         arguments.refresh_figures, arguments.incremental,
+         arguments.cprofile, arguments.trace_memory, not arguments.no_eda,
+         not arguments.no_plots, arguments.stages, arguments.refresh_stages,
+         arguments.workbooks, arguments.segment_by)
     logger.info("End of the program execution")